@@ -46,6 +46,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',  # Búsqueda full-text y trigramas (core.services.busqueda)
     'core'
 ]
 
@@ -97,6 +98,27 @@ if os.environ.get('DATABASE_URL'):
     DATABASES['default']['OPTIONS'] = {'sslmode': 'require'}
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# 'default' es local por proceso. Con REDIS_URL se agrega 'compartido', que usa
+# el catálogo (core.services.catalogo) como segundo nivel entre procesos.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+if os.environ.get('REDIS_URL'):
+    CACHES['compartido'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+        'KEY_PREFIX': 'jhomil',
+    }
+
+CATALOGO_CACHE = 'compartido' if 'compartido' in CACHES else None
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -0,0 +1,666 @@
+"""
+Escenarios del comando ``benchmark``.
+
+Cada escenario crea sus datos sintéticos con ``bulk_create`` y mide los
+servicios de core contra la alternativa ingenua que reemplazan. El comando
+corre todo dentro de una transacción que se revierte al final, así que se
+puede apuntar a una copia de la base de producción sin dejar rastros.
+
+Un escenario recibe ``(escribir, tamano, repeticiones)``: ``tamano`` es el
+volumen principal (None = el del pedido original) y ``escribir`` imprime una
+línea de resultados.
+
+Los escenarios con hilos (``escenario_concurrente``) no pueden correr dentro
+de esa transacción: cada hilo abre su conexión y solo ve datos confirmados.
+Esos escenarios confirman sus datos y los borran ellos mismos al terminar.
+"""
+import random
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import DecimalField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from core.models import (
+    Carrito, CarritoItem, Categoria, Ciudad, EmpresaEnvio, ExportJob, Lote, Marca, MovimientoInventario,
+    MovimientoResumenDiario, Pedido, PedidoItem, Producto, ProductoVariante, Promocion, PromocionProducto, Region,
+    Rol, StockVariante, TarifaEnvio, Usuario,
+)
+from core.services import accesos, analitica, busqueda, categorias, envios, lotes, promociones
+from core.services.checkout import confirmar_carrito
+from core.services.exportacion import ejecutar_exportacion
+from core.services.stock import StockInsuficiente, registrar_movimientos
+
+ESCENARIOS = {}
+
+
+def escenario(funcion):
+    ESCENARIOS[funcion.__name__] = funcion
+    return funcion
+
+
+def escenario_concurrente(funcion):
+    funcion.concurrente = True
+    return escenario(funcion)
+
+
+# -----------------------------
+# Utilidades
+# -----------------------------
+def medir(funcion, repeticiones):
+    """Tiempos en milisegundos de ``repeticiones`` llamadas."""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return tiempos
+
+
+def percentil(tiempos, p):
+    ordenados = sorted(tiempos)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+
+def resumen(tiempos):
+    return (
+        f"p50 {percentil(tiempos, 50):.3f} ms  p99 {percentil(tiempos, 99):.3f} ms  "
+        f"media {statistics.fmean(tiempos):.3f} ms"
+    )
+
+
+def consultas(funcion):
+    """Cantidad de consultas SQL que hace ``funcion()``."""
+    with CaptureQueriesContext(connection) as capturadas:
+        funcion()
+    return len(capturadas)
+
+
+def crear_catalogo(productos, variantes_por_producto=5, categorias=20):
+    """Usuario, categorías, una marca y el catálogo; devuelve (usuario, productos, variantes)."""
+    sufijo = time.time_ns()
+    rol, _ = Rol.objects.get_or_create(nombre='cliente')
+    usuario = Usuario.objects.create(rol=rol, email=f'benchmark-{sufijo}@example.com', nombre='Bench')
+    lista_categorias = Categoria.objects.bulk_create([
+        Categoria(nombre=f'Categoría {i}', slug=f'bench-{sufijo}-{i}') for i in range(categorias)
+    ])
+    marca = Marca.objects.create(nombre=f'Marca {sufijo}')
+    lista_productos = Producto.objects.bulk_create(
+        [
+            Producto(
+                categoria=lista_categorias[i % categorias], marca=marca, nombre=f'Producto {i}',
+                sku_base=f'B{sufijo}-{i}', precio_base=Decimal(10 + i % 90),
+                peso_kg=Decimal(random.randint(100, 20000)) / 1000,
+            )
+            for i in range(productos)
+        ],
+        batch_size=1000,
+    )
+    lista_variantes = ProductoVariante.objects.bulk_create(
+        [
+            ProductoVariante(producto=producto, sku=f'{producto.sku_base}-{j}', precio=producto.precio_base)
+            for producto in lista_productos
+            for j in range(variantes_por_producto)
+        ],
+        batch_size=1000,
+    )
+    return usuario, lista_productos, lista_variantes
+
+
+# -----------------------------
+# Escenarios
+# -----------------------------
+@escenario
+def promociones_carrito(escribir, tamano, repeticiones):
+    """Evaluar carritos de 1 a 500 líneas contra 10.000 promociones activas (--tamano)."""
+    tamano = tamano or 10000
+    _, productos, variantes = crear_catalogo(2000)
+    ahora = timezone.now()
+    tipos = ['porcentaje', 'monto_fijo', 'x_por_y']
+    lista = Promocion.objects.bulk_create(
+        [
+            Promocion(
+                nombre=f'Promo {i}', tipo_descuento=tipos[i % 3],
+                valor_descuento=Decimal(5 + i % 20) if i % 3 else Decimal('0.50'),
+                fecha_inicio=ahora, min_compra=Decimal(50) if i % 7 == 0 else None,
+                codigo=f'CUPON{i}' if i % 50 == 0 else None,
+            )
+            for i in range(tamano)
+        ],
+        batch_size=1000,
+    )
+    PromocionProducto.objects.bulk_create(
+        [
+            PromocionProducto(
+                promocion=promocion,
+                variante=random.choice(variantes) if i % 2 else None,
+                producto=None if i % 2 else random.choice(productos),
+                cantidad_requerida=2, cantidad_gratis=1,
+            )
+            for i, promocion in enumerate(lista)
+            if i % 50  # los cupones quedan como globales
+        ],
+        batch_size=1000,
+    )
+
+    inicio = time.perf_counter()
+    indice = promociones.compilar()
+    escribir(f"compilar {tamano} promociones: {(time.perf_counter() - inicio) * 1000:.1f} ms")
+
+    for lineas in (1, 10, 100, 500):
+        carrito = [
+            promociones.LineaPromocion(i, variante.pk, variante.producto_id, random.randint(1, 4), variante.precio)
+            for i, variante in enumerate(random.sample(variantes, lineas))
+        ]
+        consultas_indice = consultas(lambda: indice.evaluar(carrito, cupon='CUPON0'))
+        indexado = medir(lambda: indice.evaluar(carrito, cupon='CUPON0'), repeticiones)
+        # Sin índice: cada recálculo vuelve a leer promociones y objetivos
+        ingenuo = medir(lambda: promociones.compilar().evaluar(carrito, cupon='CUPON0'), max(3, repeticiones // 20))
+        escribir(f"{lineas:>4} líneas  índice: {resumen(indexado)} ({consultas_indice} consultas)")
+        escribir(f"{lineas:>4} líneas  releyendo: {resumen(ingenuo)}")
+
+
+@escenario
+def checkout(escribir, tamano, repeticiones):
+    """Latencia de confirmar_carrito (p50/p99) para carritos de 1, 10 y 50 líneas."""
+    tamano = tamano or 1000
+    usuario, productos, variantes = crear_catalogo(max(tamano // 5, 10))
+    promocion = Promocion.objects.create(nombre='10%', tipo_descuento='porcentaje', valor_descuento=10)
+    PromocionProducto.objects.bulk_create([PromocionProducto(promocion=promocion, producto=p) for p in productos[::3]])
+    registrar_movimientos([
+        MovimientoInventario(variante=variante, tipo='entrada', cantidad=1000000) for variante in variantes
+    ])
+    promociones.invalidar_local()
+    promociones.obtener_indice()
+
+    for lineas in (1, 10, 50):
+        carritos = []
+        for _ in range(repeticiones):
+            carrito = Carrito.objects.create(usuario=usuario)
+            CarritoItem.objects.bulk_create([
+                CarritoItem(carrito=carrito, variante=variante, cantidad=random.randint(1, 3), precio_unitario_snapshot=variante.precio)
+                for variante in random.sample(variantes, lineas)
+            ])
+            carritos.append(carrito.pk)
+        pendientes = iter(carritos)
+        confirmar = lambda: confirmar_carrito(next(pendientes), usuario, 'yape')
+        sentencias = consultas(confirmar)
+        tiempos = medir(confirmar, repeticiones - 1)
+        escribir(f"{lineas:>3} líneas: {resumen(tiempos)} ({sentencias} consultas)")
+
+
+def _asignar_en_paralelo(pedido_ids, hilos):
+    """Reparte los pedidos entre ``hilos`` workers que asignan lotes uno por uno."""
+    pendientes = iter(pedido_ids)
+    siguiente = threading.Lock()
+    tiempos, faltantes, errores = [], [], []
+
+    def trabajar():
+        try:
+            while True:
+                with siguiente:
+                    pk = next(pendientes, None)
+                if pk is None:
+                    return
+                inicio = time.perf_counter()
+                try:
+                    lotes.asignar_lotes_pedidos([pk])
+                except StockInsuficiente:
+                    faltantes.append(pk)
+                except Exception as exc:
+                    errores.append(exc)
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+        finally:
+            connections.close_all()
+
+    workers = [threading.Thread(target=trabajar) for _ in range(hilos)]
+    inicio = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - inicio, tiempos, faltantes, errores
+
+
+@escenario_concurrente
+def asignacion_fefo(escribir, tamano, repeticiones):
+    """Asignaciones FEFO por segundo con 1 a 32 workers sobre una sola variante, 2.000 pedidos por corrida (--tamano)."""
+    tamano = tamano or 2000
+    usuario, productos, (variante,) = crear_catalogo(1, variantes_por_producto=1, categorias=1)
+    try:
+        # Unidades de sobra: un StockInsuficiente solo puede venir de lotes bloqueados por otro worker
+        por_lote = tamano * 3 * 2 // 100
+        hoy = timezone.localdate()
+        lista = Lote.objects.bulk_create([
+            Lote(
+                producto=productos[0], variante=variante, cantidad_inicial=por_lote, cantidad_disponible=por_lote,
+                costo_total=por_lote, costo_unitario=1, fecha_vencimiento=hoy + timedelta(days=30 + i),
+            )
+            for i in range(100)
+        ])
+        registrar_movimientos([MovimientoInventario(variante=variante, tipo='entrada', cantidad=por_lote * 100)])
+        escribir(f"{len(lista)} lotes de {por_lote} unidades, pedidos de 1 a 3 unidades ({connection.vendor})")
+
+        for hilos in (1, 4, 16, 32):
+            Lote.objects.filter(pk__in=[lote.pk for lote in lista]).update(cantidad_disponible=por_lote)
+            pedidos = Pedido.objects.bulk_create([
+                Pedido(
+                    usuario=usuario, codigo=f'BF{variante.pk}-{hilos}-{i}', estado='pagado',
+                    subtotal=10, impuestos=0, costo_envio=0, total=10,
+                )
+                for i in range(tamano)
+            ])
+            PedidoItem.objects.bulk_create([
+                PedidoItem(
+                    pedido=pedido, variante=variante, cantidad=random.randint(1, 3),
+                    precio_unitario=Decimal('10.00'), subtotal=Decimal('10.00'), total_neto=Decimal('10.00'),
+                )
+                for pedido in pedidos
+            ])
+            segundos, tiempos, faltantes, errores = _asignar_en_paralelo([p.pk for p in pedidos], hilos)
+            asignados = len(tiempos) - len(faltantes) - len(errores)
+            escribir(
+                f"{hilos:>3} workers: {asignados / segundos:,.0f} asignaciones/s, {resumen(tiempos)}; "
+                f"{len(faltantes)} sin lote libre, {len(errores)} errores"
+            )
+            if errores:
+                escribir(f"      primer error: {errores[0]!r}")
+    finally:
+        MovimientoInventario.objects.filter(variante=variante).delete()
+        MovimientoResumenDiario.objects.filter(variante=variante).delete()
+        StockVariante.objects.filter(pk=variante.pk).delete()
+        Pedido.objects.filter(usuario=usuario).delete()
+        Lote.objects.filter(variante=variante).delete()
+        ProductoVariante.objects.filter(pk=variante.pk).delete()
+        Producto.objects.filter(pk=productos[0].pk).delete()
+        Categoria.objects.filter(pk=productos[0].categoria_id).delete()
+        Marca.objects.filter(pk=productos[0].marca_id).delete()
+        usuario.delete()
+
+
+def _descendientes_ingenuo(categoria_id):
+    """Subárbol recorriendo id_padre nivel por nivel (una consulta por nivel)."""
+    ids, nivel = [categoria_id], [categoria_id]
+    while nivel:
+        nivel = list(Categoria.objects.filter(id_padre_id__in=nivel).values_list('pk', flat=True))
+        ids.extend(nivel)
+    return ids
+
+
+def _migas_ingenuo(categoria_id):
+    migas = []
+    while categoria_id is not None:
+        categoria = Categoria.objects.only('pk', 'id_padre_id', 'nombre').get(pk=categoria_id)
+        migas.append(categoria)
+        categoria_id = categoria.id_padre_id
+    return migas[::-1]
+
+
+@escenario
+def arbol_categorias(escribir, tamano, repeticiones):
+    """Subárbol, migas y conteos sobre un árbol de 5 niveles con 10.000 categorías."""
+    tamano = tamano or 10000
+    sufijo = time.time_ns()
+    # Proporción por nivel: pocas raíces, la mayoría hojas
+    proporciones = [0.001, 0.009, 0.09, 0.3, 0.6]
+    niveles, creadas = [], 0
+    for profundidad, proporcion in enumerate(proporciones):
+        padres = niveles[-1] if niveles else [None]
+        cantidad = max(1, int(tamano * proporcion))
+        nivel = Categoria.objects.bulk_create(
+            [
+                Categoria(nombre=f'Cat {creadas + i}', slug=f'arbol-{sufijo}-{creadas + i}', id_padre=random.choice(padres))
+                for i in range(cantidad)
+            ],
+            batch_size=1000,
+        )
+        niveles.append(nivel)
+        creadas += cantidad
+    marca = Marca.objects.create(nombre=f'Marca {sufijo}')
+    hojas = niveles[-1] + niveles[-2]
+    Producto.objects.bulk_create(
+        [
+            Producto(categoria=random.choice(hojas), marca=marca, nombre=f'Producto {i}', sku_base=f'A{sufijo}-{i}')
+            for i in range(tamano * 2)
+        ],
+        batch_size=1000,
+    )
+
+    inicio = time.perf_counter()
+    actualizadas, _ = categorias.reconstruir_rutas()
+    escribir(f"rebuild_categorias: {actualizadas} categorías en {(time.perf_counter() - inicio) * 1000:.0f} ms")
+
+    raiz = Categoria.objects.get(pk=niveles[0][0].pk)
+    intermedia = Categoria.objects.get(pk=random.choice(niveles[1]).pk)
+    hoja = Categoria.objects.get(pk=random.choice(niveles[-1]).pk)
+    casos = [
+        (
+            'productos del subárbol (raíz)',
+            lambda: categorias.productos_en_subarbol(raiz).count(),
+            lambda: Producto.objects.filter(categoria_id__in=_descendientes_ingenuo(raiz.pk)).count(),
+        ),
+        (
+            'productos del subárbol (nivel 2)',
+            lambda: categorias.productos_en_subarbol(intermedia).count(),
+            lambda: Producto.objects.filter(categoria_id__in=_descendientes_ingenuo(intermedia.pk)).count(),
+        ),
+        (
+            'migas de pan (hoja)',
+            lambda: categorias.migas_de_pan(hoja),
+            lambda: _migas_ingenuo(hoja.pk),
+        ),
+        (
+            'conteo por hija (raíz)',
+            lambda: categorias.conteo_por_subcategoria(raiz),
+            lambda: {
+                hija: Producto.objects.filter(categoria_id__in=_descendientes_ingenuo(hija)).count()
+                for hija in Categoria.objects.filter(id_padre=raiz).values_list('pk', flat=True)
+            },
+        ),
+    ]
+    for nombre, con_ruta, ingenuo in casos:
+        escribir(f"{nombre}")
+        escribir(f"  ruta:     {resumen(medir(con_ruta, repeticiones))} ({consultas(con_ruta)} consultas)")
+        escribir(f"  id_padre: {resumen(medir(ingenuo, max(3, repeticiones // 10)))} ({consultas(ingenuo)} consultas)")
+
+
+PALABRAS = (
+    'zapatilla camiseta polo casaca pantalon short media gorra mochila bolso reloj lente taza botella '
+    'cuaderno lapiz audifono parlante cargador cable funda teclado mouse monitor lampara silla mesa '
+    'cojin manta toalla sarten olla cuchillo plato vaso jarra perfume crema shampoo jabon cepillo'
+).split()
+ADJETIVOS = 'rojo azul negro blanco verde deportivo clasico premium infantil ligero resistente termico'.split()
+
+
+@escenario
+def busqueda_productos(escribir, tamano, repeticiones):
+    """Latencia de buscar() frente a icontains sobre 20.000 productos (--tamano)."""
+    tamano = tamano or 20000
+    sufijo = time.time_ns()
+    categoria = Categoria.objects.create(nombre='Hogar y moda', slug=f'busqueda-{sufijo}')
+    marcas = Marca.objects.bulk_create([Marca(nombre=f'Marca {sufijo} {i}') for i in range(50)])
+    productos = Producto.objects.bulk_create(
+        [
+            Producto(
+                categoria=categoria, marca=random.choice(marcas), sku_base=f'SKU{sufijo % 100000}-{i:06d}',
+                nombre=f'{random.choice(PALABRAS)} {random.choice(ADJETIVOS)} {random.choice(ADJETIVOS)}',
+                descripcion=' '.join(random.choices(PALABRAS + ADJETIVOS, k=25)),
+            )
+            for i in range(tamano)
+        ],
+        batch_size=1000,
+    )
+    inicio = time.perf_counter()
+    ids = [producto.pk for producto in productos]
+    for i in range(0, len(ids), 2000):
+        busqueda.actualizar_documentos(ids[i:i + 2000])
+    busqueda.invalidar_local()
+    busqueda.buscar('warmup')
+    escribir(f"indexar {tamano} productos ({connection.vendor}): {(time.perf_counter() - inicio) * 1000:.0f} ms")
+
+    sku = productos[len(productos) // 2].sku_base
+    consultas_prueba = [
+        ('una palabra', 'mochila'),
+        ('dos palabras', 'zapatilla deportivo'),
+        ('typo', 'zapatila'),
+        ('SKU parcial', sku[:-2]),
+        ('sin resultados', 'xilofono'),
+    ]
+    # icontains no ordena por relevancia ni tolera typos: corta en las primeras 20 filas que encuentra
+    for nombre, texto in consultas_prueba:
+        ingenuo = lambda: list(
+            Producto.objects.filter(activo=True).filter(
+                Q(nombre__icontains=texto) | Q(descripcion__icontains=texto) | Q(sku_base__icontains=texto)
+                | Q(marca__nombre__icontains=texto) | Q(categoria__nombre__icontains=texto)
+                | Q(variantes__sku__icontains=texto)
+            ).distinct().values_list('pk', flat=True)[:20]
+        )
+        escribir(f"{nombre} ({texto!r}): {len(busqueda.buscar(texto))} resultados")
+        escribir(f"  buscar:    {resumen(medir(lambda: busqueda.buscar(texto), repeticiones))}")
+        escribir(f"  icontains: {resumen(medir(ingenuo, max(3, repeticiones // 10)))}")
+
+
+def _crear_ventas(usuario, variantes, items, sufijo, inicio=0, por_pedido=10, tanda=50000, dias=1):
+    """
+    ``items`` PedidoItem en pedidos de ``por_pedido`` líneas, insertados por
+    tandas; los pedidos se reparten entre los últimos ``dias`` días.
+    """
+    ahora = timezone.now()
+    for desde in range(inicio, inicio + items, tanda):
+        cantidad = min(tanda, inicio + items - desde)
+        pedidos = Pedido.objects.bulk_create(
+            [
+                Pedido(
+                    usuario=usuario, codigo=f'BV{sufijo}-{desde + i}', estado='pagado',
+                    subtotal=100, impuestos=18, costo_envio=10, total=128,
+                    fecha_pedido=ahora - timedelta(days=(desde + i) // por_pedido % dias),
+                )
+                for i in range(0, cantidad, por_pedido)
+            ],
+            batch_size=5000,
+        )
+        PedidoItem.objects.bulk_create(
+            [
+                PedidoItem(
+                    pedido=pedidos[i // por_pedido], variante=random.choice(variantes), cantidad=1,
+                    precio_unitario=Decimal('10.00'), subtotal=Decimal('10.00'), total_neto=Decimal('10.00'),
+                )
+                for i in range(cantidad)
+            ],
+            batch_size=5000,
+        )
+
+
+@escenario
+def exportacion_ventas(escribir, tamano, repeticiones):
+    """Tiempo y memoria pico de exportar 5.000.000 PedidoItem a CSV gzip (--tamano)."""
+    tamano = tamano or 5000000
+    sufijo = time.time_ns()
+    usuario, _, variantes = crear_catalogo(200)
+    # Mismo export con un décimo y con todas las filas: la memoria debe quedar igual
+    primero = max(tamano // 10, 1)
+    with tempfile.TemporaryDirectory() as directorio, override_settings(EXPORTACION_DIR=directorio):
+        hechas = 0
+        for filas in (primero, tamano):
+            _crear_ventas(usuario, variantes, filas - hechas, sufijo, inicio=hechas)
+            hechas = filas
+            job = ExportJob.objects.create(usuario=usuario, tipo='ventas', parametros='{"formato": "csv"}')
+            tracemalloc.start()
+            inicio = time.perf_counter()
+            ejecutar_exportacion(job)
+            segundos = time.perf_counter() - inicio
+            _, pico = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            escribir(
+                f"{job.filas_exportadas:>9} filas ({connection.vendor}): {segundos:.1f} s, "
+                f"{job.filas_exportadas / segundos:,.0f} filas/s, memoria pico {pico / 2 ** 20:.1f} MiB"
+            )
+
+
+DIMENSIONES_INGENUAS = {
+    'fecha': TruncDate('pedido__fecha_pedido'),
+    'categoria': F('variante__producto__categoria_id'),
+    'marca': F('variante__producto__marca_id'),
+}
+
+
+def ventas_ingenuas(desde, hasta, por):
+    """Las métricas principales de analitica.ventas con un GROUP BY sobre PedidoItem."""
+    costo = ExpressionWrapper(
+        F('cantidad') * F('lote_origen__costo_unitario'), output_field=DecimalField(max_digits=16, decimal_places=4)
+    )
+    return list(
+        PedidoItem.objects.filter(
+            pedido__fecha_pedido__gte=analitica._inicio_dia(desde),
+            pedido__fecha_pedido__lt=analitica._inicio_dia(hasta + timedelta(days=1)),
+            pedido__estado__in=analitica.estados_venta(),
+        )
+        .annotate(**{f'd_{campo}': DIMENSIONES_INGENUAS[campo] for campo in por})
+        .values(*[f'd_{campo}' for campo in por])
+        .annotate(
+            unidades=Sum('cantidad'), ingreso_bruto=Sum('subtotal'), descuento=Sum('descuento_item'),
+            ingreso_neto=Sum('total_neto'), costo=Sum(costo),
+        )
+        .order_by(*[f'd_{campo}' for campo in por])
+    )
+
+
+@escenario
+def cubos_ventas(escribir, tamano, repeticiones):
+    """Reportes de ventas sobre los cubos frente al GROUP BY sobre 1.000.000 PedidoItem de un año (--tamano)."""
+    tamano = tamano or 1000000
+    usuario, _, variantes = crear_catalogo(2000)
+    _crear_ventas(usuario, variantes, tamano, time.time_ns(), dias=365)
+    hasta = timezone.localdate()
+    desde = hasta - timedelta(days=364)
+
+    with override_settings(ANALITICA_RETRASO_SEGUNDOS=0):
+        inicio = time.perf_counter()
+        dias, filas = analitica.refrescar_cubos(completo=True)
+        escribir(
+            f"refresco completo: {dias} días, {filas} filas en {time.perf_counter() - inicio:.1f} s "
+            f"({tamano} items, {connection.vendor})"
+        )
+        por_cancelar = list(
+            Pedido.objects.filter(usuario=usuario, fecha_pedido__gte=analitica._inicio_dia(hasta - timedelta(days=2)))
+            .values_list('pk', flat=True)[:100]
+        )
+        Pedido.objects.filter(pk__in=por_cancelar).update(estado='cancelado', fecha_actualizacion=timezone.now())
+        inicio = time.perf_counter()
+        dias, filas = analitica.refrescar_cubos()
+        escribir(
+            f"refresco incremental tras cancelar {len(por_cancelar)} pedidos: {dias} días, {filas} filas "
+            f"en {(time.perf_counter() - inicio) * 1000:.0f} ms"
+        )
+
+    veces = max(3, repeticiones // 20)
+    for por in (('fecha',), ('categoria',), ('marca',), ('fecha', 'categoria')):
+        nombre = ' x '.join(por)
+        escribir(f"año por {nombre}:")
+        escribir(f"  cubos:    {resumen(medir(lambda: analitica.ventas(desde, hasta, por=por), veces))}")
+        escribir(f"  GROUP BY: {resumen(medir(lambda: ventas_ingenuas(desde, hasta, por), veces))}")
+
+
+def mejor_tarifa_ingenua(ciudad_id, peso):
+    """Lo que hace envios.mejor_cotizacion, con un filtro del ORM por cotización."""
+    return (
+        TarifaEnvio.objects.filter(ciudad_id=ciudad_id, activo=True)
+        .filter(Q(peso_min_kg__isnull=True) | Q(peso_min_kg__lte=peso))
+        .filter(Q(peso_max_kg__isnull=True) | Q(peso_max_kg__gte=peso))
+        .order_by('costo', 'pk').values_list('pk', 'costo').first()
+    )
+
+
+@escenario
+def cotizacion_envios(escribir, tamano, repeticiones):
+    """Latencia de mejor_cotizacion() frente al filtro del ORM, 200 ciudades × 8 empresas × 25 bandas (--tamano)."""
+    tamano = tamano or 200
+    region = Region.objects.create(nombre='Benchmark')
+    ciudades = Ciudad.objects.bulk_create([Ciudad(nombre=f'Ciudad {i}', region=region) for i in range(tamano)])
+    empresas = EmpresaEnvio.objects.bulk_create([EmpresaEnvio(nombre=f'Empresa {i}') for i in range(8)])
+    tarifas = []
+    for ciudad in ciudades:
+        for empresa in empresas:
+            # Bandas contiguas de ancho variable; la última queda abierta
+            desde = Decimal('0')
+            for banda in range(25):
+                hasta = desde + Decimal(random.randint(50, 400)) / 100
+                tarifas.append(TarifaEnvio(
+                    ciudad=ciudad, empresa=empresa, peso_min_kg=desde, peso_max_kg=None if banda == 24 else hasta,
+                    costo=Decimal(random.randint(500, 20000)) / 100,
+                ))
+                desde = hasta + Decimal('0.01')
+    TarifaEnvio.objects.bulk_create(tarifas, batch_size=2000)
+    envios.invalidar_local()
+    escribir(f"{len(tarifas)} tarifas en {tamano} ciudades ({connection.vendor})")
+
+    # Primer uso de cada ciudad: compila su índice; después solo lo revalida cada ENVIOS_VERIFICACION_SEGUNDOS
+    compilacion = []
+    for ciudad in ciudades:
+        compilacion.extend(medir(lambda: envios.obtener_indice(ciudad.pk), 1))
+    escribir(f"compilar índice por ciudad: {resumen(compilacion)}")
+
+    pedidos = [
+        (random.choice(ciudades).pk, Decimal(random.randint(10, 6000)) / 100) for _ in range(max(repeticiones, 1))
+    ]
+    distintas = sum(
+        envios.mejor_cotizacion(c, p).tarifa_id != mejor_tarifa_ingenua(c, p)[0] for c, p in pedidos[:50]
+    )
+    escribir(f"resultados distintos entre ambos caminos (50 muestras): {distintas}")
+
+    for nombre, cotizar in (
+        ('índice', lambda c, p: envios.mejor_cotizacion(c, p)),
+        ('ORM', mejor_tarifa_ingenua),
+    ):
+        pendientes = iter(pedidos * 2)
+        sentencias = consultas(lambda: cotizar(*next(pendientes)))
+        escribir(f"  {nombre:<6}: {resumen(medir(lambda: cotizar(*next(pendientes)), repeticiones - 1))} "
+                 f"({sentencias} consultas)")
+
+
+@escenario
+def ultimo_acceso(escribir, tamano, repeticiones):
+    """Escrituras de ultimo_acceso para 200.000 requests simuladas de 10.000 usuarios en una hora (--tamano usuarios)."""
+    tamano = tamano or 10000
+    requests = tamano * 20
+    rol, _ = Rol.objects.get_or_create(nombre='cliente')
+    sufijo = time.time_ns()
+    usuarios = [
+        u.pk for u in Usuario.objects.bulk_create(
+            [Usuario(rol=rol, email=f'acceso-{sufijo}-{i}@example.com') for i in range(tamano)], batch_size=2000,
+        )
+    ]
+    # Popularidad tipo Pareto: pocos usuarios concentran la mayoría de las requests
+    pesos = [random.paretovariate(1.2) for _ in usuarios]
+    trafico = random.choices(usuarios, weights=pesos, k=requests)
+    inicio = timezone.now()
+    paso = timedelta(hours=1) / requests
+    escribir(f"{requests} requests de {len(set(trafico))} usuarios distintos en una hora simulada ({connection.vendor})")
+
+    muestra = iter(enumerate(trafico))
+
+    def actualizar_en_la_request():
+        i, pk = next(muestra)
+        Usuario.objects.filter(pk=pk).update(ultimo_acceso=inicio + i * paso)
+
+    ingenuo = medir(actualizar_en_la_request, min(repeticiones * 10, requests))
+    escribir(f"  UPDATE por request: {requests} sentencias; {resumen(ingenuo)} por request")
+    Usuario.objects.filter(email__startswith=f'acceso-{sufijo}-').update(ultimo_acceso=None)
+
+    # El volcado se simula en el propio hilo cada ACCESOS_INTERVALO_SEGUNDOS del reloj simulado
+    intervalo = timedelta(seconds=getattr(settings, 'ACCESOS_INTERVALO_SEGUNDOS', 30.0))
+    asincrono, accesos._buffer.asincrono = accesos._buffer.asincrono, False
+    antes = accesos.estadisticas()
+    try:
+        tiempos = []
+        with CaptureQueriesContext(connection) as capturadas:
+            proximo_volcado = inicio + intervalo
+            for i, pk in enumerate(trafico):
+                fecha = inicio + i * paso
+                if fecha >= proximo_volcado:
+                    accesos.vaciar()
+                    proximo_volcado += intervalo
+                t = time.perf_counter()
+                accesos.registrar_acceso(pk, fecha)
+                tiempos.append((time.perf_counter() - t) * 1000)
+            accesos.vaciar()
+    finally:
+        accesos._buffer.asincrono = asincrono
+    despues = accesos.estadisticas()
+    sentencias = sum(1 for q in capturadas.captured_queries if q['sql'].lstrip().upper().startswith('UPDATE'))
+    filas = despues['filas'] - antes['filas']
+    omitidos = despues['omitidos'] - antes['omitidos']
+    escribir(
+        f"  buffer: {sentencias} sentencias UPDATE, {filas} filas escritas, {omitidos} accesos omitidos "
+        f"en memoria; {resumen(tiempos)} por request"
+    )
+    escribir(f"  reducción de sentencias: {requests / max(sentencias, 1):,.0f}x")
@@ -0,0 +1,40 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.benchmarks import ESCENARIOS
+
+
+class Revertir(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide un servicio de core sobre datos sintéticos. Todo corre en una transacción que se "
+        "revierte al terminar (o, en los escenarios con hilos, borra sus datos): no deja datos en la base."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('escenario', choices=sorted(ESCENARIOS))
+        parser.add_argument('--tamano', type=int, help='Volumen principal de datos (por defecto, el del escenario).')
+        parser.add_argument('--repeticiones', type=int, default=200, help='Mediciones por caso.')
+        parser.add_argument('--semilla', type=int, default=1, help='Semilla de los datos aleatorios.')
+
+    def handle(self, *args, **options):
+        random.seed(options['semilla'])
+        funcion = ESCENARIOS[options['escenario']]
+        self.stdout.write(funcion.__doc__.strip())
+        if getattr(funcion, 'concurrente', False):
+            # Los hilos solo ven datos confirmados: el escenario borra los suyos al terminar
+            funcion(self.stdout.write, options['tamano'], options['repeticiones'])
+            self.stdout.write(self.style.SUCCESS("Datos del benchmark borrados."))
+            return
+        try:
+            with transaction.atomic():
+                funcion(self.stdout.write, options['tamano'], options['repeticiones'])
+                raise Revertir()
+        except Revertir:
+            pass
+        self.stdout.write(self.style.SUCCESS("Datos del benchmark revertidos."))
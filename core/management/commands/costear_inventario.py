@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.services.costeo import costear, metodo_configurado, tomar_valorizacion
+
+
+class Command(BaseCommand):
+    help = (
+        "Costea el ledger de inventario pendiente (COSTEO_METODO: promedio o fifo) desde el "
+        "último checkpoint y asigna el costo de venta a los PedidoItem."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tanda', type=int, default=20000, help='Movimientos procesados por transacción.')
+        parser.add_argument('--reiniciar', action='store_true', help='Descarta el estado y recostea todo el ledger.')
+        parser.add_argument('--valorizar', action='store_true', help='Guarda una foto de valorización al terminar.')
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        movimientos, variantes = costear(options['tanda'], reiniciar=options['reiniciar'])
+        self.stdout.write(
+            f"Costeo ({metodo_configurado()}): {movimientos} movimientos, {variantes} variantes "
+            f"en {time.monotonic() - inicio:.1f}s."
+        )
+        if options['valorizar']:
+            inicio = time.monotonic()
+            filas, total = tomar_valorizacion()
+            self.stdout.write(f"Valorización: {filas} variantes, valor total {total} en {time.monotonic() - inicio:.1f}s.")
+        self.stdout.write(self.style.SUCCESS("Costeo al día."))
@@ -0,0 +1,155 @@
+import json
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+
+# Columna comparada dentro de un "Filter" de EXPLAIN, ej: ((session_id)::text = 'x'::text)
+PATRON_COMPARACION = re.compile(
+    r"\(?(\w+)\)?(?:::[a-z ]+?)?\s*(=|<>|<=|>=|<|>|~~\*?|IS NOT|IS)\s"
+)
+OPERADORES_IGUALDAD = {'=', 'IS'}
+
+
+class Command(BaseCommand):
+    help = (
+        "Sugiere índices faltantes analizando los Seq Scan de los planes de "
+        "pg_stat_statements (o de una consulta concreta con --sql)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sql', help='Analiza el plan de esta consulta en lugar de pg_stat_statements.')
+        parser.add_argument('--limite', type=int, default=25, help='Sentencias más costosas a revisar.')
+        parser.add_argument('--min-filas', type=int, default=10000, help='Ignora tablas con menos filas estimadas.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('index_advisor solo está disponible sobre PostgreSQL.')
+
+        self.min_filas = options['min_filas']
+        self._indices = {}
+        self._filas = {}
+
+        if options['sql']:
+            consultas = [options['sql']]
+        else:
+            self._reportar_tablas()
+            consultas = self._consultas_costosas(options['limite'])
+
+        sugerencias = {}
+        for sql in consultas:
+            plan = self._explain(sql)
+            if plan is None:
+                continue
+            for tabla, igualdad, rango in self._seq_scans(plan):
+                columnas = tuple(igualdad + [c for c in rango if c not in igualdad])
+                if columnas and not self._cubierto(tabla, igualdad or columnas[:1]):
+                    sugerencias.setdefault((tabla, columnas), sql)
+
+        if not sugerencias:
+            self.stdout.write(self.style.SUCCESS('No se encontraron índices faltantes.'))
+            return
+
+        for (tabla, columnas), sql in sugerencias.items():
+            nombre = f"{tabla}_{'_'.join(columnas)}_idx"[:63]
+            self.stdout.write(f"-- {' '.join(sql.split())[:120]}")
+            self.stdout.write(
+                f"CREATE INDEX CONCURRENTLY {nombre} ON {tabla} ({', '.join(columnas)});"
+            )
+
+    # -----------------------------
+    # Fuentes de consultas
+    # -----------------------------
+    def _reportar_tablas(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT relname, seq_scan, seq_tup_read, coalesce(idx_scan, 0), n_live_tup
+                FROM pg_stat_user_tables
+                WHERE n_live_tup >= %s AND seq_scan > coalesce(idx_scan, 0)
+                ORDER BY seq_tup_read DESC
+                """,
+                [self.min_filas],
+            )
+            filas = cursor.fetchall()
+        for relname, seq_scan, seq_tup_read, idx_scan, vivas in filas:
+            self.stdout.write(self.style.WARNING(
+                f"{relname}: {seq_scan} seq scans ({seq_tup_read} filas leídas) "
+                f"vs {idx_scan} index scans, {vivas} filas"
+            ))
+
+    def _consultas_costosas(self, limite):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'")
+            if cursor.fetchone() is None:
+                self.stderr.write('pg_stat_statements no está instalado; use --sql para analizar una consulta.')
+                return []
+            cursor.execute(
+                """
+                SELECT query FROM pg_stat_statements
+                WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+                  AND query ILIKE 'select%%'
+                ORDER BY total_exec_time DESC
+                LIMIT %s
+                """,
+                [limite],
+            )
+            return [fila[0] for fila in cursor.fetchall()]
+
+    def _explain(self, sql):
+        opciones = 'FORMAT JSON'
+        if re.search(r'\$\d+', sql):
+            # Las sentencias normalizadas ($1, $2...) solo se pueden planificar con GENERIC_PLAN (PG16+)
+            if connection.pg_version < 160000:
+                return None
+            opciones += ', GENERIC_PLAN'
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN ({opciones}) {sql}')
+                resultado = cursor.fetchone()[0]
+        except DatabaseError as exc:
+            self.stderr.write(f'No se pudo planificar: {exc}')
+            return None
+        if isinstance(resultado, str):
+            resultado = json.loads(resultado)
+        return resultado[0]['Plan']
+
+    # -----------------------------
+    # Análisis del plan
+    # -----------------------------
+    def _seq_scans(self, nodo):
+        if nodo.get('Node Type') == 'Seq Scan' and nodo.get('Filter'):
+            tabla = nodo['Relation Name']
+            if self._filas_tabla(tabla) >= self.min_filas:
+                columnas = self._columnas_tabla(tabla)
+                igualdad, rango = [], []
+                for columna, operador in PATRON_COMPARACION.findall(nodo['Filter']):
+                    if columna not in columnas:
+                        continue
+                    destino = igualdad if operador in OPERADORES_IGUALDAD else rango
+                    if columna not in destino:
+                        destino.append(columna)
+                yield tabla, igualdad, rango
+        for hijo in nodo.get('Plans', []):
+            yield from self._seq_scans(hijo)
+
+    def _filas_tabla(self, tabla):
+        if tabla not in self._filas:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [tabla])
+                fila = cursor.fetchone()
+            self._filas[tabla] = fila[0] if fila else 0
+        return self._filas[tabla]
+
+    def _columnas_tabla(self, tabla):
+        with connection.cursor() as cursor:
+            return {c.name for c in connection.introspection.get_table_description(cursor, tabla)}
+
+    def _cubierto(self, tabla, columnas):
+        # Un índice existente sirve si sus columnas iniciales son las buscadas
+        if tabla not in self._indices:
+            with connection.cursor() as cursor:
+                restricciones = connection.introspection.get_constraints(cursor, tabla)
+            self._indices[tabla] = [r['columns'] for r in restricciones.values() if r['index']]
+        n = len(columnas)
+        return any(set(indice[:n]) == set(columnas) for indice in self._indices[tabla])
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from core.services.reservas import liberar_vencidas
+
+
+class Command(BaseCommand):
+    help = (
+        "Borra en lotes las retenciones de stock (ReservaStock) vencidas. Las vencidas ya no "
+        "cuentan para el disponible; esto solo mantiene chica la tabla."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=5000, help='Retenciones borradas por transacción.')
+
+    def handle(self, *args, **options):
+        liberadas = liberar_vencidas(options['lote'])
+        self.stdout.write(self.style.SUCCESS(f"Retenciones vencidas liberadas: {liberadas}"))
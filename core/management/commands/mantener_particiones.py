@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.services.particiones import mantener
+
+
+class Command(BaseCommand):
+    help = (
+        "Crea las particiones mensuales de los próximos meses y, con --borrar, borra las que "
+        "exceden la retención configurada (solo PostgreSQL). Pensado para cron diario o mensual."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--meses-adelante', type=int, default=3, help='Meses futuros a dejar creados.')
+        parser.add_argument('--simular', action='store_true', help='Muestra qué haría sin cambiar nada.')
+        parser.add_argument(
+            '--borrar', action='store_true',
+            help='Borra (DROP TABLE) las particiones fuera de la retención; sin esto solo se listan.',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stdout.write("Las particiones solo existen en PostgreSQL; nada que hacer.")
+            return
+        for tabla, accion, nombre in mantener(options['meses_adelante'], options['simular'], options['borrar']):
+            if nombre is None:
+                self.stderr.write(f"{tabla}: {accion} (¿migraciones pendientes?)")
+            else:
+                self.stdout.write(f"{tabla}: {accion} {nombre}")
+        self.stdout.write(self.style.SUCCESS("Particiones al día."))
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+
+from core.services.particiones import PARTICIONADAS, reescribir
+
+
+class Command(BaseCommand):
+    help = (
+        "Convierte una tabla en particionada por mes (o la revierte). Copia la tabla entera con un "
+        "lock ACCESS EXCLUSIVE: correr en una ventana de mantenimiento. Solo PostgreSQL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('tabla', choices=[p.modelo._meta.db_table for p in PARTICIONADAS])
+        parser.add_argument('--revertir', action='store_true', help='Vuelve a una tabla normal.')
+        parser.add_argument(
+            '--lock-timeout', default='10s',
+            help='Espera máxima por el lock de la tabla antes de abortar (sintaxis de PostgreSQL).',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Las particiones solo existen en PostgreSQL.")
+        tabla = options['tabla']
+        inicio = time.monotonic()
+        try:
+            cambiada = reescribir(tabla, revertir=options['revertir'], lock_timeout=options['lock_timeout'])
+        except DatabaseError as exc:
+            raise CommandError(f"{tabla}: no se reescribió ({exc})")
+        if not cambiada:
+            self.stdout.write(f"{tabla} ya estaba {'sin particionar' if options['revertir'] else 'particionada'}.")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"{tabla} {'revertida' if options['revertir'] else 'particionada'} en {time.monotonic() - inicio:.1f} s "
+            f"(bloqueada durante toda la copia)."
+        ))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from core.services.carrito import desactivar_inactivos, purgar_inactivos
+
+
+class Command(BaseCommand):
+    help = (
+        "Desactiva los carritos sin actividad y borra en lotes los desactivados hace más de "
+        "la retención, con sus items. Pensado para cron diario."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias-anonimo', type=int, help='Inactividad para desactivar carritos sin usuario.')
+        parser.add_argument('--dias-usuario', type=int, help='Inactividad para desactivar carritos de usuarios.')
+        parser.add_argument('--retencion', type=int, help='Días que se conserva un carrito desactivado.')
+        parser.add_argument('--lote', type=int, default=1000, help='Carritos borrados por transacción.')
+
+    def handle(self, *args, **options):
+        desactivados = desactivar_inactivos(options['dias_anonimo'], options['dias_usuario'])
+        metricas = purgar_inactivos(options['retencion'], tamano_lote=options['lote'])
+        self.stdout.write(f"Carritos desactivados por inactividad: {desactivados}")
+        self.stdout.write(
+            f"Borrados: {metricas['carritos']} carritos, {metricas['items']} items y "
+            f"{metricas['reservas']} retenciones en {metricas['lotes']} lotes"
+        )
+        self.stdout.write(self.style.SUCCESS("Carritos al día."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from core.services.tokens import PURGABLES, purgar
+
+
+class Command(BaseCommand):
+    help = (
+        "Borra los refresh tokens y tokens de verificación de email vencidos, "
+        "en lotes cortos para no bloquear las tablas. Pensado para cron diario."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tipos', nargs='+', choices=sorted(PURGABLES), default=sorted(PURGABLES),
+            help='Tablas a purgar.',
+        )
+        parser.add_argument('--lote', type=int, default=5000, help='Filas borradas por transacción.')
+        parser.add_argument('--pausa', type=float, default=0.0, help='Segundos de espera entre lotes.')
+
+    def handle(self, *args, **options):
+        for tipo in options['tipos']:
+            total = lotes = 0
+            for borrados in purgar(tipo, tamano_lote=options['lote'], pausa=options['pausa']):
+                total += borrados
+                lotes += 1
+            self.stdout.write(f"{tipo}: {total} tokens borrados en {lotes} lotes")
+        self.stdout.write(self.style.SUCCESS("Purga de tokens terminada."))
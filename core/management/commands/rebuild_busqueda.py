@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Producto
+from core.services.busqueda import actualizar_documentos
+
+
+class Command(BaseCommand):
+    help = "Regenera los documentos de búsqueda (ProductoBusqueda) de todos los productos."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk', type=int, default=1000, help='Productos procesados por lote.')
+
+    def handle(self, *args, **options):
+        chunk = options['chunk']
+        total, lote = 0, []
+        for producto_id in Producto.objects.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=chunk):
+            lote.append(producto_id)
+            if len(lote) >= chunk:
+                actualizar_documentos(lote)
+                total += len(lote)
+                lote = []
+        if lote:
+            actualizar_documentos(lote)
+            total += len(lote)
+        self.stdout.write(self.style.SUCCESS(f"Documentos de búsqueda regenerados: {total} productos."))
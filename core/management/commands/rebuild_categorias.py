@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.services.categorias import ProfundidadExcedida, reconstruir_rutas
+
+
+class Command(BaseCommand):
+    help = "Recalcula Categoria.ruta y Categoria.profundidad a partir de id_padre."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk', type=int, default=2000, help='Categorías actualizadas por lote.')
+
+    def handle(self, *args, **options):
+        try:
+            actualizadas, en_ciclo = reconstruir_rutas(chunk=options['chunk'])
+        except ProfundidadExcedida as exc:
+            raise CommandError(str(exc))
+        if en_ciclo:
+            self.stderr.write(self.style.WARNING(
+                f"Categorías en un ciclo de id_padre (quedaron como raíz): {en_ciclo}"
+            ))
+        self.stdout.write(self.style.SUCCESS(f"Rutas recalculadas: {actualizadas} categorías actualizadas."))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from core.models import ProductoVariante
+from core.services.facetas import indexar_variantes
+
+
+class Command(BaseCommand):
+    help = "Reconstruye el índice de facetas (FacetaVariante) de todas las variantes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk', type=int, default=2000, help='Variantes indexadas por lote.')
+
+    def handle(self, *args, **options):
+        chunk = options['chunk']
+        variantes, postings, lote = 0, 0, []
+        for variante_id in ProductoVariante.objects.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=chunk):
+            lote.append(variante_id)
+            if len(lote) >= chunk:
+                postings += indexar_variantes(lote)
+                variantes += len(lote)
+                lote = []
+        if lote:
+            postings += indexar_variantes(lote)
+            variantes += len(lote)
+
+        self.stdout.write(self.style.SUCCESS(f"Facetas reconstruidas: {variantes} variantes, {postings} postings."))
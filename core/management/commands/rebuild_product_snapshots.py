@@ -0,0 +1,55 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+
+from core.models import Producto
+from core.services.snapshots import reconstruir
+
+
+def _lotes(chunk):
+    lote = []
+    for producto_id in Producto.objects.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=chunk):
+        lote.append(producto_id)
+        if len(lote) >= chunk:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def _reconstruir_lote(producto_ids):
+    return len(producto_ids), reconstruir(producto_ids)
+
+
+class Command(BaseCommand):
+    help = "Regenera los snapshots de detalle (ProductoSnapshot) de todos los productos."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk', type=int, default=500, help='Productos procesados por lote.')
+        parser.add_argument(
+            '--parallel', type=int, default=1,
+            help='Procesos que reconstruyen lotes a la vez (1 = en este proceso).',
+        )
+
+    def handle(self, *args, **options):
+        chunk, paralelo = options['chunk'], max(options['parallel'], 1)
+        productos = escritos = 0
+        if paralelo == 1:
+            for leidos, cambiados in map(_reconstruir_lote, _lotes(chunk)):
+                productos += leidos
+                escritos += cambiados
+        else:
+            # spawn: los hijos no heredan las conexiones abiertas del proceso padre
+            with ProcessPoolExecutor(
+                max_workers=paralelo,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            ) as pool:
+                for leidos, cambiados in pool.map(_reconstruir_lote, _lotes(chunk)):
+                    productos += leidos
+                    escritos += cambiados
+        self.stdout.write(self.style.SUCCESS(
+            f"Snapshots reconstruidos: {productos} productos, {escritos} actualizados."
+        ))
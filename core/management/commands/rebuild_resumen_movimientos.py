@@ -0,0 +1,52 @@
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from core.models import MovimientoInventario, MovimientoResumenDiario
+from core.services.stock import acumular_resumenes
+
+
+class Command(BaseCommand):
+    help = "Reconstruye el rollup diario (MovimientoResumenDiario) desde el ledger de MovimientoInventario."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help='Fecha AAAA-MM-DD: solo recalcula desde ese día en adelante.')
+        parser.add_argument('--chunk', type=int, default=5000, help='Filas del rollup escritas por lote.')
+
+    def handle(self, *args, **options):
+        chunk = options['chunk']
+        resumenes = MovimientoResumenDiario.objects.all()
+        movimientos = MovimientoInventario.objects.all()
+        if options['desde']:
+            desde = parse_date(options['desde'])
+            if desde is None:
+                raise CommandError("--desde debe tener formato AAAA-MM-DD")
+            resumenes = resumenes.filter(fecha__gte=desde)
+            movimientos = movimientos.filter(fecha__gte=timezone.make_aware(datetime.combine(desde, time.min)))
+
+        total = 0
+        with transaction.atomic():
+            borrados, _ = resumenes.delete()
+            # Orden de inserción por variante: un grupo (variante, día) nunca reaparece tras escribirse
+            pendientes, variante_actual = {}, None
+            for mov in movimientos.order_by('variante_id', 'pk').only(
+                'variante_id', 'tipo', 'cantidad', 'saldo_despues', 'total_costo', 'fecha'
+            ).iterator(chunk_size=chunk):
+                if mov.variante_id != variante_actual and len(pendientes) >= chunk:
+                    total += self._escribir(pendientes)
+                variante_actual = mov.variante_id
+                acumular_resumenes(pendientes, [mov])
+            total += self._escribir(pendientes)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rollup reconstruido: {total} filas (se reemplazaron {borrados})."
+        ))
+
+    def _escribir(self, pendientes):
+        MovimientoResumenDiario.objects.bulk_create(pendientes.values(), batch_size=1000)
+        escritas = len(pendientes)
+        pendientes.clear()
+        return escritas
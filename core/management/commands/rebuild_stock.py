@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from core.models import MovimientoInventario, ProductoVariante, StockVariante
+from core.services.stock import totales_desde_ledger
+
+
+class Command(BaseCommand):
+    help = "Reconstruye StockVariante desde el ledger de MovimientoInventario."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk', type=int, default=5000, help='Variantes escritas por lote.')
+        parser.add_argument(
+            '--sincronizar-variantes',
+            action='store_true',
+            help='Copia además el disponible a ProductoVariante.stock.',
+        )
+
+    def handle(self, *args, **options):
+        chunk = options['chunk']
+        total = 0
+        lote = []
+        ahora = timezone.now()
+
+        # iterator() usa un cursor de servidor en PostgreSQL: memoria constante
+        for fila in totales_desde_ledger().iterator(chunk_size=chunk):
+            lote.append(StockVariante(
+                variante_id=fila['variante_id'],
+                fisico=fila['fisico'],
+                reservado=fila['reservado'],
+                fecha_actualizacion=ahora,
+            ))
+            if len(lote) >= chunk:
+                total += self._escribir(lote)
+                lote = []
+        if lote:
+            total += self._escribir(lote)
+
+        # Variantes que ya no tienen movimientos en el ledger
+        sin_movimientos = StockVariante.objects.exclude(
+            pk__in=MovimientoInventario.objects.values('variante_id')
+        ).update(fisico=0, reservado=0, fecha_actualizacion=ahora)
+
+        if options['sincronizar_variantes']:
+            disponible = StockVariante.objects.filter(pk=OuterRef('pk')).values('disponible')[:1]
+            ProductoVariante.objects.update(stock=Coalesce(Subquery(disponible), Value(0)))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Stock reconstruido: {total} variantes con movimientos, {sin_movimientos} puestas a cero."
+        ))
+
+    def _escribir(self, lote):
+        with transaction.atomic():
+            StockVariante.objects.bulk_create(
+                lote,
+                update_conflicts=True,
+                unique_fields=['variante'],
+                update_fields=['fisico', 'reservado', 'fecha_actualizacion'],
+            )
+        return len(lote)
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.services.analitica import refrescar_cubos
+
+
+class Command(BaseCommand):
+    help = (
+        "Actualiza los cubos de ventas (VentaCubo, PromocionCubo) recalculando solo los días "
+        "de los pedidos modificados desde el último watermark."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--completo', action='store_true', help='Recalcula todos los días, ignorando el watermark.')
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        dias, filas = refrescar_cubos(completo=options['completo'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Cubos de ventas actualizados: {dias} días, {filas} filas en {time.monotonic() - inicio:.1f}s."
+        ))
@@ -0,0 +1,122 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections
+
+from core.services.particiones import mantener
+from core.services.trabajos import COLAS, ejecutar, reclamar, registrar_fallo
+
+
+class Command(BaseCommand):
+    help = (
+        "Worker de la cola de ImportJob/ExportJob: reclama trabajos con FOR UPDATE SKIP LOCKED "
+        "y los ejecuta en un pool de procesos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrencia', type=int, default=getattr(settings, 'TRABAJOS_CONCURRENCIA', 2),
+            help='Trabajos ejecutándose a la vez en este worker.',
+        )
+        parser.add_argument(
+            '--colas', nargs='+', choices=sorted(COLAS), default=sorted(COLAS),
+            help='Colas que atiende este worker.',
+        )
+        parser.add_argument('--intervalo', type=float, default=2.0, help='Segundos entre consultas a la cola.')
+        parser.add_argument(
+            '--una-vez', action='store_true',
+            help='Procesa lo que haya disponible y termina (cron, pruebas).',
+        )
+
+    def handle(self, *args, **options):
+        concurrencia = max(options['concurrencia'], 1)
+        colas, intervalo = options['colas'], options['intervalo']
+        trabajador = f"{socket.gethostname()}:{os.getpid()}"
+        self.detenido = False
+        signal.signal(signal.SIGTERM, self._detener)
+        signal.signal(signal.SIGINT, self._detener)
+
+        pool = self._crear_pool(concurrencia)
+        en_curso = {}
+        turno = 0
+        mantenimiento = None
+        self.stdout.write(f"Worker {trabajador} atendiendo {', '.join(colas)} (concurrencia {concurrencia})")
+        try:
+            while True:
+                close_old_connections()
+                if not self.detenido and (
+                    mantenimiento is None
+                    or time.monotonic() - mantenimiento >= getattr(settings, 'TRABAJOS_MANTENIMIENTO_SEGUNDOS', 86400)
+                ):
+                    mantenimiento = time.monotonic()
+                    self._mantener_particiones()
+                if not self.detenido:
+                    # Las colas se recorren por turnos para que ninguna acapare el pool
+                    for i in range(len(colas)):
+                        cola = colas[(turno + i) % len(colas)]
+                        try:
+                            tomados = reclamar(cola, trabajador, concurrencia - len(en_curso))
+                        except DatabaseError as exc:
+                            # Caída o bloqueo momentáneo de la base: se reintenta en la próxima vuelta
+                            self.stderr.write(f"No se pudo consultar la cola {cola}: {exc}")
+                            continue
+                        for pk in tomados:
+                            en_curso[pool.submit(ejecutar, cola, pk, trabajador)] = (cola, pk)
+                    turno += 1
+
+                if not en_curso:
+                    if self.detenido or options['una_vez']:
+                        break
+                    time.sleep(intervalo)
+                    continue
+
+                hechos, _ = wait(en_curso, timeout=intervalo, return_when=FIRST_COMPLETED)
+                roto = False
+                for futuro in hechos:
+                    cola, pk = en_curso.pop(futuro)
+                    try:
+                        estado = futuro.result()
+                    except BrokenProcessPool as exc:
+                        roto = True
+                        estado = registrar_fallo(cola, pk, trabajador, f"El proceso del trabajo terminó: {exc}")
+                    self.stdout.write(f"{cola} #{pk}: {estado}")
+                if roto:
+                    # Un hijo murió: el pool entero queda inutilizable y sus trabajos se reencolan
+                    for futuro in wait(en_curso).done:
+                        cola, pk = en_curso.pop(futuro)
+                        estado = registrar_fallo(cola, pk, trabajador, "El pool de procesos se interrumpió")
+                        self.stdout.write(f"{cola} #{pk}: {estado}")
+                    pool.shutdown(wait=False)
+                    pool = self._crear_pool(concurrencia)
+        finally:
+            pool.shutdown(wait=True)
+
+    def _mantener_particiones(self):
+        # Deja creados los meses próximos de las tablas particionadas (no-op fuera de PostgreSQL).
+        # Los DROP de retención solo con PARTICIONES_BORRAR_EN_WORKER; si no, quedan para mantener_particiones
+        try:
+            for tabla, accion, nombre in mantener(borrar=getattr(settings, 'PARTICIONES_BORRAR_EN_WORKER', False)):
+                self.stdout.write(f"{tabla}: {accion} {nombre or ''}".rstrip())
+        except DatabaseError as exc:
+            self.stderr.write(f"No se pudieron mantener las particiones: {exc}")
+
+    def _crear_pool(self, concurrencia):
+        # spawn: los hijos no heredan las conexiones abiertas del proceso padre
+        return ProcessPoolExecutor(
+            max_workers=concurrencia,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup,
+        )
+
+    def _detener(self, signum, frame):
+        if not self.detenido:
+            self.stdout.write("Deteniendo: se terminan los trabajos en curso y no se toman nuevos.")
+        self.detenido = True
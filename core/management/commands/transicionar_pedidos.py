@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Pedido
+from core.services.pedidos import TRANSICIONES, TransicionInvalida, transicionar
+
+
+class Command(BaseCommand):
+    help = (
+        "Cambia de estado un lote de pedidos por código (por ejemplo, el manifiesto de un "
+        "transportista) con un UPDATE por estado de origen, registrando cada transición."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('estado', choices=sorted(TRANSICIONES), help='Estado destino.')
+        parser.add_argument('--codigos', nargs='*', default=[], help='Códigos de pedido.')
+        parser.add_argument('--archivo', help='Archivo con un código de pedido por línea.')
+        parser.add_argument('--motivo', help='Motivo que queda en el historial.')
+
+    def handle(self, *args, **options):
+        codigos = set(options['codigos'])
+        if options['archivo']:
+            with open(options['archivo'], encoding='utf-8') as archivo:
+                codigos.update(linea.strip() for linea in archivo if linea.strip())
+        if not codigos:
+            raise CommandError("Indique --codigos o --archivo")
+
+        ids = dict(Pedido.objects.filter(codigo__in=codigos).values_list('pk', 'codigo'))
+        try:
+            resultado = transicionar(ids, options['estado'], motivo=options['motivo'])
+        except TransicionInvalida as exc:
+            raise CommandError(str(exc))
+
+        for origen, aplicados in sorted(resultado.aplicados.items()):
+            self.stdout.write(f"{origen} -> {resultado.destino}: {len(aplicados)}")
+        for pk, estado in sorted(resultado.rechazados.items()):
+            self.stderr.write(f"Rechazado {ids[pk]}: está '{estado}'")
+        desconocidos = codigos - set(ids.values())
+        for codigo in sorted(desconocidos):
+            self.stderr.write(f"No existe el pedido {codigo}")
+        self.stdout.write(
+            f"Envíos actualizados: {resultado.envios}. Operación {resultado.operacion}."
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Pedidos transicionados: {resultado.total_aplicados} de {len(codigos)}"
+        ))
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_usuario_email_verificado_emailverificationtoken'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='carrito',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['session_id'], name='carrito_session_activo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lote',
+            index=models.Index(condition=models.Q(('cantidad_disponible__gt', 0)), fields=['variante', 'fecha_vencimiento'], name='lote_variante_venc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimientoinventario',
+            index=models.Index(fields=['variante', '-fecha'], name='movinv_variante_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['usuario', '-fecha_pedido'], name='pedido_usuario_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['estado', '-fecha_pedido'], name='pedido_estado_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='promocion',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['fecha_inicio', 'fecha_fin'], name='promocion_vigencia_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='refreshtoken',
+            index=models.Index(condition=models.Q(('revoked', False)), fields=['user', 'expires'], name='refreshtoken_user_vigente_idx'),
+        ),
+    ]
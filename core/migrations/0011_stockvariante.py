@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:06
+
+import django.db.models.deletion
+import django.db.models.expressions
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_indices_consultas_frecuentes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockVariante',
+            fields=[
+                ('variante', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock_proyectado', serialize=False, to='core.productovariante')),
+                ('fisico', models.IntegerField(default=0)),
+                ('reservado', models.IntegerField(default=0)),
+                ('disponible', models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(models.F('fisico'), '-', models.F('reservado')), output_field=models.IntegerField())),
+                ('fecha_actualizacion', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
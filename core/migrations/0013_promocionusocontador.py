@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_contadorversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PromocionUsoContador',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField(default=0)),
+                ('usos', models.IntegerField(default=0)),
+                ('limite', models.IntegerField(blank=True, null=True)),
+                ('promocion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='contadores_uso', to='core.promocion')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('promocion', 'shard'), name='promocion_uso_shard_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:10
+
+from django.db import migrations, models
+
+
+# Copia de la reconstrucción de core.services.categorias tal como era en esta
+# migración: el servicio puede cambiar y la migración no debe hacerlo.
+ANCHO_SEGMENTO = 10
+MAX_NIVELES = 255 // (ANCHO_SEGMENTO + 1)
+
+
+def calcular_rutas(apps, schema_editor):
+    Categoria = apps.get_model('core', 'Categoria')
+    filas = list(Categoria.objects.values_list('pk', 'id_padre_id'))
+    hijos = {}
+    for pk, padre_id in filas:
+        hijos.setdefault(padre_id, []).append(pk)
+
+    calculadas = {}
+    pendientes = [(pk, '', 0) for pk in hijos.get(None, ())]
+    while pendientes:
+        pk, ruta_padre, profundidad = pendientes.pop()
+        ruta = f"{ruta_padre}{pk:0{ANCHO_SEGMENTO}d}/"
+        calculadas[pk] = (ruta, profundidad)
+        pendientes.extend((hijo, ruta, profundidad + 1) for hijo in hijos.get(pk, ()))
+    # Las atrapadas en un ciclo de id_padre quedan como raíces
+    for pk, _ in filas:
+        calculadas.setdefault(pk, (f"{pk:0{ANCHO_SEGMENTO}d}/", 0))
+
+    profundas = sorted(pk for pk, (_, profundidad) in calculadas.items() if profundidad >= MAX_NIVELES)
+    if profundas:
+        raise ValueError(f"Categorías a más de {MAX_NIVELES} niveles (no caben en ruta): {profundas}")
+    Categoria.objects.bulk_update(
+        [Categoria(pk=pk, ruta=ruta, profundidad=profundidad) for pk, (ruta, profundidad) in calculadas.items()],
+        ['ruta', 'profundidad'],
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_promocionusocontador'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categoria',
+            name='profundidad',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='categoria',
+            name='ruta',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='categoria',
+            index=models.Index(fields=['ruta'], name='categoria_ruta_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(calcular_rutas, migrations.RunPython.noop),
+    ]
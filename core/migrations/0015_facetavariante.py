@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_categoria_ruta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetaVariante',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('valor', models.CharField(max_length=255)),
+                ('atributo', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='core.atributo')),
+                ('variante', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facetas', to='core.productovariante')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('atributo', 'valor', 'variante'), name='faceta_posting_unica')],
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:12
+
+import django.contrib.postgres.search
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def crear_indices_postgres(apps, schema_editor):
+    # GIN sobre el tsvector y trigramas para SKUs y errores de tipeo; en otros
+    # motores la búsqueda usa el índice invertido en memoria.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX productobusqueda_doc_gin ON core_productobusqueda USING gin (documento)'
+    )
+    schema_editor.execute(
+        'CREATE INDEX productobusqueda_nombre_trgm ON core_productobusqueda USING gin (nombre gin_trgm_ops)'
+    )
+    schema_editor.execute(
+        'CREATE INDEX productobusqueda_skus_trgm ON core_productobusqueda USING gin (skus gin_trgm_ops)'
+    )
+
+
+def eliminar_indices_postgres(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for nombre in ('productobusqueda_doc_gin', 'productobusqueda_nombre_trgm', 'productobusqueda_skus_trgm'):
+        schema_editor.execute(f'DROP INDEX IF EXISTS {nombre}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_facetavariante'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductoBusqueda',
+            fields=[
+                ('producto', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='busqueda', serialize=False, to='core.producto')),
+                ('nombre', models.TextField(default='')),
+                ('skus', models.TextField(default='')),
+                ('marca', models.TextField(default='')),
+                ('categoria', models.TextField(default='')),
+                ('descripcion', models.TextField(default='')),
+                ('documento', django.contrib.postgres.search.SearchVectorField(null=True)),
+                ('fecha_actualizacion', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(crear_indices_postgres, eliminar_indices_postgres),
+    ]
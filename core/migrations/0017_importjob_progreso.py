@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_productobusqueda'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='filas_con_error',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='filas_procesadas',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='importjob',
+            name='status',
+            field=models.CharField(choices=[('pendiente', 'Pendiente'), ('procesando', 'Procesando'), ('completado', 'Completado'), ('completado_con_errores', 'Completado con errores'), ('error', 'Error')], default='pendiente', max_length=50),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_importjob_progreso'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportjob',
+            name='filas_exportadas',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='exportjob',
+            name='status',
+            field=models.CharField(choices=[('pendiente', 'Pendiente'), ('procesando', 'Procesando'), ('completado', 'Completado'), ('error', 'Error')], default='pendiente', max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='exportjob',
+            name='url_archivo',
+            field=models.URLField(blank=True, max_length=1024, null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+from core.migrations._particiones import desparticionar_tabla, en_migracion, es_particionada, particionar_tabla
+
+
+def particionar(apps, schema_editor):
+    # Solo PostgreSQL y con PARTICIONES_EN_MIGRACION: la copia bloquea la tabla.
+    # Si no, se convierte aparte con manage.py particionar_tabla core_logaccion
+    if not en_migracion(schema_editor):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        particionar_tabla(cursor, 'core_logaccion', 'fecha')
+
+
+def desparticionar(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        if es_particionada(cursor, 'core_logaccion'):
+            desparticionar_tabla(cursor, 'core_logaccion', 'fecha')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_cola_trabajos'),
+    ]
+
+    operations = [
+        migrations.RunPython(particionar, desparticionar),
+    ]
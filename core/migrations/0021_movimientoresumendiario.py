@@ -0,0 +1,35 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_particionar_logaccion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovimientoResumenDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('entradas', models.IntegerField(default=0)),
+                ('salidas', models.IntegerField(default=0)),
+                ('ajustes', models.IntegerField(default=0)),
+                ('reservas', models.IntegerField(default=0)),
+                ('devoluciones', models.IntegerField(default=0)),
+                ('movimientos', models.IntegerField(default=0)),
+                ('saldo_cierre', models.IntegerField(default=0)),
+                ('costo_entradas', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('costo_salidas', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('variante', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes_diarios', to='core.productovariante')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['fecha'], name='movresumen_fecha_idx')],
+                'constraints': [models.UniqueConstraint(fields=('variante', 'fecha'), name='movresumen_variante_fecha_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:23
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_particionar_movimientoinventario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PuntoControl',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=100, unique=True)),
+                ('fecha', models.DateTimeField(blank=True, null=True)),
+                ('ultimo_id', models.BigIntegerField(default=0)),
+                ('fecha_actualizacion', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='pedido',
+            name='fecha_actualizacion',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.CreateModel(
+            name='PromocionCubo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('pedidos', models.IntegerField(default=0)),
+                ('unidades', models.IntegerField(default=0)),
+                ('descuento_items', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('descuento_pedido', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('ingreso_neto', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('promocion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.promocion')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('fecha', 'promocion'), name='promocioncubo_fecha_promo_unico')],
+            },
+        ),
+        migrations.CreateModel(
+            name='VentaCubo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('pedidos', models.IntegerField(default=0)),
+                ('unidades', models.IntegerField(default=0)),
+                ('ingreso_bruto', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('descuento', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('descuento_promocion', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('ingreso_neto', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('costo', models.DecimalField(decimal_places=4, default=0, max_digits=16)),
+                ('unidades_sin_costo', models.IntegerField(default=0)),
+                ('categoria', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.categoria')),
+                ('marca', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.marca')),
+                ('variante', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.productovariante')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['fecha', 'categoria'], name='ventacubo_fecha_categoria_idx'), models.Index(fields=['fecha', 'marca'], name='ventacubo_fecha_marca_idx')],
+                'constraints': [models.UniqueConstraint(fields=('fecha', 'variante'), name='ventacubo_fecha_variante_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:25
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_cubos_ventas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CostoVariante',
+            fields=[
+                ('variante', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='costo', serialize=False, to='core.productovariante')),
+                ('metodo', models.CharField(choices=[('promedio', 'Promedio ponderado móvil'), ('fifo', 'FIFO por lote')], max_length=10)),
+                ('cantidad', models.BigIntegerField(default=0)),
+                ('valor', models.DecimalField(decimal_places=4, default=0, max_digits=18)),
+                ('costo_unitario', models.DecimalField(decimal_places=4, default=0, max_digits=12)),
+                ('capas', models.TextField(blank=True, null=True)),
+                ('fecha_actualizacion', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='movimientoinventario',
+            name='pedido_item',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movimientos', to='core.pedidoitem'),
+        ),
+        migrations.AddField(
+            model_name='pedidoitem',
+            name='costo_total',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=16, null=True),
+        ),
+        migrations.CreateModel(
+            name='ValorizacionInventario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateTimeField()),
+                ('metodo', models.CharField(choices=[('promedio', 'Promedio ponderado móvil'), ('fifo', 'FIFO por lote')], max_length=10)),
+                ('cantidad', models.BigIntegerField()),
+                ('valor', models.DecimalField(decimal_places=4, max_digits=18)),
+                ('costo_unitario', models.DecimalField(decimal_places=4, max_digits=12)),
+                ('variante', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.productovariante')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['fecha', 'variante'], name='valorizacion_fecha_idx')],
+            },
+        ),
+    ]
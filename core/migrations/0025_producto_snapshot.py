@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:32
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_costeo_inventario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductoSnapshot',
+            fields=[
+                ('producto', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='snapshot', serialize=False, to='core.producto')),
+                ('documento', models.BinaryField()),
+                ('huella', models.CharField(max_length=40)),
+                ('fecha_actualizacion', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
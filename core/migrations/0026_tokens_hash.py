@@ -0,0 +1,87 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:34
+
+import hashlib
+import uuid
+from django.db import migrations, models
+
+
+def hashear_tokens(apps, schema_editor):
+    # Los tokens vigentes siguen sirviendo: se guarda su hash y se borra el valor en claro.
+    # Cada RefreshToken existente pasa a ser su propia familia.
+    for nombre, familia in (('RefreshToken', True), ('EmailVerificationToken', False)):
+        modelo = apps.get_model('core', nombre)
+        campos = ['token', 'token_hash', 'family'] if familia else ['token', 'token_hash']
+        lote = []
+        for fila in modelo.objects.only('pk', 'token').order_by('pk').iterator(chunk_size=2000):
+            if fila.token:
+                fila.token_hash = hashlib.sha256(str(fila.token).encode()).hexdigest()
+                fila.token = None
+            if familia:
+                fila.family = uuid.uuid4()
+            lote.append(fila)
+            if len(lote) >= 2000:
+                modelo.objects.bulk_update(lote, campos)
+                lote = []
+        modelo.objects.bulk_update(lote, campos)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_producto_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailverificationtoken',
+            name='token_hash',
+            field=models.CharField(max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='refreshtoken',
+            name='family',
+            field=models.UUIDField(null=True),
+        ),
+        migrations.AddField(
+            model_name='refreshtoken',
+            name='rotated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='refreshtoken',
+            name='token_hash',
+            field=models.CharField(max_length=64, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='emailverificationtoken',
+            name='token',
+            field=models.CharField(blank=True, default=None, max_length=128, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='refreshtoken',
+            name='token',
+            field=models.CharField(blank=True, default=None, max_length=128, null=True, unique=True),
+        ),
+        migrations.RunPython(hashear_tokens, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='refreshtoken',
+            name='family',
+            field=models.UUIDField(default=uuid.uuid4),
+        ),
+        migrations.AddIndex(
+            model_name='emailverificationtoken',
+            index=models.Index(condition=models.Q(('used', False)), fields=['user'], name='emailtoken_user_pendiente_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='emailverificationtoken',
+            index=models.Index(fields=['expires'], name='emailtoken_expires_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='refreshtoken',
+            index=models.Index(condition=models.Q(('revoked', False)), fields=['family'], name='refreshtoken_family_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='refreshtoken',
+            index=models.Index(fields=['expires'], name='refreshtoken_expires_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_tokens_hash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='carrito',
+            index=models.Index(fields=['activo', 'fecha_actualizacion'], name='carrito_activo_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:38
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_carrito_actividad'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservaStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cantidad', models.IntegerField()),
+                ('expira', models.DateTimeField()),
+                ('fecha_creacion', models.DateTimeField(default=django.utils.timezone.now)),
+                ('carrito_item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='core.carritoitem')),
+                ('pedido', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservas_temporales', to='core.pedido')),
+                ('variante', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas_temporales', to='core.productovariante')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['variante', 'expira'], name='reserva_variante_expira_idx'), models.Index(fields=['expira'], name='reserva_expira_idx')],
+                'constraints': [models.CheckConstraint(condition=models.Q(('cantidad__gt', 0)), name='reserva_cantidad_positiva'), models.CheckConstraint(condition=models.Q(('carrito_item__isnull', False), ('pedido__isnull', False), _connector='OR'), name='reserva_con_titular')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:39
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0028_reservas_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PedidoTransicion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('estado_anterior', models.CharField(choices=[('pendiente', 'Pendiente'), ('pagado', 'Pagado'), ('preparando', 'Preparando'), ('enviado', 'Enviado'), ('entregado', 'Entregado'), ('cancelado', 'Cancelado')], max_length=20)),
+                ('estado_nuevo', models.CharField(choices=[('pendiente', 'Pendiente'), ('pagado', 'Pagado'), ('preparando', 'Preparando'), ('enviado', 'Enviado'), ('entregado', 'Entregado'), ('cancelado', 'Cancelado')], max_length=20)),
+                ('operacion', models.UUIDField()),
+                ('motivo', models.CharField(blank=True, max_length=255, null=True)),
+                ('fecha', models.DateTimeField(default=django.utils.timezone.now)),
+                ('pedido', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transiciones', to='core.pedido')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.usuario')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['pedido', 'fecha'], name='pedidotransicion_pedido_idx'), models.Index(fields=['operacion'], name='pedidotransicion_op_idx')],
+            },
+        ),
+    ]
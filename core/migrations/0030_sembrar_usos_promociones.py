@@ -0,0 +1,39 @@
+from django.db import migrations
+from django.db.models import Count, Q
+
+
+def sembrar_usos(apps, schema_editor):
+    """
+    Lleva los contadores de las promociones con max_usos a los usos ya
+    registrados en PromocionAplicada (pedidos no cancelados) y reparte el
+    cupo restante entre sus shards, como core.services.cupones.configurar_contador.
+    """
+    Promocion = apps.get_model('core', 'Promocion')
+    PromocionUsoContador = apps.get_model('core', 'PromocionUsoContador')
+    registrados = (
+        Promocion.objects.filter(max_usos__isnull=False)
+        .annotate(usos=Count('promocionaplicada', filter=~Q(promocionaplicada__pedido__estado='cancelado')))
+        .values_list('pk', 'max_usos', 'usos')
+    )
+    for promocion_id, max_usos, usos in registrados.iterator():
+        PromocionUsoContador.objects.get_or_create(promocion_id=promocion_id, shard=0)
+        filas = list(PromocionUsoContador.objects.filter(promocion_id=promocion_id).order_by('shard'))
+        contados = sum(fila.usos for fila in filas)
+        # Los usos contados desde que existe el contador también están en PromocionAplicada
+        filas[0].usos += max(usos - contados, 0)
+        restante = max(max_usos - max(usos, contados), 0)
+        base, resto = divmod(restante, len(filas))
+        for i, fila in enumerate(filas):
+            fila.limite = fila.usos + base + (1 if i < resto else 0)
+        PromocionUsoContador.objects.bulk_update(filas, ['usos', 'limite'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0029_pedido_transiciones'),
+    ]
+
+    operations = [
+        migrations.RunPython(sembrar_usos, migrations.RunPython.noop),
+    ]
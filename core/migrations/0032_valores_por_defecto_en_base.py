@@ -0,0 +1,72 @@
+# Generated by Django 5.2.7 on 2026-10-17 20:05
+
+import core.models
+import django.db.models.functions.datetime
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0031_movimientoinventario_fecha_registro'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='categoria',
+            name='profundidad',
+            field=models.PositiveSmallIntegerField(db_default=0, default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='categoria',
+            name='ruta',
+            field=models.CharField(db_default='', default='', editable=False, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='exportjob',
+            name='disponible_desde',
+            field=models.DateTimeField(db_default=django.db.models.functions.datetime.Now(), default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='exportjob',
+            name='filas_exportadas',
+            field=models.BigIntegerField(db_default=0, default=0),
+        ),
+        migrations.AlterField(
+            model_name='exportjob',
+            name='intentos',
+            field=models.PositiveSmallIntegerField(db_default=0, default=0),
+        ),
+        migrations.AlterField(
+            model_name='importjob',
+            name='disponible_desde',
+            field=models.DateTimeField(db_default=django.db.models.functions.datetime.Now(), default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='importjob',
+            name='filas_con_error',
+            field=models.IntegerField(db_default=0, default=0),
+        ),
+        migrations.AlterField(
+            model_name='importjob',
+            name='filas_procesadas',
+            field=models.IntegerField(db_default=0, default=0),
+        ),
+        migrations.AlterField(
+            model_name='importjob',
+            name='intentos',
+            field=models.PositiveSmallIntegerField(db_default=0, default=0),
+        ),
+        migrations.AlterField(
+            model_name='pedido',
+            name='fecha_actualizacion',
+            field=models.DateTimeField(auto_now=True, db_default=django.db.models.functions.datetime.Now(), db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='refreshtoken',
+            name='family',
+            field=models.UUIDField(db_default=core.models.UUIDAleatorio(), default=uuid.uuid4),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 20:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0032_valores_por_defecto_en_base'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='promocionaplicada',
+            name='shard_uso',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+    ]
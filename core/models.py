@@ -1,6 +1,19 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.functions import Now
 from django.utils import timezone
 import uuid
+
+
+class UUIDAleatorio(models.Func):
+    # db_default de UUIDField: gen_random_uuid() (PostgreSQL 13+); en SQLite el UUID se guarda como 32 hex
+    function = 'gen_random_uuid'
+    output_field = models.UUIDField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return 'lower(hex(randomblob(16)))', []
+
+
 # -----------------------------
 # 1) Usuarios y Roles
 # -----------------------------
@@ -40,24 +53,45 @@ class Usuario(models.Model):
         return f"{self.nombre} {self.apellido}"
 
 class RefreshToken(models.Model):
-    token = models.CharField(max_length=128, unique=True, default=uuid.uuid4)
+    # Solo se guarda el SHA-256 (hex) del token: ver core.services.tokens.
+    # `token` (valor en claro) queda nulo; si una versión anterior escribe una fila con
+    # token y sin hash, se valida por `token` y `family` sale del default de la base.
+    token = models.CharField(max_length=128, unique=True, null=True, blank=True, default=None)
+    token_hash = models.CharField(max_length=64, unique=True, null=True)
+    # Cadena de rotación: todos los tokens emitidos a partir del mismo login
+    family = models.UUIDField(default=uuid.uuid4, db_default=UUIDAleatorio())
     user = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='refresh_tokens')
     created = models.DateTimeField(auto_now_add=True)
     expires = models.DateTimeField()
     revoked = models.BooleanField(default=False)
+    rotated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Validación de sesiones: solo interesan los tokens no revocados
+            models.Index(fields=['user', 'expires'], condition=models.Q(revoked=False), name='refreshtoken_user_vigente_idx'),
+            # Revocación de una familia en un solo UPDATE
+            models.Index(fields=['family'], condition=models.Q(revoked=False), name='refreshtoken_family_idx'),
+            # Purga por lotes de vencidos
+            models.Index(fields=['expires'], name='refreshtoken_expires_idx'),
+        ]
 
     def is_expired(self):
         return self.expires < timezone.now() or self.revoked
 
     def __str__(self):
-        return f'{self.user.email} - {self.token}'
+        return f'{self.user.email} - {self.family}'
 
 class EmailVerificationToken(models.Model):
+    # Igual que RefreshToken: solo el SHA-256 del token (core.services.tokens)
     token = models.CharField(
         max_length=128,
         unique=True,
-        default=uuid.uuid4
+        null=True,
+        blank=True,
+        default=None
     )
+    token_hash = models.CharField(max_length=64, unique=True, null=True)
     user = models.ForeignKey(
         Usuario,
         on_delete=models.CASCADE,
@@ -70,12 +104,17 @@ class EmailVerificationToken(models.Model):
 
     class Meta:
         db_table = 'core_email_verification_token'
+        indexes = [
+            # Anular los pendientes de un usuario al emitir uno nuevo
+            models.Index(fields=['user'], condition=models.Q(used=False), name='emailtoken_user_pendiente_idx'),
+            models.Index(fields=['expires'], name='emailtoken_expires_idx'),
+        ]
 
     def is_expired(self):
         return self.expires < timezone.now() or self.used
 
     def __str__(self):
-        return f'{self.user.email} - {self.token}'
+        return f'{self.user.email} - {self.created:%Y-%m-%d %H:%M}'
 
 # -----------------------------
 # 2) Catálogo de productos
@@ -86,6 +125,16 @@ class Categoria(models.Model):
     id_padre = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='subcategorias')
     descripcion = models.TextField(null=True, blank=True)
     imagen_url_base = models.CharField(max_length=500, null=True, blank=True)
+    # Ruta materializada (ids de ancestros con ancho fijo, ej. "0000000001/0000000007/"),
+    # mantenida por core.services.categorias al guardar, mover o borrar.
+    ruta = models.CharField(max_length=255, default='', db_default='', editable=False)
+    profundidad = models.PositiveSmallIntegerField(default=0, db_default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # varchar_pattern_ops permite usar el índice en LIKE 'prefijo%' con cualquier collation
+            models.Index(fields=['ruta'], name='categoria_ruta_idx', opclasses=['varchar_pattern_ops']),
+        ]
 
     def __str__(self):
         return self.nombre
@@ -177,6 +226,44 @@ class VarianteAtributo(models.Model):
         unique_together = ('variante', 'atributo')
 
 
+class FacetaVariante(models.Model):
+    # Índice invertido de facetas: una fila (posting) por variante activa y valor
+    # normalizado de cada atributo, heredando los de ProductoAtributo.
+    # Mantenido por core.services.facetas.
+    atributo = models.ForeignKey(Atributo, on_delete=models.CASCADE, db_index=False)
+    valor = models.CharField(max_length=255)
+    variante = models.ForeignKey(ProductoVariante, on_delete=models.CASCADE, related_name='facetas')
+
+    class Meta:
+        constraints = [
+            # También sirve de índice de las posting lists (atributo, valor) -> variantes
+            models.UniqueConstraint(fields=['atributo', 'valor', 'variante'], name='faceta_posting_unica'),
+        ]
+
+
+class ProductoBusqueda(models.Model):
+    # Documento de búsqueda por producto, mantenido por core.services.busqueda.
+    # En PostgreSQL `documento` es un tsvector con índice GIN y los textos tienen
+    # índices de trigramas (creados en la migración solo en ese motor).
+    producto = models.OneToOneField(Producto, on_delete=models.CASCADE, primary_key=True, related_name='busqueda')
+    nombre = models.TextField(default='')
+    skus = models.TextField(default='')
+    marca = models.TextField(default='')
+    categoria = models.TextField(default='')
+    descripcion = models.TextField(default='')
+    documento = SearchVectorField(null=True)
+    fecha_actualizacion = models.DateTimeField(default=timezone.now)
+
+
+class ProductoSnapshot(models.Model):
+    # Ficha de detalle desnormalizada (JSON compacto comprimido con zlib),
+    # mantenida por core.services.snapshots.
+    producto = models.OneToOneField(Producto, on_delete=models.CASCADE, primary_key=True, related_name='snapshot')
+    documento = models.BinaryField()
+    huella = models.CharField(max_length=40)
+    fecha_actualizacion = models.DateTimeField(default=timezone.now)
+
+
 class Imagen(models.Model):
     producto = models.ForeignKey(Producto, null=True, blank=True, on_delete=models.CASCADE)
     variante = models.ForeignKey(ProductoVariante, null=True, blank=True, on_delete=models.CASCADE)
@@ -245,6 +332,12 @@ class Lote(models.Model):
     fecha_vencimiento = models.DateField(null=True, blank=True)
     id_almacen = models.IntegerField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Selección FEFO: lotes con saldo de una variante ordenados por vencimiento
+            models.Index(fields=['variante', 'fecha_vencimiento'], condition=models.Q(cantidad_disponible__gt=0), name='lote_variante_venc_idx'),
+        ]
+
 
 class MovimientoInventario(models.Model):
     TIPOS = [
@@ -264,6 +357,110 @@ class MovimientoInventario(models.Model):
     motivo = models.CharField(max_length=255, null=True, blank=True)
     usuario = models.ForeignKey(Usuario, null=True, blank=True, on_delete=models.SET_NULL)
     fecha = models.DateTimeField(default=timezone.now)
+    # Momento real del INSERT (la fecha puede venir retroactiva, p. ej. en importaciones): lo usa el costeo
+    fecha_registro = models.DateTimeField(db_default=Now(), editable=False)
+    # Ítem de pedido que originó la salida: el costeo le asigna su costo de venta
+    pedido_item = models.ForeignKey('PedidoItem', null=True, blank=True, on_delete=models.SET_NULL, related_name='movimientos')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['variante', '-fecha'], name='movinv_variante_fecha_idx'),
+        ]
+
+
+class ReservaStock(models.Model):
+    # Retención temporal de stock para un item de carrito o un pedido (ver
+    # core.services.reservas). Vencida deja de contar aunque la fila siga ahí;
+    # la purga en bloque es solo limpieza.
+    variante = models.ForeignKey(ProductoVariante, on_delete=models.CASCADE, related_name='reservas_temporales')
+    cantidad = models.IntegerField()
+    expira = models.DateTimeField()
+    carrito_item = models.ForeignKey('CarritoItem', null=True, blank=True, on_delete=models.CASCADE, related_name='reservas')
+    pedido = models.ForeignKey('Pedido', null=True, blank=True, on_delete=models.CASCADE, related_name='reservas_temporales')
+    fecha_creacion = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Retenido vigente por variante: SUM(cantidad) WHERE variante = %s AND expira > now()
+            models.Index(fields=['variante', 'expira'], name='reserva_variante_expira_idx'),
+            models.Index(fields=['expira'], name='reserva_expira_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(condition=models.Q(cantidad__gt=0), name='reserva_cantidad_positiva'),
+            models.CheckConstraint(
+                condition=models.Q(carrito_item__isnull=False) | models.Q(pedido__isnull=False),
+                name='reserva_con_titular',
+            ),
+        ]
+
+
+class StockVariante(models.Model):
+    # Proyección del stock por variante, mantenida desde MovimientoInventario
+    # (ver core.services.stock). Las lecturas del catálogo son una búsqueda por PK.
+    variante = models.OneToOneField(ProductoVariante, on_delete=models.CASCADE, primary_key=True, related_name='stock_proyectado')
+    fisico = models.IntegerField(default=0)
+    reservado = models.IntegerField(default=0)
+    disponible = models.GeneratedField(
+        expression=models.F('fisico') - models.F('reservado'),
+        output_field=models.IntegerField(),
+        db_persist=True,
+    )
+    fecha_actualizacion = models.DateTimeField(default=timezone.now)
+
+
+class MovimientoResumenDiario(models.Model):
+    # Rollup diario por variante de MovimientoInventario, mantenido junto con el
+    # ledger (ver core.services.stock). Historial y reportes leen de aquí.
+    variante = models.ForeignKey(ProductoVariante, on_delete=models.CASCADE, related_name='resumenes_diarios')
+    fecha = models.DateField()
+    entradas = models.IntegerField(default=0)
+    salidas = models.IntegerField(default=0)
+    ajustes = models.IntegerField(default=0)  # con signo
+    reservas = models.IntegerField(default=0)  # con signo (las liberaciones restan)
+    devoluciones = models.IntegerField(default=0)
+    movimientos = models.IntegerField(default=0)
+    saldo_cierre = models.IntegerField(default=0)  # saldo_despues del último movimiento del día
+    costo_entradas = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    costo_salidas = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['variante', 'fecha'], name='movresumen_variante_fecha_unico'),
+        ]
+        indexes = [
+            models.Index(fields=['fecha'], name='movresumen_fecha_idx'),
+        ]
+
+
+class CostoVariante(models.Model):
+    # Estado del costeo por variante (core.services.costeo): existencias valorizadas
+    # y, con FIFO, las capas pendientes como JSON [[lote_id, cantidad, costo_unitario], ...]
+    METODOS = [
+        ('promedio', 'Promedio ponderado móvil'),
+        ('fifo', 'FIFO por lote'),
+    ]
+    variante = models.OneToOneField(ProductoVariante, on_delete=models.CASCADE, primary_key=True, related_name='costo')
+    metodo = models.CharField(max_length=10, choices=METODOS)
+    cantidad = models.BigIntegerField(default=0)
+    valor = models.DecimalField(max_digits=18, decimal_places=4, default=0)
+    costo_unitario = models.DecimalField(max_digits=12, decimal_places=4, default=0)  # promedio vigente o último costo
+    capas = models.TextField(null=True, blank=True)
+    fecha_actualizacion = models.DateTimeField(default=timezone.now)
+
+
+class ValorizacionInventario(models.Model):
+    # Foto de CostoVariante en un instante, para reportes de valorización
+    fecha = models.DateTimeField()
+    metodo = models.CharField(max_length=10, choices=CostoVariante.METODOS)
+    variante = models.ForeignKey(ProductoVariante, on_delete=models.CASCADE)
+    cantidad = models.BigIntegerField()
+    valor = models.DecimalField(max_digits=18, decimal_places=4)
+    costo_unitario = models.DecimalField(max_digits=12, decimal_places=4)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['fecha', 'variante'], name='valorizacion_fecha_idx'),
+        ]
 
 
 # -----------------------------
@@ -291,7 +488,13 @@ class Promocion(models.Model):
     # Reglas
     min_compra = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
     max_usos = models.IntegerField(null=True, blank=True)
-    
+
+    class Meta:
+        indexes = [
+            # Promociones vigentes: el filtro siempre incluye activo=True
+            models.Index(fields=['fecha_inicio', 'fecha_fin'], condition=models.Q(activo=True), name='promocion_vigencia_idx'),
+        ]
+
     def __str__(self):
         return self.nombre
 
@@ -329,6 +532,21 @@ class PromocionProducto(models.Model):
         return f"{self.promocion.nombre} → {target}"
 
 
+class PromocionUsoContador(models.Model):
+    # Contador de usos de una promoción repartido en shards: cada shard tiene su
+    # parte del cupo (limite) y se incrementa con un UPDATE condicional, así un
+    # cupón muy usado no hace esperar a todos los checkouts por la misma fila.
+    promocion = models.ForeignKey(Promocion, on_delete=models.CASCADE, related_name='contadores_uso')
+    shard = models.PositiveSmallIntegerField(default=0)
+    usos = models.IntegerField(default=0)
+    limite = models.IntegerField(null=True, blank=True)  # NULL = sin límite
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['promocion', 'shard'], name='promocion_uso_shard_unico'),
+        ]
+
+
 # -----------------------------
 # 4) Carritos, Pedidos y Pagos (Sección Modificada)
 # -----------------------------
@@ -345,6 +563,14 @@ class Carrito(models.Model):
     # Para saber cuánto descontar al final sin recalcular todo cada vez
     descuento_global_aplicado = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
 
+    class Meta:
+        indexes = [
+            # Búsqueda del carrito anónimo vigente por sesión
+            models.Index(fields=['session_id'], condition=models.Q(activo=True), name='carrito_session_activo_idx'),
+            # Barrido de inactivos y purga de desactivados (core.services.carrito)
+            models.Index(fields=['activo', 'fecha_actualizacion'], name='carrito_activo_fecha_idx'),
+        ]
+
 
 class CarritoItem(models.Model):
     carrito = models.ForeignKey(Carrito, on_delete=models.CASCADE)
@@ -374,6 +600,31 @@ class Pedido(models.Model):
     metodo_pago = models.CharField(max_length=50, null=True, blank=True)
     direccion_envio = models.TextField(null=True, blank=True)
     nota = models.TextField(null=True, blank=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True, db_default=Now(), db_index=True)  # watermark de la analítica
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['usuario', '-fecha_pedido'], name='pedido_usuario_fecha_idx'),
+            models.Index(fields=['estado', '-fecha_pedido'], name='pedido_estado_fecha_idx'),
+        ]
+
+
+class PedidoTransicion(models.Model):
+    # Historial de cambios de estado (solo INSERT), escrito por core.services.pedidos.
+    # Las transiciones aplicadas en un mismo lote comparten `operacion`.
+    pedido = models.ForeignKey(Pedido, on_delete=models.CASCADE, related_name='transiciones')
+    estado_anterior = models.CharField(max_length=20, choices=Pedido.ESTADOS)
+    estado_nuevo = models.CharField(max_length=20, choices=Pedido.ESTADOS)
+    operacion = models.UUIDField()
+    usuario = models.ForeignKey(Usuario, null=True, blank=True, on_delete=models.SET_NULL)
+    motivo = models.CharField(max_length=255, null=True, blank=True)
+    fecha = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['pedido', 'fecha'], name='pedidotransicion_pedido_idx'),
+            models.Index(fields=['operacion'], name='pedidotransicion_op_idx'),
+        ]
 
 
 class PromocionAplicada(models.Model):
@@ -382,6 +633,7 @@ class PromocionAplicada(models.Model):
     promocion = models.ForeignKey(Promocion, on_delete=models.PROTECT, null=True, blank=True)
     nombre_snapshot = models.CharField(max_length=150) 
     valor_descuento_aplicado = models.DecimalField(max_digits=12, decimal_places=2) # Descuento total monetario que aportó esta promoción
+    shard_uso = models.PositiveSmallIntegerField(null=True, blank=True) # Shard de PromocionUsoContador que contó el uso (para devolverlo al cancelar)
     
     class Meta:
         verbose_name_plural = "Promociones Aplicadas al Pedido"
@@ -399,6 +651,7 @@ class PedidoItem(models.Model):
     descuento_item = models.DecimalField(max_digits=12, decimal_places=2, default=0.00) # Descuento monetario aplicado a esta línea
     promocion_aplicada = models.ForeignKey(Promocion, on_delete=models.SET_NULL, null=True, blank=True) # Qué promo específica causó este descuento
     total_neto = models.DecimalField(max_digits=12, decimal_places=2) # subtotal - descuento_item
+    costo_total = models.DecimalField(max_digits=16, decimal_places=4, null=True, blank=True) # Costo de venta (ver core.services.costeo)
 
 
 class Pago(models.Model):
@@ -501,13 +754,36 @@ class ImportJob(models.Model):
         ('compras', 'Compras'),
         ('clientes', 'Clientes'),
     ]
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('procesando', 'Procesando'),
+        ('completado', 'Completado'),
+        ('completado_con_errores', 'Completado con errores'),
+        ('error', 'Error'),
+    ]
     usuario = models.ForeignKey(Usuario, on_delete=models.PROTECT)
     tipo = models.CharField(max_length=50, choices=TIPOS)
     archivo_url = models.URLField()
-    status = models.CharField(max_length=50)
-    errores = models.TextField(null=True, blank=True)
+    status = models.CharField(max_length=50, choices=ESTADOS, default='pendiente')
+    errores = models.TextField(null=True, blank=True)  # JSON: [{"fila": n, "error": "..."}]
+    filas_procesadas = models.IntegerField(default=0, db_default=0)
+    filas_con_error = models.IntegerField(default=0, db_default=0)
     fecha_inicio = models.DateTimeField(default=timezone.now)
     fecha_fin = models.DateTimeField(null=True, blank=True)
+    # Cola de trabajos (core.services.trabajos / manage.py run_jobs)
+    intentos = models.PositiveSmallIntegerField(default=0, db_default=0)
+    disponible_desde = models.DateTimeField(default=timezone.now, db_default=Now())  # reintentos con espera
+    trabajador = models.CharField(max_length=100, null=True, blank=True)
+    latido = models.DateTimeField(null=True, blank=True)  # heartbeat del proceso que lo ejecuta
+    ultimo_error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['status', 'disponible_desde'], name='importjob_cola_idx',
+                condition=models.Q(status__in=['pendiente', 'procesando']),
+            ),
+        ]
 
 
 class ExportJob(models.Model):
@@ -516,17 +792,106 @@ class ExportJob(models.Model):
         ('stock', 'Stock'),
         ('productos', 'Productos'),
     ]
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('procesando', 'Procesando'),
+        ('completado', 'Completado'),
+        ('error', 'Error'),
+    ]
     usuario = models.ForeignKey(Usuario, on_delete=models.PROTECT)
     tipo = models.CharField(max_length=50, choices=TIPOS)
-    parametros = models.TextField(null=True, blank=True)
-    status = models.CharField(max_length=50)
-    url_archivo = models.URLField(null=True, blank=True)
+    parametros = models.TextField(null=True, blank=True)  # JSON, ej: {"desde": "2025-01-01", "formato": "csv"}
+    status = models.CharField(max_length=50, choices=ESTADOS, default='pendiente')
+    url_archivo = models.URLField(max_length=1024, null=True, blank=True)
+    filas_exportadas = models.BigIntegerField(default=0, db_default=0)
     fecha_creacion = models.DateTimeField(default=timezone.now)
     fecha_completado = models.DateTimeField(null=True, blank=True)
+    # Cola de trabajos (core.services.trabajos / manage.py run_jobs)
+    intentos = models.PositiveSmallIntegerField(default=0, db_default=0)
+    disponible_desde = models.DateTimeField(default=timezone.now, db_default=Now())  # reintentos con espera
+    trabajador = models.CharField(max_length=100, null=True, blank=True)
+    latido = models.DateTimeField(null=True, blank=True)  # heartbeat del proceso que lo ejecuta
+    ultimo_error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['status', 'disponible_desde'], name='exportjob_cola_idx',
+                condition=models.Q(status__in=['pendiente', 'procesando']),
+            ),
+        ]
 
 
 class LogAccion(models.Model):
     usuario = models.ForeignKey(Usuario, on_delete=models.SET_NULL, null=True, blank=True)
     accion = models.CharField(max_length=255)
     detalle = models.TextField(null=True, blank=True)
-    fecha = models.DateTimeField(default=timezone.now)
\ No newline at end of file
+    fecha = models.DateTimeField(default=timezone.now)
+
+
+# -----------------------------
+# 8) Infraestructura
+# -----------------------------
+class ContadorVersion(models.Model):
+    # Versión por clave (ej. 'promociones') para invalidar cachés en proceso
+    clave = models.CharField(max_length=100, unique=True)
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.clave} v{self.version}"
+
+
+class PuntoControl(models.Model):
+    # Watermark de procesos incrementales (ej. 'ventas_cubos'): hasta dónde se procesó
+    clave = models.CharField(max_length=100, unique=True)
+    fecha = models.DateTimeField(null=True, blank=True)
+    ultimo_id = models.BigIntegerField(default=0)
+    fecha_actualizacion = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.clave} @ {self.fecha or self.ultimo_id}"
+
+
+# -----------------------------
+# 9) Analítica
+# -----------------------------
+class VentaCubo(models.Model):
+    # Agregado diario de PedidoItem por variante (ver core.services.analitica).
+    # categoria y marca son las del producto al momento del refresco.
+    fecha = models.DateField()
+    variante = models.ForeignKey(ProductoVariante, on_delete=models.CASCADE)
+    categoria = models.ForeignKey(Categoria, on_delete=models.CASCADE)
+    marca = models.ForeignKey(Marca, on_delete=models.SET_NULL, null=True, blank=True)
+    pedidos = models.IntegerField(default=0)
+    unidades = models.IntegerField(default=0)
+    ingreso_bruto = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # suma de subtotal
+    descuento = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # suma de descuento_item
+    descuento_promocion = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # con promocion_aplicada
+    ingreso_neto = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # suma de total_neto
+    costo = models.DecimalField(max_digits=16, decimal_places=4, default=0)  # PedidoItem.costo_total o, sin costear, cantidad * Lote.costo_unitario
+    unidades_sin_costo = models.IntegerField(default=0)  # ítems sin costo de venta ni lote de origen
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['fecha', 'variante'], name='ventacubo_fecha_variante_unico'),
+        ]
+        indexes = [
+            models.Index(fields=['fecha', 'categoria'], name='ventacubo_fecha_categoria_idx'),
+            models.Index(fields=['fecha', 'marca'], name='ventacubo_fecha_marca_idx'),
+        ]
+
+
+class PromocionCubo(models.Model):
+    # Impacto diario de cada promoción: descuentos por ítem y a nivel pedido
+    fecha = models.DateField()
+    promocion = models.ForeignKey(Promocion, on_delete=models.CASCADE)
+    pedidos = models.IntegerField(default=0)
+    unidades = models.IntegerField(default=0)
+    descuento_items = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    descuento_pedido = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    ingreso_neto = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # de los ítems con la promoción
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['fecha', 'promocion'], name='promocioncubo_fecha_promo_unico'),
+        ]
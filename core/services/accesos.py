@@ -0,0 +1,142 @@
+"""
+Registro de Usuario.ultimo_acceso sin un UPDATE por request.
+
+``registrar_acceso`` solo anota (usuario, fecha) en un buffer del proceso
+que se queda con la fecha más reciente por usuario (core.services.buffer);
+un hilo de fondo lo vuelca cada ACCESOS_INTERVALO_SEGUNDOS con una única
+sentencia para todo el lote:
+
+  - PostgreSQL: ``UPDATE ... FROM (VALUES (id, fecha), ...)``.
+  - Resto: ``UPDATE ... SET ultimo_acceso = CASE WHEN id = ... END`` (en
+    tandas de 200 por el límite de parámetros de SQLite).
+
+Solo se escriben las filas cuyo valor guardado es más viejo que
+ACCESOS_GRANULARIDAD_SEGUNDOS respecto al nuevo (la condición va en el
+WHERE, así que tampoco pisa un valor más reciente escrito por otro proceso).
+Además cada proceso recuerda hasta qué fecha ya registró a cada usuario y no
+vuelve a encolarlo dentro de la misma ventana.
+"""
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from core.models import Usuario
+from core.services.buffer import BufferEscritura
+
+MAX_RECORDADOS = 100000
+
+
+def granularidad():
+    return timedelta(seconds=getattr(settings, 'ACCESOS_GRANULARIDAD_SEGUNDOS', 300))
+
+
+class BufferAccesos(BufferEscritura):
+    """Buffer que guarda solo el último acceso por usuario."""
+
+    def _contenedor(self):
+        return {}
+
+    def _agregar(self, pendientes, elemento):
+        usuario_id, fecha = elemento
+        if usuario_id not in pendientes or pendientes[usuario_id] < fecha:
+            pendientes[usuario_id] = fecha
+
+    def _reencolar(self, pendientes, fallidos):
+        combinados = dict(fallidos)
+        for elemento in pendientes.items():
+            self._agregar(combinados, elemento)
+        sobrantes = len(combinados) - self.max_pendientes
+        if sobrantes > 0:
+            # Se pierden los accesos más viejos: el próximo acceso del usuario los repone
+            self.descartados += sobrantes
+            for usuario_id, _ in sorted(combinados.items(), key=lambda par: par[1])[:sobrantes]:
+                del combinados[usuario_id]
+        return combinados
+
+
+def _escribir_postgres(accesos, margen):
+    tabla = connection.ops.quote_name(Usuario._meta.db_table)
+    valores = ', '.join(['(%s, %s::timestamptz)'] * len(accesos))
+    parametros = [dato for par in accesos.items() for dato in par]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {tabla} AS u SET ultimo_acceso = v.fecha "
+            f"FROM (VALUES {valores}) AS v(id, fecha) "
+            f"WHERE u.id = v.id AND (u.ultimo_acceso IS NULL OR u.ultimo_acceso < v.fecha - %s)",
+            parametros + [margen],
+        )
+        return cursor.rowcount
+
+
+def _escribir_generico(accesos, margen, tamano=200):
+    filas = 0
+    pares = list(accesos.items())
+    for inicio in range(0, len(pares), tamano):
+        lote = pares[inicio:inicio + tamano]
+        # Condición por fila: el conteo de filas es el de las que realmente cambian
+        vencidos = Q()
+        for usuario_id, fecha in lote:
+            vencidos |= Q(pk=usuario_id) & (Q(ultimo_acceso__isnull=True) | Q(ultimo_acceso__lt=fecha - margen))
+        filas += Usuario.objects.filter(vencidos).update(
+            ultimo_acceso=Case(
+                *(When(pk=usuario_id, then=Value(fecha)) for usuario_id, fecha in lote),
+                default=F('ultimo_acceso'),
+            ),
+        )
+    return filas
+
+
+def _escribir(accesos):
+    margen = granularidad()
+    if connection.vendor == 'postgresql':
+        filas = _escribir_postgres(accesos, margen)
+    else:
+        filas = _escribir_generico(accesos, margen)
+    _metricas['sentencias'] += 1
+    _metricas['filas'] += filas
+
+
+_buffer = BufferAccesos(
+    'accesos',
+    _escribir,
+    tamano=getattr(settings, 'ACCESOS_TAMANO_LOTE', 1000),
+    intervalo=getattr(settings, 'ACCESOS_INTERVALO_SEGUNDOS', 30.0),
+    max_pendientes=getattr(settings, 'ACCESOS_MAX_PENDIENTES', 100000),
+    asincrono=getattr(settings, 'ACCESOS_ASINCRONA', True),
+)
+# usuario_id -> fecha desde la que ya se registró el acceso en este proceso
+_registrados = OrderedDict()
+_registrados_lock = threading.Lock()
+_metricas = {'registrados': 0, 'omitidos': 0, 'sentencias': 0, 'filas': 0}
+
+
+def registrar_acceso(usuario, fecha=None):
+    """Anota que ``usuario`` (instancia o id) accedió en ``fecha`` (ahora por defecto)."""
+    usuario_id = getattr(usuario, 'pk', usuario)
+    fecha = fecha or timezone.now()
+    with _registrados_lock:
+        anterior = _registrados.get(usuario_id)
+        if anterior is not None and fecha - anterior < granularidad():
+            _metricas['omitidos'] += 1
+            return
+        _registrados[usuario_id] = fecha
+        _registrados.move_to_end(usuario_id)
+        if len(_registrados) > MAX_RECORDADOS:
+            _registrados.popitem(last=False)
+        _metricas['registrados'] += 1
+    _buffer.agregar((usuario_id, fecha))
+
+
+def vaciar():
+    """Escribe lo pendiente ya mismo (apagado del worker, fin de un comando)."""
+    return _buffer.vaciar()
+
+
+def estadisticas():
+    """Accesos anotados/omitidos en memoria, sentencias UPDATE emitidas y filas escritas."""
+    return {**_metricas, 'descartados': _buffer.descartados}
@@ -0,0 +1,211 @@
+"""
+Cubos de ventas precalculados (VentaCubo, PromocionCubo).
+
+Los reportes agrupan sobre los cubos (una fila por día y variante, o por día
+y promoción) en lugar de recorrer todos los PedidoItem. El refresco es
+incremental: ``refrescar_cubos`` busca los pedidos con ``fecha_actualizacion``
+posterior al watermark (PuntoControl 'ventas_cubos') y recalcula completos
+solo los días de esos pedidos. Así un pedido que pasa a cancelado deja de
+contar sin llevar deltas por fila.
+
+Cuentan los pedidos en ANALITICA_ESTADOS_VENTA (por defecto, los pagados en
+adelante). El watermark se queda ANALITICA_RETRASO_SEGUNDOS por detrás del
+reloj para no saltear transacciones que aún no confirmaron.
+
+El costo es el de venta que asigna el costeo (``PedidoItem.costo_total``,
+core.services.costeo), que al costear avanza ``fecha_actualizacion`` de sus
+pedidos; los ítems aún sin costear toman el costo de su lote de origen.
+"""
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from core.models import Pedido, PedidoItem, PromocionAplicada, PromocionCubo, PuntoControl, VentaCubo
+
+CLAVE_PUNTO_CONTROL = 'ventas_cubos'
+ESTADOS_VENTA = ('pagado', 'preparando', 'enviado', 'entregado')
+MAX_DIAS_POR_TANDA = 31
+
+
+def estados_venta():
+    return getattr(settings, 'ANALITICA_ESTADOS_VENTA', ESTADOS_VENTA)
+
+
+def _inicio_dia(dia):
+    return timezone.make_aware(datetime.combine(dia, time.min))
+
+
+def _tandas(dias):
+    """Agrupa días ordenados en rangos contiguos [desde, hasta] de hasta MAX_DIAS_POR_TANDA."""
+    rangos = []
+    for dia in sorted(dias):
+        if rangos and dia - rangos[-1][1] == timedelta(days=1) and (dia - rangos[-1][0]).days < MAX_DIAS_POR_TANDA:
+            rangos[-1][1] = dia
+        else:
+            rangos.append([dia, dia])
+    return rangos
+
+
+def recalcular_dias(dias):
+    """Reemplaza las filas de los cubos de esos días. Devuelve filas escritas."""
+    escritas = 0
+    for desde, hasta in _tandas(dias):
+        with transaction.atomic():
+            VentaCubo.objects.filter(fecha__range=(desde, hasta)).delete()
+            PromocionCubo.objects.filter(fecha__range=(desde, hasta)).delete()
+            escritas += _calcular(_inicio_dia(desde), _inicio_dia(hasta + timedelta(days=1)))
+    return escritas
+
+
+def _calcular(inicio, fin):
+    items = PedidoItem.objects.filter(
+        pedido__fecha_pedido__gte=inicio, pedido__fecha_pedido__lt=fin, pedido__estado__in=estados_venta(),
+    ).annotate(dia=TruncDate('pedido__fecha_pedido'))
+
+    # Costo de venta del costeo; mientras el ítem no se costea, el de su lote de origen
+    costo = Coalesce(
+        'costo_total',
+        ExpressionWrapper(F('cantidad') * F('lote_origen__costo_unitario'), output_field=DecimalField()),
+        output_field=DecimalField(max_digits=16, decimal_places=4),
+    )
+    ventas = [
+        VentaCubo(
+            fecha=fila['dia'],
+            variante_id=fila['variante_id'],
+            categoria_id=fila['variante__producto__categoria_id'],
+            marca_id=fila['variante__producto__marca_id'],
+            pedidos=fila['n_pedidos'],
+            unidades=fila['n_unidades'],
+            ingreso_bruto=fila['s_bruto'] or 0,
+            descuento=fila['s_descuento'] or 0,
+            descuento_promocion=fila['s_descuento_promocion'] or 0,
+            ingreso_neto=fila['s_neto'] or 0,
+            costo=fila['s_costo'] or 0,
+            unidades_sin_costo=fila['n_sin_costo'] or 0,
+        )
+        for fila in items.values(
+            'dia', 'variante_id', 'variante__producto__categoria_id', 'variante__producto__marca_id',
+        ).annotate(
+            n_pedidos=Count('pedido_id', distinct=True),
+            n_unidades=Sum('cantidad'),
+            s_bruto=Sum('subtotal'),
+            s_descuento=Sum('descuento_item'),
+            s_descuento_promocion=Sum('descuento_item', filter=Q(promocion_aplicada__isnull=False)),
+            s_neto=Sum('total_neto'),
+            s_costo=Sum(costo),
+            n_sin_costo=Sum('cantidad', filter=Q(costo_total__isnull=True, lote_origen__costo_unitario__isnull=True)),
+        ).order_by()
+    ]
+
+    promociones = {}
+    for fila in items.filter(promocion_aplicada__isnull=False).values('dia', 'promocion_aplicada_id').annotate(
+        n_pedidos=Count('pedido_id', distinct=True),
+        n_unidades=Sum('cantidad'),
+        s_descuento=Sum('descuento_item'),
+        s_neto=Sum('total_neto'),
+    ).order_by():
+        promociones[fila['dia'], fila['promocion_aplicada_id']] = PromocionCubo(
+            fecha=fila['dia'], promocion_id=fila['promocion_aplicada_id'],
+            pedidos=fila['n_pedidos'], unidades=fila['n_unidades'],
+            descuento_items=fila['s_descuento'] or 0, ingreso_neto=fila['s_neto'] or 0,
+        )
+    # Descuentos a nivel pedido (cupón principal)
+    for fila in PromocionAplicada.objects.filter(
+        pedido__fecha_pedido__gte=inicio, pedido__fecha_pedido__lt=fin,
+        pedido__estado__in=estados_venta(), promocion__isnull=False,
+    ).annotate(dia=TruncDate('pedido__fecha_pedido')).values('dia', 'promocion_id').annotate(
+        n_pedidos=Count('pedido_id', distinct=True), s_descuento=Sum('valor_descuento_aplicado'),
+    ).order_by():
+        cubo = promociones.setdefault(
+            (fila['dia'], fila['promocion_id']),
+            PromocionCubo(fecha=fila['dia'], promocion_id=fila['promocion_id']),
+        )
+        cubo.descuento_pedido = fila['s_descuento'] or 0
+        cubo.pedidos = max(cubo.pedidos, fila['n_pedidos'])
+
+    VentaCubo.objects.bulk_create(ventas, batch_size=2000)
+    PromocionCubo.objects.bulk_create(promociones.values(), batch_size=2000)
+    return len(ventas) + len(promociones)
+
+
+def refrescar_cubos(completo=False):
+    """
+    Recalcula los días de los pedidos cambiados desde el último watermark (o
+    todo con ``completo``). Devuelve (días recalculados, filas escritas).
+    """
+    PuntoControl.objects.get_or_create(clave=CLAVE_PUNTO_CONTROL)
+    hasta = timezone.now() - timedelta(seconds=getattr(settings, 'ANALITICA_RETRASO_SEGUNDOS', 60))
+    with transaction.atomic():
+        # El bloqueo del watermark serializa refrescos concurrentes
+        punto = PuntoControl.objects.select_for_update().get(clave=CLAVE_PUNTO_CONTROL)
+        pedidos = Pedido.objects.filter(fecha_actualizacion__lte=hasta)
+        if punto.fecha and not completo:
+            pedidos = pedidos.filter(fecha_actualizacion__gt=punto.fecha)
+        dias = set(
+            pedidos.annotate(dia=TruncDate('fecha_pedido')).order_by().values_list('dia', flat=True).distinct()
+        )
+        if completo:
+            # Días que ya no tienen pedidos también se limpian
+            dias |= set(VentaCubo.objects.order_by().values_list('fecha', flat=True).distinct())
+            dias |= set(PromocionCubo.objects.order_by().values_list('fecha', flat=True).distinct())
+
+        escritas = recalcular_dias(dias)
+        punto.fecha = hasta
+        punto.fecha_actualizacion = timezone.now()
+        punto.save(update_fields=['fecha', 'fecha_actualizacion'])
+    return len(dias), escritas
+
+
+# -----------------------------
+# Reportes sobre los cubos
+# -----------------------------
+METRICAS = {
+    'pedidos': Sum('pedidos'),
+    'unidades': Sum('unidades'),
+    'ingreso_bruto': Sum('ingreso_bruto'),
+    'descuento': Sum('descuento'),
+    'descuento_promocion': Sum('descuento_promocion'),
+    'ingreso_neto': Sum('ingreso_neto'),
+    'costo': Sum('costo'),
+    'unidades_sin_costo': Sum('unidades_sin_costo'),
+}
+
+
+def ventas(desde, hasta, por=('fecha',), categoria=None, marca_id=None):
+    """
+    Métricas de [desde, hasta] agrupadas por las dimensiones de ``por``
+    ('fecha', 'categoria', 'marca', 'variante'). ``categoria`` filtra por su
+    subárbol. ``pedidos`` suma por fila del cubo: un pedido con varias
+    variantes cuenta una vez por variante. Incluye ``margen`` = neto - costo.
+    """
+    filas = VentaCubo.objects.filter(fecha__range=(desde, hasta))
+    if categoria is not None:
+        filas = filas.filter(categoria__ruta__startswith=categoria.ruta)
+    if marca_id is not None:
+        filas = filas.filter(marca_id=marca_id)
+    dimensiones = [f'{campo}_id' if campo != 'fecha' else campo for campo in por]
+    alias = {f't_{nombre}': agregado for nombre, agregado in METRICAS.items()}
+    resultado = []
+    for fila in filas.values(*dimensiones).annotate(**alias).order_by(*dimensiones):
+        metricas = {nombre: fila.pop(f't_{nombre}') or 0 for nombre in METRICAS}
+        metricas['margen'] = metricas['ingreso_neto'] - metricas['costo']
+        resultado.append({**fila, **metricas})
+    return resultado
+
+
+def impacto_promociones(desde, hasta):
+    """Por promoción: pedidos, unidades, descuentos (ítem y pedido) e ingreso neto de [desde, hasta]."""
+    return list(
+        PromocionCubo.objects.filter(fecha__range=(desde, hasta))
+        .values('promocion_id', 'promocion__nombre')
+        .annotate(
+            t_pedidos=Sum('pedidos'), t_unidades=Sum('unidades'),
+            t_descuento_items=Sum('descuento_items'), t_descuento_pedido=Sum('descuento_pedido'),
+            t_ingreso_neto=Sum('ingreso_neto'),
+        )
+        .order_by('-t_descuento_items')
+    )
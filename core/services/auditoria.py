@@ -0,0 +1,62 @@
+"""
+Registro de auditoría (LogAccion) sin INSERT en la request.
+
+``registrar_accion`` deja la fila en un buffer del proceso y un hilo de fondo
+la escribe con bulk_create (core.services.buffer). La fecha es la del
+momento del registro, no la de la escritura; dentro de una transacción la
+fila se encola al confirmarse, así que una acción revertida no se registra.
+Con AUDITORIA_ASINCRONA=False el buffer se vacía en el propio hilo al
+llenarse (comandos, tests).
+
+Registran acciones: checkout (confirmar_carrito), transiciones de pedidos,
+ejecución de ImportJob/ExportJob y revocación de sesiones (tokens).
+
+En PostgreSQL LogAccion se particiona por mes (core.services.particiones,
+``manage.py particionar_tabla core_logaccion``): la retención de
+AUDITORIA_RETENCION_MESES se aplica borrando particiones enteras con
+``manage.py mantener_particiones --borrar``.
+"""
+import json
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import LogAccion
+from core.services.buffer import BufferEscritura
+
+
+def _escribir(filas):
+    LogAccion.objects.bulk_create(filas, batch_size=1000)
+
+
+_buffer = BufferEscritura(
+    'auditoria',
+    _escribir,
+    tamano=getattr(settings, 'AUDITORIA_TAMANO_LOTE', 200),
+    intervalo=getattr(settings, 'AUDITORIA_INTERVALO_SEGUNDOS', 2.0),
+    max_pendientes=getattr(settings, 'AUDITORIA_MAX_PENDIENTES', 50000),
+    asincrono=getattr(settings, 'AUDITORIA_ASINCRONA', True),
+)
+
+
+def registrar_accion(accion, usuario=None, detalle=None):
+    """Encola una entrada de auditoría; ``detalle`` puede ser texto o algo serializable a JSON."""
+    if detalle is not None and not isinstance(detalle, str):
+        detalle = json.dumps(detalle, ensure_ascii=False, default=str)
+    fila = LogAccion(
+        usuario_id=getattr(usuario, 'pk', usuario),
+        accion=accion[:255],
+        detalle=detalle,
+        fecha=timezone.now(),
+    )
+    transaction.on_commit(lambda: _buffer.agregar(fila))
+
+
+def vaciar():
+    """Escribe lo pendiente ya mismo (apagado del worker, fin de un comando)."""
+    return _buffer.vaciar()
+
+
+def estadisticas():
+    return {'escritos': _buffer.escritos, 'descartados': _buffer.descartados}
@@ -0,0 +1,118 @@
+"""
+Buffer de escrituras en memoria para sacar INSERT/UPDATE del camino de la request.
+
+Cada proceso acumula elementos y un hilo de fondo los escribe en bloque cuando
+se junta ``tamano`` o pasan ``intervalo`` segundos desde el primero pendiente.
+Al terminar el proceso (atexit, worker_exit de gunicorn) se vacía lo que quede.
+Si la escritura falla, los elementos vuelven al buffer hasta ``max_pendientes``;
+pasado ese tope se descartan los más viejos.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.db import DatabaseError, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class BufferEscritura:
+    """
+    ``escribir(elementos)`` recibe lo acumulado (lo que devuelve
+    ``_contenedor``). Las subclases pueden cambiar el contenedor para, por
+    ejemplo, quedarse solo con el último valor por clave.
+    """
+
+    def __init__(self, nombre, escribir, tamano=500, intervalo=2.0, max_pendientes=50000, asincrono=True):
+        self.nombre = nombre
+        self.escribir = escribir
+        self.tamano, self.intervalo, self.max_pendientes = tamano, intervalo, max_pendientes
+        self.asincrono = asincrono
+        self.escritos = self.descartados = 0
+        self._reiniciar()
+        atexit.register(self.vaciar)
+
+    def _reiniciar(self):
+        self._pid = os.getpid()
+        self._condicion = threading.Condition()
+        self._pendientes = self._contenedor()
+        self._desde = None
+        self._hilo = None
+
+    def _contenedor(self):
+        return []
+
+    def _agregar(self, pendientes, elemento):
+        pendientes.append(elemento)
+
+    def _reencolar(self, pendientes, fallidos):
+        """Devuelve al buffer lo que no se pudo escribir, por delante de lo nuevo."""
+        combinados = list(fallidos) + list(pendientes)
+        sobrantes = len(combinados) - self.max_pendientes
+        if sobrantes > 0:
+            self.descartados += sobrantes
+            logger.warning("Buffer %s lleno: se descartan %d elementos", self.nombre, sobrantes)
+            combinados = combinados[sobrantes:]
+        return combinados
+
+    def agregar(self, elemento):
+        if os.getpid() != self._pid:
+            # Proceso hijo (fork): no hereda el hilo ni lo pendiente del padre
+            self._reiniciar()
+        with self._condicion:
+            self._agregar(self._pendientes, elemento)
+            if self._desde is None:
+                self._desde = time.monotonic()
+            lleno = len(self._pendientes) >= self.tamano
+            if self.asincrono:
+                self._asegurar_hilo()
+                if lleno:
+                    self._condicion.notify()
+                return
+        if lleno:
+            self.vaciar()
+
+    def vaciar(self):
+        """Escribe todo lo pendiente en el hilo actual. Devuelve cuántos se escribieron."""
+        with self._condicion:
+            pendientes, self._pendientes, self._desde = self._pendientes, self._contenedor(), None
+        if not pendientes:
+            return 0
+        try:
+            # Savepoint si se vacía dentro de una transacción ajena: un fallo no la arrastra
+            with transaction.atomic():
+                self.escribir(pendientes)
+        except DatabaseError:
+            logger.exception("No se pudo vaciar el buffer %s", self.nombre)
+            if not connection.in_atomic_block:
+                # La conexión puede haber quedado rota: se abre otra en el próximo intento
+                connection.close()
+            with self._condicion:
+                self._pendientes = self._reencolar(self._pendientes, pendientes)
+                self._desde = time.monotonic()
+            return 0
+        self.escritos += len(pendientes)
+        return len(pendientes)
+
+    def _asegurar_hilo(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            self._hilo = threading.Thread(target=self._bucle, name=f'buffer-{self.nombre}', daemon=True)
+            self._hilo.start()
+
+    def _bucle(self):
+        try:
+            while True:
+                with self._condicion:
+                    while not self._listo():
+                        espera = None if self._desde is None else self._desde + self.intervalo - time.monotonic()
+                        self._condicion.wait(espera)
+                self.vaciar()
+        finally:
+            connection.close()
+
+    def _listo(self):
+        if self._desde is None:
+            return False
+        return len(self._pendientes) >= self.tamano or time.monotonic() - self._desde >= self.intervalo
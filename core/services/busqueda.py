@@ -0,0 +1,206 @@
+"""
+Búsqueda de productos por nombre, descripción, marca, categoría y SKU.
+
+ProductoBusqueda guarda por producto los textos ya desnormalizados; se
+actualiza desde core.signals cuando cambian el producto, sus variantes, su
+marca o su categoría. Hay dos backends:
+
+  - PostgreSQL: ``documento`` (tsvector con pesos A/B/C e índice GIN) con
+    ``websearch`` y SearchRank; si faltan resultados se completa por
+    similitud de trigramas sobre nombre y SKUs (typos, SKUs parciales).
+  - Resto (SQLite en tests): índice invertido en memoria con prefijos y
+    corrección de typos vía difflib, invalidado por ContadorVersion.
+"""
+import bisect
+import difflib
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity,
+)
+from django.db import connection
+from django.db.models import Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from core.models import Producto, ProductoBusqueda, ProductoVariante
+from core.services.versiones import incrementar_version, version_actual
+
+CLAVE_VERSION = 'busqueda'
+CONFIG_FTS = 'spanish'
+UMBRAL_TRIGRAMA = 0.3
+PESOS = {'nombre': 3.0, 'skus': 3.0, 'marca': 2.0, 'categoria': 2.0, 'descripcion': 1.0}
+
+
+def actualizar_documentos(producto_ids):
+    """Regenera los documentos de búsqueda de los productos indicados."""
+    producto_ids = list(producto_ids)
+    if not producto_ids:
+        return
+    skus = defaultdict(list)
+    for producto_id, sku in ProductoVariante.objects.filter(
+        producto_id__in=producto_ids, activo=True
+    ).values_list('producto_id', 'sku'):
+        skus[producto_id].append(sku)
+
+    ahora = timezone.now()
+    documentos = [
+        ProductoBusqueda(
+            producto_id=producto.pk,
+            nombre=producto.nombre,
+            skus=' '.join(filter(None, [producto.sku_base, *skus[producto.pk]])),
+            marca=producto.marca.nombre if producto.marca else '',
+            categoria=producto.categoria.nombre,
+            descripcion=producto.descripcion or '',
+            fecha_actualizacion=ahora,
+        )
+        for producto in Producto.objects.filter(pk__in=producto_ids).select_related('marca', 'categoria')
+    ]
+    ProductoBusqueda.objects.bulk_create(
+        documentos,
+        update_conflicts=True,
+        unique_fields=['producto'],
+        update_fields=['nombre', 'skus', 'marca', 'categoria', 'descripcion', 'fecha_actualizacion'],
+    )
+    if connection.vendor == 'postgresql':
+        ProductoBusqueda.objects.filter(pk__in=producto_ids).update(documento=(
+            SearchVector('nombre', weight='A', config=CONFIG_FTS)
+            + SearchVector('skus', weight='A', config='simple')
+            + SearchVector('marca', 'categoria', weight='B', config=CONFIG_FTS)
+            + SearchVector('descripcion', weight='C', config=CONFIG_FTS)
+        ))
+    else:
+        incrementar_version(CLAVE_VERSION)
+        invalidar_local()
+
+
+def buscar(texto, limite=20):
+    """Lista de (producto_id, puntaje) de productos activos, del más relevante al menos."""
+    texto = (texto or '').strip()
+    if not texto:
+        return []
+    if connection.vendor == 'postgresql':
+        return _buscar_postgres(texto, limite)
+    return obtener_indice().buscar(texto, limite)
+
+
+def _buscar_postgres(texto, limite):
+    consulta = SearchQuery(texto, config=CONFIG_FTS, search_type='websearch')
+    activos = ProductoBusqueda.objects.filter(producto__activo=True)
+    resultados = list(
+        activos.filter(documento=consulta)
+        .annotate(puntaje=SearchRank('documento', consulta))
+        .order_by('-puntaje')
+        .values_list('producto_id', 'puntaje')[:limite]
+    )
+    if len(resultados) < limite:
+        # Respaldo por trigramas: el operador <% usa los índices gin_trgm_ops
+        encontrados = [producto_id for producto_id, _ in resultados]
+        resultados += list(
+            activos.filter(Q(nombre__trigram_word_similar=texto) | Q(skus__trigram_word_similar=texto))
+            .exclude(pk__in=encontrados)
+            .annotate(puntaje=Greatest(
+                TrigramWordSimilarity(texto, 'nombre'), TrigramWordSimilarity(texto, 'skus'),
+            ))
+            .filter(puntaje__gte=UMBRAL_TRIGRAMA)
+            .order_by('-puntaje')
+            .values_list('producto_id', 'puntaje')[:limite - len(resultados)]
+        )
+    return resultados
+
+
+# -----------------------------
+# Backend en memoria
+# -----------------------------
+def tokenizar(texto):
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+    return re.findall(r'[a-z0-9]+', texto)
+
+
+class IndiceInvertido:
+    def __init__(self, version=0):
+        self.version = version
+        self.postings = defaultdict(dict)  # token -> {producto_id: peso}
+        self.vocabulario = []
+        self.documentos = 0
+
+    @classmethod
+    def construir(cls, filas, version=0):
+        indice = cls(version)
+        for fila in filas:
+            indice.documentos += 1
+            for campo, peso in PESOS.items():
+                for token in tokenizar(fila[campo]):
+                    pesos = indice.postings[token]
+                    pesos[fila['producto_id']] = pesos.get(fila['producto_id'], 0.0) + peso
+        indice.vocabulario = sorted(indice.postings)
+        return indice
+
+    def _expandir(self, token):
+        """Tokens del índice que cuentan como coincidencia: exacto, prefijo o typo."""
+        if token in self.postings:
+            return [token]
+        inicio = bisect.bisect_left(self.vocabulario, token)
+        prefijos = []
+        for candidato in self.vocabulario[inicio:]:
+            if not candidato.startswith(token):
+                break
+            prefijos.append(candidato)
+        if prefijos:
+            return prefijos
+        return difflib.get_close_matches(token, self.vocabulario, n=3, cutoff=0.75)
+
+    def buscar(self, texto, limite=20):
+        total = max(self.documentos, 1)
+        puntajes = None
+        for token in tokenizar(texto):
+            parciales = defaultdict(float)
+            for termino in self._expandir(token):
+                pesos = self.postings[termino]
+                idf = math.log(1 + total / len(pesos))
+                for producto_id, peso in pesos.items():
+                    parciales[producto_id] = max(parciales[producto_id], peso * idf)
+            # Todas las palabras deben coincidir (AND)
+            if puntajes is None:
+                puntajes = dict(parciales)
+            else:
+                puntajes = {p: s + parciales[p] for p, s in puntajes.items() if p in parciales}
+            if not puntajes:
+                return []
+        ordenados = sorted((puntajes or {}).items(), key=lambda par: (-par[1], par[0]))
+        return ordenados[:limite]
+
+
+_lock = threading.Lock()
+_indice = None
+_verificado_en = 0.0
+
+
+def obtener_indice():
+    global _indice, _verificado_en
+    intervalo = getattr(settings, 'BUSQUEDA_VERIFICACION_SEGUNDOS', 5)
+    with _lock:
+        ahora = time.monotonic()
+        if _indice is not None and ahora - _verificado_en < intervalo:
+            return _indice
+        version = version_actual(CLAVE_VERSION)
+        if _indice is None or version != _indice.version:
+            filas = ProductoBusqueda.objects.filter(producto__activo=True).values(
+                'producto_id', *PESOS
+            )
+            _indice = IndiceInvertido.construir(filas.iterator(), version)
+        _verificado_en = ahora
+        return _indice
+
+
+def invalidar_local():
+    global _indice
+    with _lock:
+        _indice = None
@@ -0,0 +1,259 @@
+"""
+Carga y totales del carrito en un número fijo de consultas.
+
+``resumen_carrito`` hace siempre las mismas consultas sin importar cuántas
+líneas tenga el carrito: el carrito, sus items con variante/producto/marca/
+categoría (JOIN) y las imágenes de variantes y productos (dos prefetch).
+Los descuentos salen del índice en memoria de core.services.promociones.
+
+Ciclo de vida: ``fusionar_carrito_anonimo`` pasa el carrito de la sesión al
+del usuario al iniciar sesión; ``desactivar_inactivos`` y
+``purgar_inactivos`` (comando ``purgar_carritos``) desactivan los carritos
+sin actividad y borran, en lotes, los que llevan tiempo desactivados. La
+actividad se mide por ``fecha_actualizacion`` (o ``fecha_creacion`` si nunca
+se actualizó). Un carrito que se desactiva (por inactividad o al fusionarse)
+suelta sus retenciones de stock (ReservaStock) en la misma transacción; no se
+espera a que venzan ni a la cascada del borrado.
+"""
+from dataclasses import dataclass, field
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch, Q
+from django.utils import timezone
+
+from core.models import Carrito, CarritoItem, Imagen, ReservaStock
+from core.services import promociones
+
+CERO = Decimal('0.00')
+
+
+@dataclass
+class LineaCarrito:
+    item_id: int
+    variante_id: int
+    producto_id: int
+    sku: str
+    nombre: str
+    marca: str
+    categoria: str
+    imagen_url: str
+    cantidad: int
+    precio_unitario: Decimal
+    subtotal: Decimal
+    descuento: Decimal = CERO
+    promocion_id: int = None
+    # Por unidad, para cotizar el envío (core.services.envios)
+    peso_kg: Decimal = None
+    volumen_m3: Decimal = None
+
+    @property
+    def total(self):
+        return self.subtotal - self.descuento
+
+
+@dataclass
+class ResumenCarrito:
+    carrito_id: int
+    cupon_codigo: str
+    lineas: list
+    subtotal: Decimal = CERO
+    descuento_lineas: Decimal = CERO
+    descuento_global: Decimal = CERO
+    promocion_global_id: int = None
+    # promocion_id -> (nombre, monto), para registrar PromocionAplicada
+    aplicadas: dict = field(default_factory=dict)
+    con_limite: set = field(default_factory=set)
+
+    @property
+    def total(self):
+        return self.subtotal - self.descuento_lineas - self.descuento_global
+
+
+def _imagenes_ordenadas():
+    return Imagen.objects.order_by('-es_principal', 'orden', 'pk')
+
+
+def cargar_items(carrito_id):
+    """Items del carrito con todo lo necesario para pintarlos (3 consultas)."""
+    return list(
+        CarritoItem.objects.filter(carrito_id=carrito_id)
+        .select_related('variante__producto__marca', 'variante__producto__categoria')
+        .prefetch_related(
+            Prefetch('variante__imagen_set', queryset=_imagenes_ordenadas(), to_attr='imagenes'),
+            Prefetch('variante__producto__imagen_set', queryset=_imagenes_ordenadas(), to_attr='imagenes'),
+        )
+        .order_by('pk')
+    )
+
+
+def resumen_carrito(carrito_id):
+    carrito = Carrito.objects.only('pk', 'cupon_codigo', 'descuento_global_aplicado').get(pk=carrito_id)
+    items = cargar_items(carrito_id)
+
+    lineas = []
+    for item in items:
+        variante = item.variante
+        producto = variante.producto
+        imagenes = variante.imagenes or producto.imagenes
+        lineas.append(LineaCarrito(
+            item_id=item.pk,
+            variante_id=variante.pk,
+            producto_id=producto.pk,
+            sku=variante.sku,
+            nombre=producto.nombre,
+            marca=producto.marca.nombre if producto.marca else None,
+            categoria=producto.categoria.nombre,
+            imagen_url=imagenes[0].url if imagenes else None,
+            cantidad=item.cantidad,
+            precio_unitario=item.precio_unitario_snapshot,
+            subtotal=item.precio_unitario_snapshot * item.cantidad,
+            peso_kg=variante.peso_kg if variante.peso_kg is not None else producto.peso_kg,
+            volumen_m3=producto.volumen_m3,
+        ))
+
+    resultado = promociones.obtener_indice().evaluar(
+        [
+            promociones.LineaPromocion(l.item_id, l.variante_id, l.producto_id, l.cantidad, l.precio_unitario)
+            for l in lineas
+        ],
+        cupon=carrito.cupon_codigo,
+    )
+    for linea, evaluada in zip(lineas, resultado.lineas):
+        linea.subtotal = evaluada.subtotal
+        linea.descuento = evaluada.descuento
+        linea.promocion_id = evaluada.promocion_id
+
+    if resultado.descuento_global != carrito.descuento_global_aplicado:
+        Carrito.objects.filter(pk=carrito_id).update(descuento_global_aplicado=resultado.descuento_global)
+
+    return ResumenCarrito(
+        carrito_id=carrito_id,
+        cupon_codigo=carrito.cupon_codigo,
+        lineas=lineas,
+        subtotal=resultado.subtotal,
+        descuento_lineas=resultado.descuento_lineas,
+        descuento_global=resultado.descuento_global,
+        promocion_global_id=resultado.promocion_global_id,
+        aplicadas=resultado.aplicadas,
+        con_limite=resultado.con_limite,
+    )
+
+
+# -----------------------------
+# Ciclo de vida
+# -----------------------------
+def fusionar_carrito_anonimo(session_id, usuario):
+    """
+    Une el carrito activo de ``session_id`` al del usuario y devuelve el
+    carrito resultante (o None si no hay ninguno). Las variantes repetidas
+    suman cantidades y conservan el precio del carrito del usuario; el cupón
+    del carrito anónimo se toma si el usuario no tenía uno. Las retenciones
+    del carrito anónimo se sueltan: el fusionado se vuelve a reservar.
+    """
+    ahora = timezone.now()
+    with transaction.atomic():
+        carritos = list(
+            Carrito.objects.select_for_update()
+            .filter(Q(session_id=session_id, usuario__isnull=True) | Q(usuario=usuario), activo=True)
+            .order_by('pk')
+        )
+        anonimo = next((c for c in carritos if c.usuario_id is None), None)
+        propio = next((c for c in reversed(carritos) if c.usuario_id is not None), None)
+        if anonimo is None:
+            return propio
+        if propio is None:
+            Carrito.objects.filter(pk=anonimo.pk).update(usuario=usuario, session_id=None, fecha_actualizacion=ahora)
+            anonimo.usuario, anonimo.session_id, anonimo.fecha_actualizacion = usuario, None, ahora
+            return anonimo
+
+        ReservaStock.objects.filter(carrito_item__carrito=anonimo).delete()
+        existentes = {
+            item.variante_id: item for item in CarritoItem.objects.filter(carrito=propio).order_by('pk')
+        }
+        repetidos, sumados = [], {}
+        for item in CarritoItem.objects.filter(carrito=anonimo, variante_id__in=list(existentes)):
+            destino = sumados[item.variante_id] = existentes[item.variante_id]
+            destino.cantidad += item.cantidad
+            repetidos.append(item.pk)
+        if repetidos:
+            CarritoItem.objects.bulk_update(list(sumados.values()), ['cantidad'])
+            CarritoItem.objects.filter(pk__in=repetidos).delete()
+        CarritoItem.objects.filter(carrito=anonimo).update(carrito=propio)
+        Carrito.objects.filter(pk=anonimo.pk).update(activo=False, fecha_actualizacion=ahora)
+        cambios = {'fecha_actualizacion': ahora}
+        if not propio.cupon_codigo and anonimo.cupon_codigo:
+            cambios['cupon_codigo'] = anonimo.cupon_codigo
+        Carrito.objects.filter(pk=propio.pk).update(**cambios)
+        for campo, valor in cambios.items():
+            setattr(propio, campo, valor)
+    return propio
+
+
+def _sin_actividad_desde(corte):
+    return Q(fecha_actualizacion__lt=corte) | Q(fecha_actualizacion__isnull=True, fecha_creacion__lt=corte)
+
+
+def _por_lotes(consulta, accion, tamano_lote):
+    """Aplica ``accion(ids)`` a ``consulta`` en lotes por PK, cada uno en su transacción."""
+    total = 0
+    while True:
+        with transaction.atomic():
+            ids = list(consulta.order_by('pk').values_list('pk', flat=True)[:tamano_lote])
+            if not ids:
+                return total
+            total += accion(ids)
+
+
+def desactivar_inactivos(dias_anonimo=None, dias_usuario=None, tamano_lote=5000):
+    """
+    Desactiva los carritos sin actividad en CARRITOS_INACTIVO_DIAS_ANONIMO
+    (sin usuario) o CARRITOS_INACTIVO_DIAS_USUARIO días y suelta sus
+    retenciones. Devuelve cuántos.
+    """
+    ahora = timezone.now()
+    if dias_anonimo is None:
+        dias_anonimo = getattr(settings, 'CARRITOS_INACTIVO_DIAS_ANONIMO', 7)
+    if dias_usuario is None:
+        dias_usuario = getattr(settings, 'CARRITOS_INACTIVO_DIAS_USUARIO', 30)
+    inactivos = Carrito.objects.filter(activo=True).filter(
+        (Q(usuario__isnull=True) & _sin_actividad_desde(ahora - timedelta(days=dias_anonimo)))
+        | (Q(usuario__isnull=False) & _sin_actividad_desde(ahora - timedelta(days=dias_usuario)))
+    )
+
+    def desactivar(ids):
+        ReservaStock.objects.filter(carrito_item__carrito_id__in=ids).delete()
+        # Desde acá fecha_actualizacion marca la desactivación: cuenta para la retención
+        return Carrito.objects.filter(pk__in=ids, activo=True).update(activo=False, fecha_actualizacion=ahora)
+
+    return _por_lotes(inactivos, desactivar, tamano_lote)
+
+
+def purgar_inactivos(dias_retencion=None, tamano_lote=1000):
+    """
+    Borra los carritos desactivados hace más de CARRITOS_RETENCION_DIAS
+    días junto con sus items y retenciones que hayan quedado. Devuelve
+    {'carritos': n, 'items': n, 'reservas': n, 'lotes': n}.
+    """
+    if dias_retencion is None:
+        dias_retencion = getattr(settings, 'CARRITOS_RETENCION_DIAS', 30)
+    vencidos = Carrito.objects.filter(activo=False).filter(
+        _sin_actividad_desde(timezone.now() - timedelta(days=dias_retencion))
+    )
+    metricas = {'carritos': 0, 'items': 0, 'reservas': 0, 'lotes': 0}
+
+    def borrar(ids):
+        # Cada modelo se borra y se cuenta aparte: sin depender de cascadas
+        metricas['reservas'] += ReservaStock.objects.filter(carrito_item__carrito_id__in=ids).delete()[0]
+        _, items = CarritoItem.objects.filter(carrito_id__in=ids).delete()
+        _, carritos = Carrito.objects.filter(pk__in=ids).delete()
+        carritos = carritos.get(Carrito._meta.label, 0)
+        metricas['items'] += items.get(CarritoItem._meta.label, 0)
+        metricas['carritos'] += carritos
+        metricas['lotes'] += 1
+        return carritos
+
+    _por_lotes(vencidos, borrar, tamano_lote)
+    return metricas
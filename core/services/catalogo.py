@@ -0,0 +1,364 @@
+"""
+Fichas de catálogo con caché read-through versionada en dos niveles.
+
+``construir_fichas`` arma por producto un dict con marca, categoría,
+imágenes (principal primero, luego ``orden``), atributos y variantes con sus
+atributos e imágenes, en un número fijo de consultas para cualquier cantidad
+de productos. ``obtener_fichas`` lo sirve desde caché:
+
+  - Nivel local: LRU por proceso (CATALOGO_LOCAL_MAX entradas, vigencia
+    CATALOGO_LOCAL_TTL_SEGUNDOS).
+  - Nivel compartido (opcional): el alias de CACHES indicado en
+    CATALOGO_CACHE (ej. Redis). Sin él, las versiones viven solo en el
+    proceso y los demás procesos ven un cambio a lo sumo tras el TTL local.
+
+Cada producto tiene una clave de versión (``catalogo:ver:<id>``) que
+core.signals incrementa al confirmar cambios en Producto, ProductoVariante,
+Imagen, ProductoAtributo, VarianteAtributo, Marca o Categoría. Las fichas se
+guardan bajo su versión, así que invalidar es incrementar: lo viejo deja de
+leerse y expira solo. Las versiones nuevas arrancan en ``time.time_ns()``
+para que una clave de versión desalojada no reutilice números ya servidos.
+
+El stock no se cachea: cambia con cada movimiento del ledger, que no pasa
+por esas señales. ``obtener_fichas`` devuelve copias de las fichas con el
+``stock`` de cada variante leído al momento (``StockVariante.disponible``
+menos retenciones vigentes, core.services.reservas) en una consulta más.
+
+Ante un fallo, un solo proceso (y dentro de él un solo hilo) recalcula cada
+ficha: toma ``catalogo:lock:<id>:<versión>`` con ``add`` y los demás esperan hasta
+CATALOGO_ESPERA_SEGUNDOS a que aparezca antes de calcularla por su cuenta.
+"""
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from core.models import Imagen, Producto, ProductoAtributo, ProductoVariante, VarianteAtributo
+from core.services import reservas
+
+PREFIJO = 'catalogo'
+ESPERA_REINTENTO = 0.05
+
+
+# -----------------------------
+# Construcción
+# -----------------------------
+def _imagenes(campo, ids, **filtro):
+    imagenes = defaultdict(list)
+    for dueno_id, url, es_principal in (
+        Imagen.objects.filter(**{f'{campo}_id__in': ids}, **filtro).order_by('-es_principal', 'orden', 'pk')
+        .values_list(f'{campo}_id', 'url', 'es_principal')
+    ):
+        imagenes[dueno_id].append({'url': url, 'es_principal': es_principal})
+    return imagenes
+
+
+def _atributos(modelo, campo, ids):
+    atributos = defaultdict(list)
+    for dueno_id, codigo, nombre, unidad, texto, numero in (
+        modelo.objects.filter(**{f'{campo}_id__in': ids}).order_by('atributo__orden_visual', 'atributo_id')
+        .values_list(f'{campo}_id', 'atributo__codigo', 'atributo__nombre', 'atributo__unidad', 'valor_text', 'valor_num')
+    ):
+        atributos[dueno_id].append({
+            'codigo': codigo, 'nombre': nombre, 'unidad': unidad,
+            'valor': numero if numero is not None else texto,
+        })
+    return atributos
+
+
+def construir_fichas(producto_ids):
+    """{producto_id: ficha} de los productos existentes, sin stock (6 consultas)."""
+    producto_ids = list(producto_ids)
+    productos = list(
+        Producto.objects.filter(pk__in=producto_ids).select_related('marca', 'categoria')
+    )
+    if not productos:
+        return {}
+    variantes = defaultdict(list)
+    for variante in ProductoVariante.objects.filter(producto_id__in=producto_ids).order_by('pk').values(
+        'pk', 'producto_id', 'sku', 'precio', 'peso_kg', 'activo',
+    ):
+        variantes[variante.pop('producto_id')].append(variante)
+    variante_ids = [v['pk'] for lista in variantes.values() for v in lista]
+
+    imagenes_producto = _imagenes('producto', producto_ids, variante__isnull=True)
+    imagenes_variante = _imagenes('variante', variante_ids)
+    atributos_producto = _atributos(ProductoAtributo, 'producto', producto_ids)
+    atributos_variante = _atributos(VarianteAtributo, 'variante', variante_ids)
+
+    fichas = {}
+    for producto in productos:
+        for variante in variantes[producto.pk]:
+            variante['imagenes'] = imagenes_variante.get(variante['pk'], [])
+            variante['atributos'] = atributos_variante.get(variante['pk'], [])
+        fichas[producto.pk] = {
+            'pk': producto.pk,
+            'nombre': producto.nombre,
+            'descripcion': producto.descripcion,
+            'sku_base': producto.sku_base,
+            'precio_base': producto.precio_base,
+            'activo': producto.activo,
+            'marca': {'pk': producto.marca_id, 'nombre': producto.marca.nombre} if producto.marca else None,
+            'categoria': {
+                'pk': producto.categoria_id, 'nombre': producto.categoria.nombre, 'ruta': producto.categoria.ruta,
+            },
+            'imagenes': imagenes_producto.get(producto.pk, []),
+            'atributos': atributos_producto.get(producto.pk, []),
+            'variantes': variantes[producto.pk],
+        }
+    return fichas
+
+
+def agregar_stock(fichas):
+    """Copias de las fichas con el ``stock`` disponible de cada variante (1 consulta)."""
+    variante_ids = [variante['pk'] for ficha in fichas.values() for variante in ficha['variantes']]
+    stock = reservas.disponibles(variante_ids) if variante_ids else {}
+    return {
+        pk: {**ficha, 'variantes': [{**variante, 'stock': stock[variante['pk']]} for variante in ficha['variantes']]}
+        for pk, ficha in fichas.items()
+    }
+
+
+# -----------------------------
+# Niveles de caché
+# -----------------------------
+class Metricas:
+    def __init__(self):
+        self.aciertos = 0
+        self.fallos = 0
+        self.lock = threading.Lock()
+
+    def sumar(self, aciertos=0, fallos=0):
+        with self.lock:
+            self.aciertos += aciertos
+            self.fallos += fallos
+
+    def como_dict(self):
+        with self.lock:
+            aciertos, fallos = self.aciertos, self.fallos
+        total = aciertos + fallos
+        return {
+            'aciertos': aciertos,
+            'fallos': fallos,
+            'tasa_aciertos': aciertos / total if total else None,
+        }
+
+
+class NivelLocal:
+    """LRU en proceso: clave -> (versión, valor, vence)."""
+
+    def __init__(self):
+        self.entradas = OrderedDict()
+        self.versiones = {}
+        self.metricas = Metricas()
+        self.lock = threading.Lock()
+
+    def leer(self, claves, versiones):
+        ahora = time.monotonic()
+        encontrados = {}
+        with self.lock:
+            for clave in claves:
+                entrada = self.entradas.get(clave)
+                if entrada is not None and entrada[0] == versiones[clave] and entrada[2] > ahora:
+                    self.entradas.move_to_end(clave)
+                    encontrados[clave] = entrada[1]
+        self.metricas.sumar(len(encontrados), len(claves) - len(encontrados))
+        return encontrados
+
+    def escribir(self, valores, versiones):
+        vence = time.monotonic() + getattr(settings, 'CATALOGO_LOCAL_TTL_SEGUNDOS', 30)
+        maximo = getattr(settings, 'CATALOGO_LOCAL_MAX', 1000)
+        with self.lock:
+            for clave, valor in valores.items():
+                self.entradas[clave] = (versiones[clave], valor, vence)
+                self.entradas.move_to_end(clave)
+            while len(self.entradas) > maximo:
+                clave, _ = self.entradas.popitem(last=False)
+                self.versiones.pop(clave, None)
+            if len(self.versiones) > 2 * maximo:
+                # Versiones sin ficha local (ej. productos inexistentes). Olvidarlas es
+                # seguro: la próxima lectura arranca una versión nueva, mayor que las servidas.
+                self.versiones = {clave: v for clave, v in self.versiones.items() if clave in self.entradas}
+
+    def limpiar(self):
+        with self.lock:
+            self.entradas.clear()
+            self.versiones.clear()
+
+
+_local = NivelLocal()
+_metricas_compartido = Metricas()
+_recalculos = Metricas()  # aciertos: fichas que otro hilo/proceso calculó mientras se esperaba
+_en_vuelo = {}
+_en_vuelo_lock = threading.Lock()
+
+
+def _compartido():
+    alias = getattr(settings, 'CATALOGO_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def _clave_version(producto_id):
+    return f'{PREFIJO}:ver:{producto_id}'
+
+
+def _clave_ficha(producto_id, version):
+    return f'{PREFIJO}:ficha:{producto_id}:{version}'
+
+
+def _versiones(producto_ids):
+    compartido = _compartido()
+    if compartido is None:
+        with _local.lock:
+            return {pk: _local.versiones.setdefault(pk, time.time_ns()) for pk in producto_ids}
+    claves = {_clave_version(pk): pk for pk in producto_ids}
+    leidas = compartido.get_many(list(claves))
+    versiones = {claves[clave]: version for clave, version in leidas.items()}
+    for pk in producto_ids:
+        if pk not in versiones:
+            # add: si otro proceso la creó primero, vale la suya
+            compartido.add(_clave_version(pk), time.time_ns(), timeout=None)
+            versiones[pk] = compartido.get(_clave_version(pk))
+    return versiones
+
+
+def incrementar_versiones(producto_ids):
+    """Invalida las fichas de esos productos en todos los niveles."""
+    compartido = _compartido()
+    with _local.lock:
+        for pk in producto_ids:
+            _local.versiones[pk] = time.time_ns()
+            _local.entradas.pop(pk, None)
+    if compartido is None:
+        return
+    for pk in producto_ids:
+        try:
+            compartido.incr(_clave_version(pk))
+        except ValueError:
+            compartido.set(_clave_version(pk), time.time_ns(), timeout=None)
+
+
+# -----------------------------
+# Lectura con single-flight
+# -----------------------------
+def _calcular(producto_ids, versiones, compartido):
+    """
+    Recalcula las fichas que faltan; dentro del proceso una sola vez por
+    (producto, versión) aunque lleguen varios hilos a la vez.
+    """
+    propios, ajenos = [], []
+    with _en_vuelo_lock:
+        for pk in producto_ids:
+            llave = (pk, versiones[pk])
+            if llave in _en_vuelo:
+                ajenos.append((pk, _en_vuelo[llave]))
+            else:
+                _en_vuelo[llave] = {'listo': threading.Event(), 'valor': None}
+                propios.append(pk)
+
+    fichas = {}
+    try:
+        if propios:
+            fichas.update(_calcular_compartido(propios, versiones, compartido))
+    finally:
+        with _en_vuelo_lock:
+            for pk in propios:
+                vuelo = _en_vuelo.pop((pk, versiones[pk]))
+                vuelo['valor'] = fichas.get(pk)
+                vuelo['listo'].set()
+
+    espera = getattr(settings, 'CATALOGO_ESPERA_SEGUNDOS', 5)
+    faltan = []
+    for pk, vuelo in ajenos:
+        if vuelo['listo'].wait(espera) and vuelo['valor'] is not None:
+            fichas[pk] = vuelo['valor']
+            _recalculos.sumar(aciertos=1)
+        else:
+            faltan.append(pk)
+    if faltan:
+        fichas.update(construir_fichas(faltan))
+    return fichas
+
+
+def _calcular_compartido(producto_ids, versiones, compartido):
+    if compartido is None:
+        _recalculos.sumar(fallos=len(producto_ids))
+        return construir_fichas(producto_ids)
+
+    espera = getattr(settings, 'CATALOGO_ESPERA_SEGUNDOS', 5)
+    propios, ajenos = [], []
+    for pk in producto_ids:
+        tomado = compartido.add(f'{PREFIJO}:lock:{pk}:{versiones[pk]}', 1, timeout=espera)
+        (propios if tomado else ajenos).append(pk)
+
+    fichas = {}
+    if propios:
+        _recalculos.sumar(fallos=len(propios))
+        fichas = construir_fichas(propios)
+        compartido.set_many(
+            {_clave_ficha(pk, versiones[pk]): ficha for pk, ficha in fichas.items()},
+            timeout=getattr(settings, 'CATALOGO_TTL_SEGUNDOS', 3600),
+        )
+        compartido.delete_many([f'{PREFIJO}:lock:{pk}:{versiones[pk]}' for pk in propios])
+
+    limite = time.monotonic() + espera
+    while ajenos and time.monotonic() < limite:
+        time.sleep(ESPERA_REINTENTO)
+        listas = compartido.get_many([_clave_ficha(pk, versiones[pk]) for pk in ajenos])
+        for pk in list(ajenos):
+            ficha = listas.get(_clave_ficha(pk, versiones[pk]))
+            if ficha is not None:
+                fichas[pk] = ficha
+                ajenos.remove(pk)
+                _recalculos.sumar(aciertos=1)
+    if ajenos:
+        # El dueño del lock tardó demasiado (o murió): se calcula sin guardar
+        _recalculos.sumar(fallos=len(ajenos))
+        fichas.update(construir_fichas(ajenos))
+    return fichas
+
+
+def obtener_fichas(producto_ids):
+    """{producto_id: ficha} de los productos pedidos que existen, con stock al momento."""
+    producto_ids = list(dict.fromkeys(producto_ids))
+    if not producto_ids:
+        return {}
+    versiones = _versiones(producto_ids)
+    fichas = _local.leer(producto_ids, versiones)
+
+    faltan = [pk for pk in producto_ids if pk not in fichas]
+    compartido = _compartido()
+    if faltan and compartido is not None:
+        claves = {_clave_ficha(pk, versiones[pk]): pk for pk in faltan}
+        encontradas = {claves[clave]: ficha for clave, ficha in compartido.get_many(list(claves)).items()}
+        _metricas_compartido.sumar(len(encontradas), len(faltan) - len(encontradas))
+        _local.escribir(encontradas, versiones)
+        fichas.update(encontradas)
+        faltan = [pk for pk in faltan if pk not in encontradas]
+
+    if faltan:
+        calculadas = _calcular(faltan, versiones, compartido)
+        _local.escribir(calculadas, versiones)
+        fichas.update(calculadas)
+    return agregar_stock(fichas)
+
+
+def obtener_ficha(producto_id):
+    return obtener_fichas([producto_id]).get(producto_id)
+
+
+def estadisticas():
+    """Métricas del proceso por nivel; ``recalculo`` cuenta esperas resueltas vs. cálculos."""
+    with _local.lock:
+        entradas = len(_local.entradas)
+    return {
+        'local': {**_local.metricas.como_dict(), 'entradas': entradas},
+        'compartido': _metricas_compartido.como_dict() if _compartido() is not None else None,
+        'recalculo': _recalculos.como_dict(),
+    }
+
+
+def invalidar_local():
+    _local.limpiar()
@@ -0,0 +1,171 @@
+"""
+Árbol de categorías con ruta materializada (Categoria.ruta).
+
+Cada categoría guarda los ids de sus ancestros y el suyo, con ancho fijo:
+``0000000001/0000000007/``. Así el subárbol es un ``LIKE 'ruta%'`` indexado,
+las migas de pan salen de la propia ruta y los conteos por subcategoría son
+un GROUP BY sobre un prefijo de longitud fija.
+
+La ruta es un varchar: caben MAX_NIVELES segmentos (23 con max_length=255).
+Guardar, mover o reconstruir un árbol más profundo lanza ProfundidadExcedida.
+"""
+from django.db import transaction
+from django.db.models import Count, F, Max, Value
+from django.db.models.functions import Concat, Substr
+
+from core.models import Categoria, Producto
+
+ANCHO_SEGMENTO = 10
+LARGO_SEGMENTO = ANCHO_SEGMENTO + 1
+MAX_NIVELES = Categoria._meta.get_field('ruta').max_length // LARGO_SEGMENTO
+
+
+def segmento(categoria_id):
+    return f"{categoria_id:0{ANCHO_SEGMENTO}d}/"
+
+
+def ids_de_ruta(ruta):
+    return [int(ruta[i:i + ANCHO_SEGMENTO]) for i in range(0, len(ruta), LARGO_SEGMENTO)]
+
+
+class CicloCategorias(ValueError):
+    pass
+
+
+class ProfundidadExcedida(ValueError):
+    pass
+
+
+def validar_padre(categoria):
+    """
+    Impide mover una categoría debajo de sí misma o de un descendiente, y que
+    ella o alguna de sus descendientes quede a más de MAX_NIVELES niveles.
+    """
+    if not categoria.id_padre_id:
+        return
+    ruta_padre, profundidad_padre = Categoria.objects.values_list('ruta', 'profundidad').get(
+        pk=categoria.id_padre_id
+    )
+    existente = categoria.pk and categoria.ruta
+    if existente and ruta_padre.startswith(categoria.ruta):
+        raise CicloCategorias(
+            f"La categoría {categoria.pk} no puede colgar de su descendiente {categoria.id_padre_id}"
+        )
+    profundidad = profundidad_padre + 1
+    if existente and profundidad > categoria.profundidad:
+        # Al bajar de nivel, lo que importa es la descendiente más profunda
+        maxima = subarbol(categoria).aggregate(maxima=Max('profundidad'))['maxima']
+        profundidad += (maxima or categoria.profundidad) - categoria.profundidad
+    if profundidad >= MAX_NIVELES:
+        raise ProfundidadExcedida(
+            f"La categoría {categoria.pk or categoria.nombre} quedaría a más de {MAX_NIVELES} niveles"
+        )
+
+
+def sincronizar_ruta(categoria):
+    """Recalcula la ruta de la categoría y, si cambió, la de todo su subárbol."""
+    ruta_padre, profundidad = '', 0
+    if categoria.id_padre_id:
+        ruta_padre, profundidad_padre = Categoria.objects.values_list('ruta', 'profundidad').get(
+            pk=categoria.id_padre_id
+        )
+        profundidad = profundidad_padre + 1
+    ruta = ruta_padre + segmento(categoria.pk)
+    anterior, profundidad_anterior = categoria.ruta, categoria.profundidad
+    if ruta == anterior and profundidad == profundidad_anterior:
+        return
+
+    with transaction.atomic():
+        Categoria.objects.filter(pk=categoria.pk).update(ruta=ruta, profundidad=profundidad)
+        if anterior:
+            _reemplazar_prefijo(anterior, ruta, profundidad - profundidad_anterior)
+    categoria.ruta, categoria.profundidad = ruta, profundidad
+
+
+def desprender_subarbol(categoria):
+    """Tras borrar una categoría sus hijas quedan como raíces (on_delete=SET_NULL)."""
+    if categoria.ruta:
+        _reemplazar_prefijo(categoria.ruta, '', -(categoria.profundidad + 1))
+
+
+def _reemplazar_prefijo(anterior, nuevo, delta_profundidad):
+    Categoria.objects.filter(ruta__startswith=anterior).exclude(ruta=anterior).update(
+        ruta=Concat(Value(nuevo), Substr('ruta', len(anterior) + 1)),
+        profundidad=F('profundidad') + delta_profundidad,
+    )
+
+
+def reconstruir_rutas(modelo=Categoria, chunk=2000):
+    """
+    Recalcula todas las rutas desde id_padre en memoria y escribe solo las que
+    cambian, en lotes. Las categorías atrapadas en un ciclo quedan como raíces;
+    si alguna queda a más de MAX_NIVELES niveles no se escribe nada.
+    Devuelve (actualizadas, en_ciclo).
+    """
+    filas = list(modelo.objects.values_list('pk', 'id_padre_id', 'ruta', 'profundidad'))
+    hijos = {}
+    padres = {}
+    for pk, padre_id, _, _ in filas:
+        padres[pk] = padre_id
+        hijos.setdefault(padre_id, []).append(pk)
+
+    calculadas = {}
+    pendientes = [(pk, '', 0) for pk, padre_id, _, _ in filas if padre_id is None]
+    while pendientes:
+        pk, ruta_padre, profundidad = pendientes.pop()
+        ruta = ruta_padre + segmento(pk)
+        calculadas[pk] = (ruta, profundidad)
+        pendientes.extend((hijo, ruta, profundidad + 1) for hijo in hijos.get(pk, ()))
+
+    profundas = sorted(pk for pk, (_, profundidad) in calculadas.items() if profundidad >= MAX_NIVELES)
+    if profundas:
+        raise ProfundidadExcedida(f"Categorías a más de {MAX_NIVELES} niveles: {profundas}")
+
+    en_ciclo = [pk for pk in padres if pk not in calculadas]
+    for pk in en_ciclo:
+        calculadas[pk] = (segmento(pk), 0)
+
+    cambios = [
+        modelo(pk=pk, ruta=calculadas[pk][0], profundidad=calculadas[pk][1])
+        for pk, _, ruta, profundidad in filas
+        if calculadas[pk] != (ruta, profundidad)
+    ]
+    for inicio in range(0, len(cambios), chunk):
+        with transaction.atomic():
+            modelo.objects.bulk_update(cambios[inicio:inicio + chunk], ['ruta', 'profundidad'])
+    return len(cambios), en_ciclo
+
+
+# -----------------------------
+# Consultas
+# -----------------------------
+def subarbol(categoria):
+    return Categoria.objects.filter(ruta__startswith=categoria.ruta)
+
+
+def productos_en_subarbol(categoria):
+    return Producto.objects.filter(categoria__ruta__startswith=categoria.ruta)
+
+
+def migas_de_pan(categoria):
+    """Ancestros de la categoría (incluida) de la raíz hacia abajo."""
+    return list(Categoria.objects.filter(pk__in=ids_de_ruta(categoria.ruta)).order_by('profundidad'))
+
+
+def conteo_por_subcategoria(categoria=None, productos=None):
+    """
+    Productos del subárbol agrupados por hija directa: {categoria_id: total}.
+    Sin categoría agrupa por raíz. Los productos asignados directamente a la
+    categoría cuentan bajo su propio id. ``productos`` permite partir de un
+    queryset ya filtrado (facetas combinadas).
+    """
+    prefijo = categoria.ruta if categoria else ''
+    productos = Producto.objects.all() if productos is None else productos
+    filas = (
+        productos.filter(categoria__ruta__startswith=prefijo)
+        .annotate(rama=Substr('categoria__ruta', 1, len(prefijo) + LARGO_SEGMENTO))
+        .values('rama')
+        .annotate(total=Count('pk'))
+        .order_by()
+    )
+    return {ids_de_ruta(fila['rama'])[-1]: fila['total'] for fila in filas}
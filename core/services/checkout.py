@@ -0,0 +1,134 @@
+"""
+Conversión de Carrito en Pedido dentro de una sola transacción.
+
+El número de consultas no depende del tamaño del carrito: lectura del
+carrito (core.services.carrito), un INSERT del pedido, un ``bulk_create``
+para items, otro para promociones aplicadas, la reserva de stock vía
+``registrar_movimientos`` y el Pago. Solo las promociones con ``max_usos``
+agregan un UPDATE condicional cada una.
+"""
+import base64
+import secrets
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from core.models import (
+    Carrito, MovimientoInventario, Pago, Pedido, PedidoItem, Promocion, PromocionAplicada,
+)
+from core.services.auditoria import registrar_accion
+from core.services.carrito import resumen_carrito
+from core.services.cupones import consumir_uso
+from core.services.reservas import liberar_carrito
+from core.services.stock import registrar_movimientos
+
+CERO = Decimal('0.00')
+INTENTOS_CODIGO = 3
+
+
+class CarritoVacio(Exception):
+    pass
+
+
+def generar_codigo_pedido(ahora=None):
+    """
+    Código legible sin tabla de secuencias: fecha + 40 bits aleatorios en
+    base32 (ej. PED-250314-K3J9QZ2A). La unicidad la garantiza la BD.
+    """
+    ahora = ahora or timezone.now()
+    sufijo = base64.b32encode(secrets.token_bytes(5)).decode()
+    return f"PED-{ahora:%y%m%d}-{sufijo}"
+
+
+def confirmar_carrito(carrito_id, usuario, metodo_pago, direccion_envio=None,
+                      costo_envio=CERO, impuestos=CERO, nota=None):
+    """
+    Crea Pedido, PedidoItem, PromocionAplicada, las reservas de stock y el Pago
+    pendiente a partir del carrito, y lo desactiva. Lanza CarritoVacio,
+    StockInsuficiente o CuponAgotado (sin dejar rastros) si no se puede.
+    """
+    with transaction.atomic():
+        # Bloquea el carrito: dos confirmaciones simultáneas no generan dos pedidos
+        Carrito.objects.select_for_update().get(pk=carrito_id, activo=True)
+        resumen = resumen_carrito(carrito_id)
+        if not resumen.lineas:
+            raise CarritoVacio(f"El carrito {carrito_id} no tiene items")
+
+        shards = {}
+        if resumen.con_limite:
+            for promocion in Promocion.objects.filter(pk__in=resumen.con_limite).order_by('pk'):
+                shards[promocion.pk] = consumir_uso(promocion)
+
+        descuento = resumen.descuento_lineas + resumen.descuento_global
+        pedido = Pedido(
+            usuario=usuario,
+            subtotal=resumen.subtotal,
+            descuento=descuento,
+            impuestos=impuestos,
+            costo_envio=costo_envio,
+            total=resumen.subtotal - descuento + impuestos + costo_envio,
+            metodo_pago=metodo_pago,
+            direccion_envio=direccion_envio,
+            nota=nota,
+        )
+        _guardar_con_codigo(pedido)
+
+        items = PedidoItem.objects.bulk_create([
+            PedidoItem(
+                pedido=pedido,
+                variante_id=linea.variante_id,
+                cantidad=linea.cantidad,
+                precio_unitario=linea.precio_unitario,
+                subtotal=linea.subtotal,
+                descuento_item=linea.descuento,
+                promocion_aplicada_id=linea.promocion_id,
+                total_neto=linea.total,
+            )
+            for linea in resumen.lineas
+        ])
+        PromocionAplicada.objects.bulk_create([
+            PromocionAplicada(
+                pedido=pedido,
+                promocion_id=promocion_id,
+                nombre_snapshot=nombre,
+                valor_descuento_aplicado=monto,
+                shard_uso=shards.get(promocion_id),
+            )
+            for promocion_id, (nombre, monto) in resumen.aplicadas.items()
+        ])
+        # Las retenciones del carrito pasan a ser la reserva firme del pedido, ligada
+        # a cada item para que core.services.pedidos pueda liberarla al cancelar
+        liberar_carrito(carrito_id)
+        registrar_movimientos(
+            [
+                MovimientoInventario(
+                    variante_id=linea.variante_id,
+                    tipo='reserva',
+                    cantidad=linea.cantidad,
+                    motivo=f"Pedido {pedido.codigo}",
+                    usuario=usuario,
+                    pedido_item=item,
+                )
+                for linea, item in zip(resumen.lineas, items)
+            ],
+            exigir_disponible=True,
+        )
+        Pago.objects.create(pedido=pedido, metodo=metodo_pago, monto=pedido.total)
+        Carrito.objects.filter(pk=carrito_id).update(activo=False, fecha_actualizacion=timezone.now())
+        registrar_accion('checkout.confirmar', usuario, {'pedido': pedido.codigo, 'total': pedido.total})
+
+    return pedido
+
+
+def _guardar_con_codigo(pedido):
+    for intento in range(INTENTOS_CODIGO):
+        pedido.codigo = generar_codigo_pedido()
+        try:
+            # Savepoint: una colisión de código no aborta la transacción externa
+            with transaction.atomic():
+                pedido.save(force_insert=True)
+            return
+        except IntegrityError:
+            if intento == INTENTOS_CODIGO - 1:
+                raise
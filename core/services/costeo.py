@@ -0,0 +1,296 @@
+"""
+Costeo de inventario: promedio ponderado móvil o FIFO por lote.
+
+Reproduce el ledger (MovimientoInventario) en orden de id, por tandas, sobre
+el estado guardado en CostoVariante. Cada tanda carga el estado de sus
+variantes en arreglos paralelos de enteros (``array``, importes en
+diezmilésimos), aplica los movimientos y guarda estado, costo de venta de
+los PedidoItem y checkpoint (PuntoControl 'costeo') en una sola transacción:
+si se corta, se retoma desde la última tanda confirmada.
+
+Reglas:
+  - entrada/devolución: suman al costo del movimiento; si no lo trae, al del
+    lote y si tampoco, al costo vigente.
+  - salida y ajuste negativo: salen al promedio (promedio) o consumiendo
+    capas, primero las del lote del movimiento y luego las más antiguas (fifo).
+    Lo que exceda las existencias sale al último costo y queda como déficit
+    que cubren las próximas entradas.
+  - reserva: no afecta al costo.
+Las salidas con ``pedido_item`` suman su costo a ``PedidoItem.costo_total``;
+las devoluciones con ``pedido_item`` lo restan. Sus pedidos avanzan
+``fecha_actualizacion``, el watermark de los cubos de ventas.
+
+Cambiar COSTEO_METODO requiere reiniciar (``costear_inventario --reiniciar``).
+"""
+import json
+from array import array
+from collections import defaultdict, deque
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import (
+    CostoVariante, MovimientoInventario, Pedido, PedidoItem, PuntoControl, ValorizacionInventario,
+)
+
+CLAVE_PUNTO_CONTROL = 'costeo'
+ESCALA = 10000  # 4 decimales, como Lote.costo_unitario
+DIEZMILESIMO = Decimal('0.0001')
+
+
+def metodo_configurado():
+    metodo = getattr(settings, 'COSTEO_METODO', 'promedio')
+    if metodo not in dict(CostoVariante.METODOS):
+        raise ValueError(f"COSTEO_METODO desconocido: {metodo}")
+    return metodo
+
+
+def a_entero(valor):
+    return int((Decimal(valor) * ESCALA).to_integral_value())
+
+
+def a_decimal(entero):
+    return (Decimal(entero) / ESCALA).quantize(DIEZMILESIMO)
+
+
+def _dividir(a, b):
+    """a / b redondeado al entero más cercano (b > 0)."""
+    return (2 * a + b) // (2 * b)
+
+
+class Acumulador:
+    """Estado de costeo de las variantes de una tanda, en arreglos paralelos."""
+
+    def __init__(self, metodo, estados=()):
+        self.metodo = metodo
+        self.indice = {}
+        self.cantidad = array('q')
+        self.valor = array('q')
+        self.ultimo = array('q')
+        self.capas = []
+        for estado in estados:
+            self._nueva(
+                estado.variante_id, estado.cantidad, a_entero(estado.valor), a_entero(estado.costo_unitario),
+                json.loads(estado.capas) if estado.capas else [],
+            )
+
+    def _nueva(self, variante_id, cantidad=0, valor=0, ultimo=0, capas=()):
+        self.indice[variante_id] = len(self.cantidad)
+        self.cantidad.append(cantidad)
+        self.valor.append(valor)
+        self.ultimo.append(ultimo)
+        self.capas.append(deque(capas))
+        return self.indice[variante_id]
+
+    def posicion(self, variante_id):
+        i = self.indice.get(variante_id)
+        return self._nueva(variante_id) if i is None else i
+
+    def entrar(self, i, cantidad, costo, lote_id=None):
+        """Suma ``cantidad`` unidades a ``costo`` (entero) por unidad."""
+        if costo is None:
+            costo = self.ultimo[i]
+        if self.cantidad[i] < 0:
+            # El déficit ya salió al último costo: se cubre al mismo costo
+            cubre = min(cantidad, -self.cantidad[i])
+            self.cantidad[i] += cubre
+            self.valor[i] += cubre * self.ultimo[i]
+            cantidad -= cubre
+            if self.cantidad[i] == 0:
+                self.valor[i] = 0
+        if cantidad <= 0:
+            return
+        self.cantidad[i] += cantidad
+        self.valor[i] += cantidad * costo
+        if self.metodo == 'fifo':
+            self.capas[i].append([lote_id, cantidad, costo])
+            self.ultimo[i] = costo
+        else:
+            self.ultimo[i] = _dividir(self.valor[i], self.cantidad[i])
+
+    def sacar(self, i, cantidad, lote_id=None):
+        """Retira ``cantidad`` unidades y devuelve su costo total (entero)."""
+        disponible = max(self.cantidad[i], 0)
+        if self.metodo == 'fifo':
+            costo, restante = self._consumir_capas(i, cantidad, lote_id)
+        else:
+            tomadas = min(cantidad, disponible)
+            if tomadas == 0:
+                costo = 0
+            elif tomadas == disponible:
+                costo = self.valor[i]
+            else:
+                costo = _dividir(self.valor[i] * tomadas, disponible)
+            restante = cantidad - tomadas
+        costo += restante * self.ultimo[i]
+        self.cantidad[i] -= cantidad
+        self.valor[i] -= costo
+        if self.cantidad[i] == 0:
+            self.valor[i] = 0
+        return costo
+
+    def _consumir_capas(self, i, cantidad, lote_id):
+        capas = self.capas[i]
+        costo = 0
+        if lote_id is not None:
+            for capa in capas:
+                if cantidad == 0:
+                    break
+                if capa[0] == lote_id:
+                    tomadas = min(cantidad, capa[1])
+                    capa[1] -= tomadas
+                    costo += tomadas * capa[2]
+                    cantidad -= tomadas
+        while cantidad > 0 and capas:
+            capa = capas[0]
+            tomadas = min(cantidad, capa[1])
+            capa[1] -= tomadas
+            costo += tomadas * capa[2]
+            cantidad -= tomadas
+            if capa[1] == 0:
+                capas.popleft()
+        # Capas vaciadas por lote que quedaron en medio
+        if lote_id is not None and any(capa[1] == 0 for capa in capas):
+            self.capas[i] = deque(capa for capa in capas if capa[1] > 0)
+        return costo, cantidad
+
+    def estados(self, ahora):
+        return [
+            CostoVariante(
+                variante_id=variante_id,
+                metodo=self.metodo,
+                cantidad=self.cantidad[i],
+                valor=a_decimal(self.valor[i]),
+                costo_unitario=a_decimal(self.ultimo[i]),
+                capas=json.dumps(list(self.capas[i])) if self.metodo == 'fifo' else None,
+                fecha_actualizacion=ahora,
+            )
+            for variante_id, i in self.indice.items()
+        ]
+
+
+def _costo_entrada(costo_unitario, total_costo, cantidad, costo_lote):
+    if costo_unitario is not None:
+        return a_entero(costo_unitario)
+    if total_costo is not None and cantidad:
+        return _dividir(a_entero(total_costo), abs(cantidad))
+    if costo_lote is not None:
+        return a_entero(costo_lote)
+    return None
+
+
+def aplicar_movimientos(acumulador, movimientos):
+    """Aplica las filas del ledger; devuelve {pedido_item_id: delta de costo entero}."""
+    costos_items = defaultdict(int)
+    for _, variante_id, tipo, cantidad, costo_unitario, total_costo, lote_id, costo_lote, item_id in movimientos:
+        if tipo == 'reserva':
+            continue
+        i = acumulador.posicion(variante_id)
+        if tipo in ('entrada', 'devolucion') or (tipo == 'ajuste' and cantidad > 0):
+            costo = _costo_entrada(costo_unitario, total_costo, cantidad, costo_lote)
+            if tipo == 'devolucion' and item_id is not None:
+                # Sin costo explícito, la devolución vuelve al costo vigente
+                costo = acumulador.ultimo[i] if costo is None else costo
+                costos_items[item_id] -= cantidad * costo
+            acumulador.entrar(i, cantidad, costo, lote_id)
+        elif tipo == 'salida' or (tipo == 'ajuste' and cantidad < 0):
+            costo = acumulador.sacar(i, abs(cantidad), lote_id)
+            if tipo == 'salida' and item_id is not None:
+                costos_items[item_id] += costo
+    return costos_items
+
+
+def _limite_seguro(desde_id):
+    """
+    Último id que es seguro procesar: los ids se asignan antes del commit, así
+    que se frena antes del primer movimiento insertado en los últimos
+    COSTEO_RETRASO_SEGUNDOS (una transacción anterior podría seguir abierta).
+    Se mira ``fecha_registro`` (la pone la base al insertar), no ``fecha``,
+    que puede ser retroactiva.
+    """
+    corte = timezone.now() - timedelta(seconds=getattr(settings, 'COSTEO_RETRASO_SEGUNDOS', 60))
+    reciente = (
+        MovimientoInventario.objects.filter(pk__gt=desde_id, fecha_registro__gt=corte)
+        .order_by('pk').values_list('pk', flat=True).first()
+    )
+    return None if reciente is None else reciente - 1
+
+
+def costear(tamano_tanda=20000, reiniciar=False):
+    """Procesa el ledger pendiente. Devuelve (movimientos procesados, variantes tocadas)."""
+    metodo = metodo_configurado()
+    if reiniciar:
+        with transaction.atomic():
+            CostoVariante.objects.all().delete()
+            PedidoItem.objects.filter(costo_total__isnull=False).update(costo_total=None)
+            PuntoControl.objects.update_or_create(clave=CLAVE_PUNTO_CONTROL, defaults={'ultimo_id': 0})
+    elif CostoVariante.objects.exclude(metodo=metodo).exists():
+        raise ValueError(f"El costeo guardado no es '{metodo}': ejecute costear_inventario --reiniciar")
+
+    PuntoControl.objects.get_or_create(clave=CLAVE_PUNTO_CONTROL)
+    procesados, variantes = 0, set()
+    while True:
+        with transaction.atomic():
+            punto = PuntoControl.objects.select_for_update().get(clave=CLAVE_PUNTO_CONTROL)
+            pendientes = MovimientoInventario.objects.filter(pk__gt=punto.ultimo_id)
+            limite = _limite_seguro(punto.ultimo_id)
+            if limite is not None:
+                pendientes = pendientes.filter(pk__lte=limite)
+            tanda = list(
+                pendientes.order_by('pk').values_list(
+                    'pk', 'variante_id', 'tipo', 'cantidad', 'costo_unitario', 'total_costo',
+                    'lote_id', 'lote__costo_unitario', 'pedido_item_id',
+                )[:tamano_tanda]
+            )
+            if not tanda:
+                break
+
+            ids = {fila[1] for fila in tanda}
+            acumulador = Acumulador(metodo, CostoVariante.objects.filter(pk__in=ids))
+            costos_items = aplicar_movimientos(acumulador, tanda)
+
+            ahora = timezone.now()
+            CostoVariante.objects.bulk_create(
+                acumulador.estados(ahora),
+                update_conflicts=True,
+                unique_fields=['variante'],
+                update_fields=['metodo', 'cantidad', 'valor', 'costo_unitario', 'capas', 'fecha_actualizacion'],
+                batch_size=5000,
+            )
+            items = list(PedidoItem.objects.filter(pk__in=list(costos_items)).only('pk', 'costo_total'))
+            for item in items:
+                item.costo_total = a_decimal(a_entero(item.costo_total or 0) + costos_items[item.pk])
+            PedidoItem.objects.bulk_update(items, ['costo_total'], batch_size=5000)
+            # Watermark de la analítica: los pedidos con costo nuevo se recalculan en los cubos
+            Pedido.objects.filter(
+                pk__in=PedidoItem.objects.filter(pk__in=list(costos_items)).values('pedido_id')
+            ).update(fecha_actualizacion=ahora)
+
+            punto.ultimo_id = tanda[-1][0]
+            punto.fecha = punto.fecha_actualizacion = ahora
+            punto.save(update_fields=['ultimo_id', 'fecha', 'fecha_actualizacion'])
+        procesados += len(tanda)
+        variantes |= ids
+    return procesados, len(variantes)
+
+
+def tomar_valorizacion(fecha=None, tamano_lote=5000):
+    """Copia CostoVariante a ValorizacionInventario con una misma fecha. Devuelve (filas, valor total)."""
+    fecha = fecha or timezone.now()
+    filas, total, lote = 0, Decimal(0), []
+    with transaction.atomic():
+        for estado in CostoVariante.objects.order_by('pk').iterator(chunk_size=tamano_lote):
+            lote.append(ValorizacionInventario(
+                fecha=fecha, metodo=estado.metodo, variante_id=estado.variante_id,
+                cantidad=estado.cantidad, valor=estado.valor, costo_unitario=estado.costo_unitario,
+            ))
+            total += estado.valor
+            if len(lote) >= tamano_lote:
+                ValorizacionInventario.objects.bulk_create(lote)
+                filas += len(lote)
+                lote = []
+        ValorizacionInventario.objects.bulk_create(lote)
+    return filas + len(lote), total
@@ -0,0 +1,122 @@
+"""
+Conteo de usos de promociones (Promocion.max_usos) sin COUNT(*) sobre
+PromocionAplicada.
+
+Cada uso es un ``UPDATE ... SET usos = usos + 1 WHERE usos < limite`` sobre
+uno de los shards de PromocionUsoContador. La suma de los límites de los
+shards nunca supera el cupo restante, de modo que el tope global no se
+sobrepasa aunque muchos checkouts consuman a la vez.
+
+Al crear los contadores de una promoción se parte de los usos ya
+registrados en PromocionAplicada (pedidos no cancelados); la migración 0030
+hizo lo mismo con las promociones existentes.
+"""
+import random
+import threading
+
+from django.db import transaction
+from django.db.models import F, Q, Sum
+
+from core.models import PromocionAplicada, PromocionUsoContador
+
+
+class CuponAgotado(Exception):
+    def __init__(self, promocion_id):
+        self.promocion_id = promocion_id
+        super().__init__(f"La promoción {promocion_id} alcanzó su máximo de usos")
+
+
+_lock = threading.Lock()
+_shards = {}
+
+
+def configurar_contador(promocion, shards=None):
+    """
+    Crea los shards de la promoción (o cambia su número) y reparte entre ellos
+    el cupo restante según ``promocion.max_usos``. Los usos ya contados se
+    conservan; los de shards sobrantes se acumulan en el shard 0.
+    """
+    with transaction.atomic():
+        existentes = PromocionUsoContador.objects.filter(promocion=promocion)
+        cantidad = existentes.count()
+        if shards is None:
+            shards = cantidad or 1
+        # Contador nuevo: arranca con los usos que ya hubo
+        previos = 0 if cantidad else usos_registrados(promocion.pk)
+        PromocionUsoContador.objects.bulk_create(
+            [PromocionUsoContador(promocion=promocion, shard=i, usos=previos if i == 0 else 0) for i in range(shards)],
+            ignore_conflicts=True,
+        )
+        filas = list(existentes.select_for_update().order_by('shard'))
+        activos, sobrantes = filas[:shards], filas[shards:]
+        if sobrantes:
+            activos[0].usos += sum(f.usos for f in sobrantes)
+            PromocionUsoContador.objects.filter(pk__in=[f.pk for f in sobrantes]).delete()
+
+        if promocion.max_usos is None:
+            for fila in activos:
+                fila.limite = None
+        else:
+            restante = max(promocion.max_usos - sum(f.usos for f in activos), 0)
+            base, resto = divmod(restante, shards)
+            for i, fila in enumerate(activos):
+                fila.limite = fila.usos + base + (1 if i < resto else 0)
+
+        PromocionUsoContador.objects.bulk_update(activos, ['usos', 'limite'])
+    with _lock:
+        _shards.pop(promocion.pk, None)
+
+
+def consumir_uso(promocion):
+    """
+    Registra un uso y devuelve el shard incrementado (para ``liberar_uso``).
+    Lanza CuponAgotado si ningún shard tiene cupo.
+    """
+    for recargar in (False, True):
+        shards = _shards_de(promocion, recargar)
+        inicio = random.randrange(len(shards))
+        for shard in shards[inicio:] + shards[:inicio]:
+            actualizados = (
+                PromocionUsoContador.objects
+                .filter(promocion_id=promocion.pk, shard=shard)
+                .filter(Q(limite__isnull=True) | Q(usos__lt=F('limite')))
+                .update(usos=F('usos') + 1)
+            )
+            if actualizados:
+                return shard
+    raise CuponAgotado(promocion.pk)
+
+
+def liberar_uso(promocion_id, shard):
+    """Devuelve un uso (ej. pedido cancelado) al shard que lo consumió."""
+    PromocionUsoContador.objects.filter(
+        promocion_id=promocion_id, shard=shard, usos__gt=0
+    ).update(usos=F('usos') - 1)
+
+
+def usos_registrados(promocion_id):
+    """Usos según PromocionAplicada (pedidos no cancelados); solo para sembrar el contador."""
+    return PromocionAplicada.objects.filter(promocion_id=promocion_id).exclude(pedido__estado='cancelado').count()
+
+
+def usos_totales(promocion_id):
+    total = PromocionUsoContador.objects.filter(promocion_id=promocion_id).aggregate(total=Sum('usos'))['total']
+    return total or 0
+
+
+def _shards_de(promocion, recargar=False):
+    with _lock:
+        shards = None if recargar else _shards.get(promocion.pk)
+    if shards is None:
+        shards = list(
+            PromocionUsoContador.objects.filter(promocion_id=promocion.pk)
+            .filter(Q(limite__isnull=True) | Q(usos__lt=F('limite')))
+            .order_by('shard')
+            .values_list('shard', flat=True)
+        )
+        if not shards and not PromocionUsoContador.objects.filter(promocion_id=promocion.pk).exists():
+            configurar_contador(promocion, shards=1)
+            shards = [0]
+        with _lock:
+            _shards[promocion.pk] = shards or [0]
+    return shards or [0]
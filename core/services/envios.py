@@ -0,0 +1,155 @@
+"""
+Cotización de envíos sobre TarifaEnvio sin consultar la base por pedido.
+
+Las tarifas activas de cada ciudad se compilan en memoria, una vez, como un
+índice de intervalos: los extremos de todas las bandas de peso (ordenados)
+parten la recta en tramos elementales (cada extremo y el hueco entre dos
+extremos consecutivos) y cada tramo guarda ya ordenadas por costo las
+tarifas que lo cubren, la más barata por empresa. Cotizar es un ``bisect``
+sobre los extremos más una lectura de lista.
+
+Las bandas son cerradas [peso_min_kg, peso_max_kg]; un extremo nulo es
+abierto hacia ese lado. El peso facturable es el mayor entre el peso real y
+el volumétrico (volumen_m3 × ENVIOS_FACTOR_VOLUMETRICO, en kg/m³).
+
+Cada índice se revalida como mucho cada ENVIOS_VERIFICACION_SEGUNDOS con una
+consulta agregada (máxima ``fecha_actualizacion`` y cantidad de tarifas de
+la ciudad): altas, bajas y cambios guardados con ``save()`` la mueven
+(core.signals actualiza ``fecha_actualizacion``). Un ``update()`` masivo debe
+actualizar ``fecha_actualizacion`` también.
+"""
+import bisect
+import threading
+import time
+from collections import namedtuple
+from decimal import ROUND_CEILING, Decimal
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+from core.models import CarritoItem, TarifaEnvio
+
+CERO = Decimal('0')
+MILESIMO = Decimal('0.001')
+FACTOR_VOLUMETRICO = Decimal('200')  # kg/m³ (equivale a dividir cm³ por 5000)
+
+Cotizacion = namedtuple('Cotizacion', 'tarifa_id empresa_id empresa costo peso_facturable')
+
+
+def peso_facturable(lineas):
+    """
+    Peso a cobrar de ``lineas`` (cantidad, peso_kg unitario, volumen_m3
+    unitario); los nulos cuentan como cero.
+    """
+    peso = volumen = CERO
+    for cantidad, peso_kg, volumen_m3 in lineas:
+        peso += cantidad * (peso_kg or CERO)
+        volumen += cantidad * (volumen_m3 or CERO)
+    factor = Decimal(str(getattr(settings, 'ENVIOS_FACTOR_VOLUMETRICO', FACTOR_VOLUMETRICO)))
+    return max(peso, volumen * factor).quantize(MILESIMO, rounding=ROUND_CEILING)
+
+
+class IndiceTarifas:
+    def __init__(self, firma, tarifas):
+        self.firma = firma
+        self.verificado_en = time.monotonic()
+        extremos = {t[p] for t in tarifas for p in ('peso_min_kg', 'peso_max_kg') if t[p] is not None}
+        self.extremos = sorted(extremos)
+        # Tramo 2i+1 = extremos[i]; tramo 2i = hueco anterior a extremos[i]
+        tramos = [{} for _ in range(2 * len(self.extremos) + 1)]
+        for tarifa in tarifas:
+            desde = 0 if tarifa['peso_min_kg'] is None else self._tramo(tarifa['peso_min_kg'])
+            hasta = len(tramos) - 1 if tarifa['peso_max_kg'] is None else self._tramo(tarifa['peso_max_kg'])
+            cotizacion = (tarifa['costo'], tarifa['pk'], tarifa['empresa_id'], tarifa['empresa__nombre'])
+            for tramo in tramos[desde:hasta + 1]:
+                actual = tramo.get(tarifa['empresa_id'])
+                if actual is None or cotizacion < actual:
+                    tramo[tarifa['empresa_id']] = cotizacion
+        self.tramos = [tuple(sorted(tramo.values())) for tramo in tramos]
+
+    def _tramo(self, peso):
+        i = bisect.bisect_left(self.extremos, peso)
+        if i < len(self.extremos) and self.extremos[i] == peso:
+            return 2 * i + 1
+        return 2 * i
+
+    def cotizar(self, peso):
+        """Una Cotizacion por empresa que cubre ``peso``, de la más barata a la más cara."""
+        return [
+            Cotizacion(tarifa_id, empresa_id, empresa, costo, peso)
+            for costo, tarifa_id, empresa_id, empresa in self.tramos[self._tramo(peso)]
+        ]
+
+
+def _firma(ciudad_id):
+    # Incluye las inactivas: desactivar una tarifa también mueve la fecha
+    resumen = TarifaEnvio.objects.filter(ciudad_id=ciudad_id).aggregate(
+        ultima=Max('fecha_actualizacion'), total=Count('pk'),
+    )
+    return resumen['ultima'], resumen['total']
+
+
+def compilar(ciudad_id):
+    firma = _firma(ciudad_id)
+    tarifas = list(
+        TarifaEnvio.objects.filter(ciudad_id=ciudad_id, activo=True)
+        .values('pk', 'empresa_id', 'empresa__nombre', 'peso_min_kg', 'peso_max_kg', 'costo')
+    )
+    return IndiceTarifas(firma, tarifas)
+
+
+# -----------------------------
+# Índices por proceso
+# -----------------------------
+_lock = threading.Lock()
+_indices = {}
+
+
+def obtener_indice(ciudad_id):
+    intervalo = getattr(settings, 'ENVIOS_VERIFICACION_SEGUNDOS', 30)
+    with _lock:
+        indice = _indices.get(ciudad_id)
+        ahora = time.monotonic()
+        if indice is not None and ahora - indice.verificado_en < intervalo:
+            return indice
+        if indice is None or _firma(ciudad_id) != indice.firma:
+            indice = _indices[ciudad_id] = compilar(ciudad_id)
+        indice.verificado_en = ahora
+        return indice
+
+
+def invalidar_local(ciudad_id=None):
+    with _lock:
+        if ciudad_id is None:
+            _indices.clear()
+        else:
+            _indices.pop(ciudad_id, None)
+
+
+def cotizar(ciudad_id, peso):
+    """Cotizaciones para enviar ``peso`` kg a la ciudad, de la más barata a la más cara."""
+    return obtener_indice(ciudad_id).cotizar(Decimal(str(peso)).quantize(MILESIMO, rounding=ROUND_CEILING))
+
+
+def mejor_cotizacion(ciudad_id, peso):
+    """La Cotizacion más barata, o None si ninguna tarifa activa cubre ese peso."""
+    cotizaciones = cotizar(ciudad_id, peso)
+    return cotizaciones[0] if cotizaciones else None
+
+
+def cotizar_resumen(resumen, ciudad_id):
+    """Cotiza un ResumenCarrito (core.services.carrito) sin volver a leer sus items."""
+    peso = peso_facturable((l.cantidad, l.peso_kg, l.volumen_m3) for l in resumen.lineas)
+    return cotizar(ciudad_id, peso)
+
+
+def cotizar_carrito(carrito_id, ciudad_id):
+    """Cotiza el carrito leyendo solo cantidades, pesos y volúmenes (una consulta)."""
+    lineas = CarritoItem.objects.filter(carrito_id=carrito_id).values_list(
+        'cantidad', 'variante__peso_kg', 'variante__producto__peso_kg', 'variante__producto__volumen_m3',
+    )
+    peso = peso_facturable(
+        (cantidad, peso_variante if peso_variante is not None else peso_producto, volumen)
+        for cantidad, peso_variante, peso_producto, volumen in lineas
+    )
+    return cotizar(ciudad_id, peso)
@@ -0,0 +1,266 @@
+"""
+Motor de exportación para ExportJob (ventas, stock, productos).
+
+Las filas se leen en streaming y se escriben directo a disco, con memoria
+constante sin importar cuántas sean:
+
+  - CSV gzip sobre PostgreSQL (psycopg2): ``COPY (consulta) TO STDOUT``.
+  - CSV gzip en otros motores: ``values_list().iterator(chunk_size)``.
+  - Parquet (requiere pyarrow): un row group por bloque del iterador.
+
+Ambos caminos del CSV escriben los valores igual: booleanos como
+``true``/``false``, decimales en notación fija y fechas-hora en UTC como
+``AAAA-MM-DD HH:MM:SS``. Con COPY el formato se arma en el SQL y el avance
+(filas_exportadas) se reporta contando las líneas que llegan al archivo.
+
+Los archivos quedan en EXPORTACION_DIR; ``url_archivo`` se arma con
+EXPORTACION_URL_BASE si está definido, o como file:// en caso contrario.
+"""
+import csv
+import gzip
+import io
+import json
+from datetime import date, datetime, time, timezone as dt_timezone
+from decimal import Decimal
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import BooleanField, Case, CharField, DateTimeField, Func, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from core.models import ExportJob, PedidoItem, Producto, ProductoVariante
+from core.services.auditoria import registrar_accion
+
+TAMANO_BLOQUE = 10000
+
+
+def _rango_fechas(consulta, campo, parametros):
+    desde = parse_date(parametros['desde']) if parametros.get('desde') else None
+    hasta = parse_date(parametros['hasta']) if parametros.get('hasta') else None
+    if desde:
+        consulta = consulta.filter(**{f'{campo}__gte': timezone.make_aware(datetime.combine(desde, time.min))})
+    if hasta:
+        consulta = consulta.filter(**{f'{campo}__lte': timezone.make_aware(datetime.combine(hasta, time.max))})
+    return consulta
+
+
+def consulta_ventas(parametros):
+    consulta = PedidoItem.objects.exclude(pedido__estado='cancelado')
+    if parametros.get('estados'):
+        consulta = PedidoItem.objects.filter(pedido__estado__in=parametros['estados'])
+    consulta = _rango_fechas(consulta, 'pedido__fecha_pedido', parametros)
+    columnas = [
+        ('pedido', 'pedido__codigo'),
+        ('fecha_pedido', 'pedido__fecha_pedido'),
+        ('estado', 'pedido__estado'),
+        ('sku', 'variante__sku'),
+        ('producto', 'variante__producto__nombre'),
+        ('cantidad', 'cantidad'),
+        ('precio_unitario', 'precio_unitario'),
+        ('subtotal', 'subtotal'),
+        ('descuento_item', 'descuento_item'),
+        ('total_neto', 'total_neto'),
+    ]
+    return consulta.order_by('pk'), columnas
+
+
+def consulta_stock(parametros):
+    consulta = ProductoVariante.objects.all()
+    if parametros.get('solo_activos'):
+        consulta = consulta.filter(activo=True)
+    columnas = [
+        ('sku', 'sku'),
+        ('producto', 'producto__nombre'),
+        ('activo', 'activo'),
+        ('fisico', 'stock_proyectado__fisico'),
+        ('reservado', 'stock_proyectado__reservado'),
+        ('disponible', 'stock_proyectado__disponible'),
+    ]
+    return consulta.order_by('pk'), columnas
+
+
+def consulta_productos(parametros):
+    consulta = Producto.objects.all()
+    if parametros.get('solo_activos'):
+        consulta = consulta.filter(activo=True)
+    columnas = [
+        ('sku_base', 'sku_base'),
+        ('nombre', 'nombre'),
+        ('categoria', 'categoria__slug'),
+        ('marca', 'marca__nombre'),
+        ('precio_base', 'precio_base'),
+        ('peso_kg', 'peso_kg'),
+        ('volumen_m3', 'volumen_m3'),
+        ('activo', 'activo'),
+    ]
+    return consulta.order_by('pk'), columnas
+
+
+CONSULTAS = {
+    'ventas': consulta_ventas,
+    'stock': consulta_stock,
+    'productos': consulta_productos,
+}
+
+
+# -----------------------------
+# Escritores
+# -----------------------------
+def _escribir_csv(consulta, columnas, ruta, progreso):
+    with gzip.open(ruta, 'wt', newline='', encoding='utf-8') as archivo:
+        csv.writer(archivo).writerow([nombre for nombre, _ in columnas])
+        if _puede_copiar():
+            archivo.flush()
+            return _copiar_postgres(consulta, columnas, _ConAvance(archivo, progreso))
+        escritor = csv.writer(archivo)
+        total = 0
+        filas = consulta.values_list(*[campo for _, campo in columnas]).iterator(chunk_size=TAMANO_BLOQUE)
+        while bloque := list(islice(filas, TAMANO_BLOQUE)):
+            escritor.writerows([[_valor_csv(valor) for valor in fila] for fila in bloque])
+            total += len(bloque)
+            progreso(total)
+        return total
+
+
+def _valor_csv(valor):
+    if isinstance(valor, bool):
+        return 'true' if valor else 'false'
+    if isinstance(valor, Decimal):
+        return format(valor, 'f')
+    if isinstance(valor, datetime):
+        return valor.astimezone(dt_timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    return valor
+
+
+class _ConAvance(io.TextIOBase):
+    """
+    Stream de texto para copy_expert que reporta el avance cada TAMANO_BLOQUE
+    líneas. Es aproximado (un texto con saltos de línea cuenta de más); el
+    total final sale del rowcount de COPY.
+    """
+
+    def __init__(self, archivo, progreso):
+        self.archivo, self.progreso = archivo, progreso
+        self.lineas = self.reportadas = 0
+
+    def writable(self):
+        return True
+
+    def write(self, texto):
+        self.archivo.write(texto)
+        self.lineas += texto.count('\n')
+        if self.lineas - self.reportadas >= TAMANO_BLOQUE:
+            self.reportadas = self.lineas
+            self.progreso(self.lineas)
+        return len(texto)
+
+
+def _puede_copiar():
+    # COPY con copy_expert es propio de psycopg2; con psycopg 3 se usa el iterador
+    return connection.vendor == 'postgresql' and connection.Database.__name__ == 'psycopg2'
+
+
+class _FechaHoraUTC(Func):
+    template = "to_char(%(expressions)s AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')"
+    output_field = CharField()
+
+
+def _columna_copy(consulta, campo):
+    """Expresión SQL que da el mismo texto que ``_valor_csv`` (numeric ya sale en notación fija)."""
+    tipo = consulta.query.clone().resolve_ref(campo).output_field
+    if isinstance(tipo, BooleanField):
+        return Case(
+            When(**{campo: True}, then=Value('true')),
+            When(**{campo: False}, then=Value('false')),
+            output_field=CharField(),
+        )
+    if isinstance(tipo, DateTimeField):
+        return _FechaHoraUTC(campo)
+    return campo
+
+
+def _copiar_postgres(consulta, columnas, archivo):
+    expresiones = [_columna_copy(consulta, campo) for _, campo in columnas]
+    sql, params = consulta.values_list(*expresiones).query.sql_with_params()
+    with connection.cursor() as cursor:
+        literal = cursor.cursor.mogrify(sql, params).decode()
+        # copy_expert escribe texto: se le pasa el stream de texto del gzip
+        cursor.cursor.copy_expert(f"COPY ({literal}) TO STDOUT WITH (FORMAT csv)", archivo)
+        return cursor.cursor.rowcount
+
+
+def _escribir_parquet(consulta, columnas, ruta, progreso):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as exc:
+        raise RuntimeError("Exportar en Parquet requiere el paquete pyarrow") from exc
+
+    nombres = [nombre for nombre, _ in columnas]
+    escritor = None
+    total = 0
+    filas = consulta.values_list(*[campo for _, campo in columnas]).iterator(chunk_size=TAMANO_BLOQUE)
+    try:
+        while bloque := list(islice(filas, TAMANO_BLOQUE)):
+            tabla = pa.table({nombre: [_valor_parquet(f[i]) for f in bloque] for i, nombre in enumerate(nombres)})
+            if escritor is None:
+                escritor = pq.ParquetWriter(ruta, tabla.schema, compression='snappy')
+            escritor.write_table(tabla.cast(escritor.schema))
+            total += len(bloque)
+            progreso(total)
+    finally:
+        if escritor is not None:
+            escritor.close()
+    return total
+
+
+def _valor_parquet(valor):
+    # Decimales como texto para no depender de la precisión inferida por bloque
+    if isinstance(valor, (datetime, date)) or valor is None or isinstance(valor, (int, float, bool, str)):
+        return valor
+    return str(valor)
+
+
+FORMATOS = {
+    'csv': ('csv.gz', _escribir_csv),
+    'parquet': ('parquet', _escribir_parquet),
+}
+
+
+def ejecutar_exportacion(job):
+    """Genera el archivo del ExportJob. Si falla, queda en 'error' y relanza."""
+    parametros = json.loads(job.parametros) if job.parametros else {}
+    extension, escribir = FORMATOS[parametros.get('formato', 'csv')]
+    consulta, columnas = CONSULTAS[job.tipo](parametros)
+
+    directorio = Path(getattr(settings, 'EXPORTACION_DIR', settings.BASE_DIR / 'exports'))
+    directorio.mkdir(parents=True, exist_ok=True)
+    nombre = f"{job.tipo}_{job.pk}_{timezone.now():%Y%m%d%H%M%S}.{extension}"
+    ruta = directorio / nombre
+
+    job.status = 'procesando'
+    job.filas_exportadas = 0
+    job.save(update_fields=['status', 'filas_exportadas'])
+
+    def progreso(total):
+        ExportJob.objects.filter(pk=job.pk).update(filas_exportadas=total)
+
+    try:
+        job.filas_exportadas = escribir(consulta, columnas, ruta, progreso)
+        url_base = getattr(settings, 'EXPORTACION_URL_BASE', None)
+        job.url_archivo = f"{url_base.rstrip('/')}/{nombre}" if url_base else ruta.resolve().as_uri()
+        job.status = 'completado'
+        job.fecha_completado = timezone.now()
+    except Exception:
+        job.status = 'error'
+        ruta.unlink(missing_ok=True)
+        raise
+    finally:
+        job.save(update_fields=['status', 'url_archivo', 'filas_exportadas', 'fecha_completado'])
+        registrar_accion('exportacion.ejecutar', job.usuario_id, {
+            'job': job.pk, 'tipo': job.tipo, 'status': job.status, 'filas': job.filas_exportadas,
+        })
+    return job
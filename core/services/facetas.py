@@ -0,0 +1,136 @@
+"""
+Filtrado facetado sobre los atributos EAV (ProductoAtributo/VarianteAtributo).
+
+FacetaVariante guarda una posting list por (atributo, valor normalizado):
+las variantes activas que lo tienen. Un filtro con varios atributos es una
+sola consulta (OR de los pares pedidos, agrupado por variante y exigiendo
+que coincidan todos los atributos) en lugar de un self-join por atributo, y
+los conteos de facetas son un GROUP BY sobre esas variantes.
+
+El índice se actualiza por variante desde core.signals; ``rebuild_facetas``
+lo reconstruye completo.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from core.models import Atributo, FacetaVariante, ProductoAtributo, ProductoVariante, VarianteAtributo
+
+LARGO_VALOR = 255
+
+
+def normalizar_valor(valor_text=None, valor_num=None):
+    if valor_num is not None:
+        valor_num = Decimal(valor_num).normalize()
+        return format(valor_num, 'f')
+    if valor_text is None:
+        return None
+    valor = str(valor_text).strip().lower()
+    return valor[:LARGO_VALOR] or None
+
+
+def indexar_variantes(variante_ids):
+    """Reemplaza las postings de las variantes dadas (las inactivas quedan fuera)."""
+    variante_ids = list(variante_ids)
+    if not variante_ids:
+        return 0
+    variantes = dict(
+        ProductoVariante.objects.filter(pk__in=variante_ids, activo=True, producto__activo=True)
+        .values_list('pk', 'producto_id')
+    )
+    por_producto = defaultdict(dict)
+    for producto_id, atributo_id, texto, numero in ProductoAtributo.objects.filter(
+        producto_id__in=set(variantes.values())
+    ).values_list('producto_id', 'atributo_id', 'valor_text', 'valor_num'):
+        por_producto[producto_id][atributo_id] = normalizar_valor(texto, numero)
+
+    # Los valores de la variante pisan a los heredados del producto
+    valores = {pk: dict(por_producto.get(producto_id, {})) for pk, producto_id in variantes.items()}
+    for variante_id, atributo_id, texto, numero in VarianteAtributo.objects.filter(
+        variante_id__in=list(variantes)
+    ).values_list('variante_id', 'atributo_id', 'valor_text', 'valor_num'):
+        valores[variante_id][atributo_id] = normalizar_valor(texto, numero)
+
+    postings = [
+        FacetaVariante(atributo_id=atributo_id, valor=valor, variante_id=variante_id)
+        for variante_id, atributos in valores.items()
+        for atributo_id, valor in atributos.items()
+        if valor is not None
+    ]
+    with transaction.atomic():
+        FacetaVariante.objects.filter(variante_id__in=variante_ids).delete()
+        FacetaVariante.objects.bulk_create(postings, batch_size=5000)
+    return len(postings)
+
+
+def indexar_productos(producto_ids):
+    return indexar_variantes(
+        ProductoVariante.objects.filter(producto_id__in=list(producto_ids)).values_list('pk', flat=True)
+    )
+
+
+def _resolver(filtros):
+    """
+    {codigo o id de atributo: valor o lista de valores} -> {atributo_id:
+    [valores normalizados]}, o None si algún código no existe (el filtro
+    viene del usuario: un atributo desconocido no lo cumple ninguna variante).
+    """
+    codigos = [clave for clave in filtros if not isinstance(clave, int)]
+    ids = dict(Atributo.objects.filter(codigo__in=codigos).values_list('codigo', 'pk')) if codigos else {}
+    resueltos = {}
+    for clave, valores in filtros.items():
+        if not isinstance(valores, (list, tuple, set)):
+            valores = [valores]
+        normalizados = [
+            normalizar_valor(valor_num=v) if isinstance(v, (int, float, Decimal)) and not isinstance(v, bool)
+            else normalizar_valor(valor_text=v)
+            for v in valores
+        ]
+        atributo_id = clave if isinstance(clave, int) else ids.get(clave)
+        if atributo_id is None:
+            return None
+        resueltos[atributo_id] = [v for v in normalizados if v is not None]
+    return resueltos
+
+
+def variantes_filtradas(filtros, variantes=None):
+    """
+    Subconsulta de variante_id que cumplen todos los atributos (OR entre los
+    valores de un mismo atributo). ``variantes`` restringe a un conjunto
+    previo, por ejemplo las del subárbol de una categoría.
+    """
+    filtros = _resolver(filtros)
+    if filtros is None:
+        return FacetaVariante.objects.none().values('variante_id')
+    postings = FacetaVariante.objects.all()
+    if variantes is not None:
+        postings = postings.filter(variante_id__in=variantes)
+    if not filtros:
+        return postings.values('variante_id').distinct()
+
+    condicion = Q()
+    for atributo_id, valores in filtros.items():
+        condicion |= Q(atributo_id=atributo_id, valor__in=valores)
+    return (
+        postings.filter(condicion)
+        .values('variante_id')
+        .annotate(coincidencias=Count('atributo_id', distinct=True))
+        .filter(coincidencias=len(filtros))
+        .values('variante_id')
+    )
+
+
+def conteo_facetas(filtros, variantes=None, atributos=None):
+    """{atributo_id: {valor: número de variantes}} sobre el resultado del filtro."""
+    postings = FacetaVariante.objects.filter(variante_id__in=variantes_filtradas(filtros, variantes))
+    if atributos is not None:
+        postings = postings.filter(atributo_id__in=atributos)
+    conteos = defaultdict(dict)
+    for atributo_id, valor, total in (
+        postings.values('atributo_id', 'valor').annotate(total=Count('variante_id')).order_by()
+        .values_list('atributo_id', 'valor', 'total')
+    ):
+        conteos[atributo_id][valor] = total
+    return dict(conteos)
@@ -0,0 +1,520 @@
+"""
+Motor de importación masiva para ImportJob (productos, lotes, compras, clientes).
+
+El archivo (CSV o XLSX) se lee fila a fila sin cargarlo entero en memoria.
+Las filas se validan en lotes de IMPORTACION_TAMANO_LOTE; las claves
+foráneas (Categoria.slug, Marca.nombre, Producto.sku_base,
+ProductoVariante.sku, Proveedor.ruc, Rol.nombre) se resuelven contra
+diccionarios precargados una sola vez, y cada lote se escribe con
+``bulk_create`` (``update_conflicts`` donde hay clave natural única).
+
+El avance (filas_procesadas / filas_con_error) y los errores por fila
+(ImportJob.errores, JSON) se guardan en la misma transacción que cada lote,
+así que ``filas_procesadas`` es también el punto de reanudación: si la cola
+reintenta el trabajo, las filas ya confirmadas se saltan en lugar de volver
+a insertarse (los lotes de inventario no tienen clave natural).
+
+Cada texto se compara con el ``max_length`` de su columna antes de guardar;
+los que no caben se informan como error de la fila.
+
+``ImportJob.archivo_url`` solo puede ser una URL http(s) o una ruta (también
+``file://``) dentro de IMPORTACION_DIR: cualquier otro origen se rechaza
+antes de abrirlo, porque partes del archivo vuelven al usuario en los
+errores por fila.
+"""
+import csv
+import io
+import json
+import shutil
+import tempfile
+import urllib.request
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models import CharField, DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from core.models import (
+    Categoria, Compra, CompraItem, ImportJob, Lote, Marca, MovimientoInventario, Producto,
+    ProductoVariante, Proveedor, Rol, Usuario,
+)
+from core.services import busqueda, catalogo, snapshots
+from core.services.auditoria import registrar_accion
+from core.services.stock import registrar_movimientos
+
+MAX_ERRORES_GUARDADOS = 1000
+CENTIMO = Decimal('0.01')
+
+
+class FilaInvalida(ValueError):
+    pass
+
+
+class OrigenNoPermitido(ValueError):
+    pass
+
+
+# -----------------------------
+# Lectura del archivo
+# -----------------------------
+def directorio_importacion():
+    return Path(getattr(settings, 'IMPORTACION_DIR', settings.BASE_DIR / 'imports')).resolve()
+
+
+def ruta_local(url):
+    """
+    Ruta absoluta de un archivo local dentro de IMPORTACION_DIR (las rutas
+    relativas parten de ahí), o None si ``url`` es http(s). Lanza
+    OrigenNoPermitido con cualquier otro esquema o ruta fuera del directorio.
+    """
+    partes = urlparse(url)
+    if partes.scheme in ('http', 'https'):
+        return None
+    if partes.scheme == 'file' and partes.netloc in ('', 'localhost'):
+        ruta = unquote(partes.path)
+    elif not partes.scheme:
+        ruta = url
+    else:
+        raise OrigenNoPermitido(f"Origen de importación no permitido: {partes.scheme}://")
+    directorio = directorio_importacion()
+    # resolve() sigue enlaces simbólicos y '..': se compara la ruta real
+    resuelta = (directorio / ruta).resolve()
+    if not resuelta.is_relative_to(directorio):
+        raise OrigenNoPermitido("El archivo a importar debe estar dentro de IMPORTACION_DIR")
+    return resuelta
+
+
+@contextmanager
+def abrir_archivo(url):
+    """Flujo binario del archivo: http(s):// o una ruta dentro de IMPORTACION_DIR."""
+    ruta = ruta_local(url)
+    if ruta is not None:
+        with open(ruta, 'rb') as archivo:
+            yield archivo
+    else:
+        with urllib.request.urlopen(url) as respuesta:
+            yield respuesta
+
+
+def leer_filas(url):
+    """Genera diccionarios {columna: valor} con las columnas en minúsculas."""
+    if urlparse(url).path.lower().endswith('.xlsx'):
+        yield from _leer_xlsx(url)
+        return
+    with abrir_archivo(url) as archivo:
+        texto = io.TextIOWrapper(archivo, encoding='utf-8-sig', newline='')
+        lector = csv.reader(texto)
+        columnas = [c.strip().lower() for c in next(lector, [])]
+        for valores in lector:
+            if any(valores):
+                yield dict(zip(columnas, valores))
+
+
+def _leer_xlsx(url):
+    try:
+        from openpyxl import load_workbook
+    except ImportError as exc:
+        raise RuntimeError("Importar XLSX requiere el paquete openpyxl") from exc
+    # openpyxl necesita un archivo con seek: se copia a disco por bloques
+    with tempfile.NamedTemporaryFile(suffix='.xlsx') as temporal:
+        with abrir_archivo(url) as archivo:
+            shutil.copyfileobj(archivo, temporal)
+        temporal.flush()
+        libro = load_workbook(temporal.name, read_only=True, data_only=True)
+        try:
+            filas = libro.active.iter_rows(values_only=True)
+            columnas = [str(c or '').strip().lower() for c in next(filas, ())]
+            for valores in filas:
+                if any(v not in (None, '') for v in valores):
+                    yield dict(zip(columnas, valores))
+        finally:
+            libro.close()
+
+
+# -----------------------------
+# Conversión de valores
+# -----------------------------
+def _texto(fila, campo, requerido=False):
+    valor = fila.get(campo)
+    valor = '' if valor is None else str(valor).strip()
+    if requerido and not valor:
+        raise FilaInvalida(f"'{campo}' es obligatorio")
+    return valor or None
+
+
+def _decimal(fila, campo, requerido=False):
+    valor = _texto(fila, campo, requerido)
+    if valor is None:
+        return None
+    try:
+        return Decimal(valor.replace(',', '.'))
+    except InvalidOperation:
+        raise FilaInvalida(f"'{campo}' no es un número: {valor}")
+
+
+def _entero(fila, campo, requerido=False, minimo=None):
+    numero = _decimal(fila, campo, requerido)
+    if numero is None:
+        return None
+    if numero != numero.to_integral_value() or (minimo is not None and numero < minimo):
+        raise FilaInvalida(f"'{campo}' debe ser un entero mayor o igual a {minimo or 0}")
+    return int(numero)
+
+
+def _fecha(fila, campo):
+    valor = fila.get(campo)
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    valor = _texto(fila, campo)
+    if valor is None:
+        return None
+    for formato in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(valor, formato).date()
+        except ValueError:
+            pass
+    raise FilaInvalida(f"'{campo}' no es una fecha válida: {valor}")
+
+
+def _fecha_hora(fila, campo):
+    dia = _fecha(fila, campo)
+    if dia is None:
+        return None
+    return timezone.make_aware(datetime.combine(dia, datetime.min.time()))
+
+
+def _booleano(fila, campo, defecto=True):
+    valor = _texto(fila, campo)
+    if valor is None:
+        return defecto
+    return valor.lower() in ('1', 'si', 'sí', 'true', 'verdadero', 'x')
+
+
+def _resolver(diccionario, clave, campo):
+    if clave is None:
+        return None
+    try:
+        return diccionario[clave]
+    except KeyError:
+        raise FilaInvalida(f"{campo} '{clave}' no existe")
+
+
+def _verificar_longitudes(objetos):
+    """FilaInvalida si algún texto excede el max_length de su columna."""
+    for objeto in objetos:
+        for campo in objeto._meta.concrete_fields:
+            if not isinstance(campo, CharField) or not campo.max_length:
+                continue
+            valor = getattr(objeto, campo.attname)
+            if isinstance(valor, str) and len(valor) > campo.max_length:
+                raise FilaInvalida(f"'{campo.name}' admite hasta {campo.max_length} caracteres")
+
+
+def _ultimo_por_clave(objetos, clave):
+    """Deja una fila por clave única dentro del lote (la última gana)."""
+    return list({getattr(o, clave): o for o in objetos}.values())
+
+
+# -----------------------------
+# Importadores
+# -----------------------------
+class Importador:
+    def __init__(self, job):
+        self.job = job
+
+    def preparar(self):
+        pass
+
+    def validar(self, fila):
+        raise NotImplementedError
+
+    def guardar(self, objetos):
+        raise NotImplementedError
+
+    def finalizar(self):
+        pass
+
+    def omitir(self, fila):
+        """Fila ya confirmada en un intento anterior (al reanudar)."""
+
+    def procesar_lote(self, numeradas):
+        """Valida y guarda un lote; devuelve los errores [{'fila', 'error'}]."""
+        errores, validos = [], []
+        for numero, fila in numeradas:
+            try:
+                objeto = self.validar(fila)
+                _verificar_longitudes(objeto if isinstance(objeto, tuple) else (objeto,))
+                validos.append(objeto)
+            except FilaInvalida as exc:
+                errores.append({'fila': numero, 'error': str(exc)})
+        if validos:
+            with transaction.atomic():
+                self.guardar(validos)
+        return errores
+
+
+class ImportadorProductos(Importador):
+    def preparar(self):
+        self.categorias = dict(Categoria.objects.values_list('slug', 'pk'))
+        self.marcas = {nombre.lower(): pk for nombre, pk in Marca.objects.values_list('nombre', 'pk')}
+
+    def validar(self, fila):
+        marca = _texto(fila, 'marca')
+        return Producto(
+            sku_base=_texto(fila, 'sku_base', requerido=True),
+            nombre=_texto(fila, 'nombre', requerido=True),
+            categoria_id=_resolver(self.categorias, _texto(fila, 'categoria', requerido=True), 'Categoría'),
+            marca_id=_resolver(self.marcas, marca.lower() if marca else None, 'Marca'),
+            descripcion=_texto(fila, 'descripcion'),
+            precio_base=_decimal(fila, 'precio_base'),
+            peso_kg=_decimal(fila, 'peso_kg'),
+            volumen_m3=_decimal(fila, 'volumen_m3'),
+            activo=_booleano(fila, 'activo'),
+            fecha_actualizacion=timezone.now(),
+        )
+
+    def guardar(self, productos):
+        productos = _ultimo_por_clave(productos, 'sku_base')
+        Producto.objects.bulk_create(
+            productos,
+            update_conflicts=True,
+            unique_fields=['sku_base'],
+            update_fields=[
+                'nombre', 'categoria', 'marca', 'descripcion', 'precio_base', 'peso_kg',
+                'volumen_m3', 'activo', 'fecha_actualizacion',
+            ],
+        )
+        # bulk_create no dispara señales: búsqueda, fichas y snapshots se actualizan explícitamente
+        ids = Producto.objects.filter(sku_base__in=[p.sku_base for p in productos]).values_list('pk', flat=True)
+        ids = list(ids)
+        transaction.on_commit(lambda: busqueda.actualizar_documentos(ids))
+        transaction.on_commit(lambda: catalogo.incrementar_versiones(ids))
+        transaction.on_commit(lambda: snapshots.reconstruir(ids))
+
+
+class ImportadorLotes(Importador):
+    def preparar(self):
+        self.variantes = {
+            sku: (pk, producto_id)
+            for sku, pk, producto_id in ProductoVariante.objects.values_list('sku', 'pk', 'producto_id').iterator()
+        }
+        self.proveedores = dict(Proveedor.objects.exclude(ruc__isnull=True).values_list('ruc', 'pk'))
+
+    def validar(self, fila):
+        variante_id, producto_id = _resolver(self.variantes, _texto(fila, 'sku', requerido=True), 'Variante')
+        cantidad = _entero(fila, 'cantidad', requerido=True, minimo=1)
+        costo_unitario = _decimal(fila, 'costo_unitario', requerido=True)
+        return Lote(
+            producto_id=producto_id,
+            variante_id=variante_id,
+            proveedor_id=_resolver(self.proveedores, _texto(fila, 'proveedor_ruc'), 'Proveedor'),
+            codigo_lote=_texto(fila, 'codigo_lote'),
+            presentacion=_texto(fila, 'presentacion'),
+            unidades_por_presentacion=_entero(fila, 'unidades_por_presentacion', minimo=1) or 1,
+            cantidad_inicial=cantidad,
+            cantidad_disponible=cantidad,
+            costo_unitario=costo_unitario,
+            costo_total=(costo_unitario * cantidad).quantize(CENTIMO),
+            fecha_ingreso=_fecha_hora(fila, 'fecha_ingreso') or timezone.now(),
+            fecha_vencimiento=_fecha(fila, 'fecha_vencimiento'),
+        )
+
+    def guardar(self, lotes):
+        # Los lotes no tienen clave natural: siempre son altas, con su entrada al ledger
+        Lote.objects.bulk_create(lotes)
+        registrar_movimientos([
+            MovimientoInventario(
+                lote=lote,
+                variante_id=lote.variante_id,
+                tipo='entrada',
+                cantidad=lote.cantidad_inicial,
+                costo_unitario=lote.costo_unitario,
+                total_costo=lote.costo_total,
+                motivo=f"Importación #{self.job.pk}",
+                usuario_id=self.job.usuario_id,
+                fecha=lote.fecha_ingreso,
+            )
+            for lote in lotes
+        ])
+
+
+class ImportadorCompras(Importador):
+    """Una fila por item; las compras se agrupan por 'codigo'."""
+
+    def preparar(self):
+        self.proveedores = dict(Proveedor.objects.exclude(ruc__isnull=True).values_list('ruc', 'pk'))
+        self.variantes = {
+            sku: (pk, producto_id)
+            for sku, pk, producto_id in ProductoVariante.objects.values_list('sku', 'pk', 'producto_id').iterator()
+        }
+        self.productos = dict(Producto.objects.exclude(sku_base__isnull=True).values_list('sku_base', 'pk'))
+        self.codigos = set()
+
+    def omitir(self, fila):
+        # Las compras ya guardadas no deben perder sus items ni quedar fuera de los totales
+        try:
+            compra, _ = self.validar(fila)
+        except FilaInvalida:
+            return
+        self.codigos.add(compra.codigo)
+
+    def validar(self, fila):
+        sku = _texto(fila, 'sku')
+        if sku:
+            variante_id, producto_id = _resolver(self.variantes, sku, 'Variante')
+        else:
+            variante_id = None
+            producto_id = _resolver(self.productos, _texto(fila, 'sku_base', requerido=True), 'Producto')
+        unidades = _entero(fila, 'unidades_por_presentacion', minimo=1) or 1
+        presentaciones = _entero(fila, 'cantidad_presentaciones', requerido=True, minimo=1)
+        precio = _decimal(fila, 'precio_unitario_presentacion', requerido=True)
+        compra = Compra(
+            codigo=_texto(fila, 'codigo', requerido=True),
+            proveedor_id=_resolver(self.proveedores, _texto(fila, 'proveedor_ruc', requerido=True), 'Proveedor'),
+            fecha_compra=_fecha_hora(fila, 'fecha_compra') or timezone.now(),
+            subtotal=0,
+            total=0,
+        )
+        item = CompraItem(
+            producto_id=producto_id,
+            variante_id=variante_id,
+            presentacion=_texto(fila, 'presentacion'),
+            unidades_por_presentacion=unidades,
+            cantidad_presentaciones=presentaciones,
+            cantidad_unidades=unidades * presentaciones,
+            precio_unitario_presentacion=precio,
+            precio_unitario_unidad=(precio / unidades).quantize(Decimal('0.0001')),
+            subtotal=(precio * presentaciones).quantize(CENTIMO),
+        )
+        return compra, item
+
+    def guardar(self, filas):
+        compras = _ultimo_por_clave([compra for compra, _ in filas], 'codigo')
+        Compra.objects.bulk_create(
+            compras,
+            update_conflicts=True,
+            unique_fields=['codigo'],
+            update_fields=['proveedor', 'fecha_compra'],
+        )
+        ids = dict(Compra.objects.filter(codigo__in=[c.codigo for c in compras]).values_list('codigo', 'pk'))
+        # Reimportar una compra reemplaza sus items en lugar de duplicarlos
+        nuevas = [ids[c.codigo] for c in compras if c.codigo not in self.codigos]
+        CompraItem.objects.filter(compra_id__in=nuevas).delete()
+        self.codigos.update(ids)
+        for compra, item in filas:
+            item.compra_id = ids[compra.codigo]
+        CompraItem.objects.bulk_create([item for _, item in filas])
+
+    def finalizar(self):
+        codigos = list(self.codigos)
+        subtotal = Coalesce(
+            Subquery(
+                CompraItem.objects.filter(compra=OuterRef('pk')).values('compra')
+                .annotate(total=Sum('subtotal')).values('total')
+            ),
+            Value(Decimal('0')),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        )
+        for inicio in range(0, len(codigos), 1000):
+            Compra.objects.filter(codigo__in=codigos[inicio:inicio + 1000]).update(subtotal=subtotal)
+            Compra.objects.filter(codigo__in=codigos[inicio:inicio + 1000]).update(
+                total=F('subtotal') + F('impuestos')
+            )
+
+
+class ImportadorClientes(Importador):
+    def preparar(self):
+        self.roles = dict(Rol.objects.values_list('nombre', 'pk'))
+        self.rol_defecto = getattr(settings, 'IMPORTACION_ROL_CLIENTE', 'cliente')
+
+    def validar(self, fila):
+        email = _texto(fila, 'email', requerido=True).lower()
+        try:
+            validate_email(email)
+        except ValidationError:
+            raise FilaInvalida(f"Email inválido: {email}")
+        return Usuario(
+            email=email,
+            rol_id=_resolver(self.roles, _texto(fila, 'rol') or self.rol_defecto, 'Rol'),
+            nombre=_texto(fila, 'nombre'),
+            apellido=_texto(fila, 'apellido'),
+            telefono=_texto(fila, 'telefono'),
+            documento=_texto(fila, 'documento'),
+            direccion=_texto(fila, 'direccion'),
+        )
+
+    def guardar(self, usuarios):
+        Usuario.objects.bulk_create(
+            _ultimo_por_clave(usuarios, 'email'),
+            update_conflicts=True,
+            unique_fields=['email'],
+            update_fields=['nombre', 'apellido', 'telefono', 'documento', 'direccion'],
+        )
+
+
+IMPORTADORES = {
+    'productos': ImportadorProductos,
+    'lotes': ImportadorLotes,
+    'compras': ImportadorCompras,
+    'clientes': ImportadorClientes,
+}
+
+
+def ejecutar_importacion(job, tamano_lote=None):
+    """
+    Procesa el ImportJob completo, reanudando tras las filas ya confirmadas.
+    Si falla, queda en 'error' y relanza.
+    """
+    tamano_lote = tamano_lote or getattr(settings, 'IMPORTACION_TAMANO_LOTE', 2000)
+    importador = IMPORTADORES[job.tipo](job)
+    confirmadas = job.filas_procesadas
+    errores = [e for e in json.loads(job.errores or '[]') if e['fila'] is not None] if confirmadas else []
+    if not confirmadas:
+        job.filas_con_error = 0
+    job.status = 'procesando'
+    job.fecha_inicio = timezone.now()
+    job.save(update_fields=['status', 'filas_procesadas', 'filas_con_error', 'fecha_inicio'])
+
+    try:
+        importador.preparar()
+        filas = enumerate(leer_filas(job.archivo_url), start=2)  # fila 1 = encabezados
+        for _, fila in islice(filas, confirmadas):
+            importador.omitir(fila)
+        while lote := list(islice(filas, tamano_lote)):
+            with transaction.atomic():
+                errores_lote = importador.procesar_lote(lote)
+                acumulados = errores + errores_lote[:MAX_ERRORES_GUARDADOS - len(errores)]
+                procesadas = job.filas_procesadas + len(lote)
+                con_error = job.filas_con_error + len(errores_lote)
+                # El avance se confirma junto con el lote: es el punto de reanudación
+                ImportJob.objects.filter(pk=job.pk).update(
+                    filas_procesadas=procesadas, filas_con_error=con_error,
+                    errores=json.dumps(acumulados, ensure_ascii=False) if acumulados else None,
+                )
+            errores, job.filas_procesadas, job.filas_con_error = acumulados, procesadas, con_error
+        importador.finalizar()
+        job.status = 'completado_con_errores' if job.filas_con_error else 'completado'
+    except Exception as exc:
+        job.status = 'error'
+        errores.append({'fila': None, 'error': str(exc)})
+        raise
+    finally:
+        job.errores = json.dumps(errores, ensure_ascii=False) if errores else None
+        job.fecha_fin = timezone.now()
+        job.save(update_fields=['status', 'errores', 'fecha_fin', 'filas_procesadas', 'filas_con_error'])
+        registrar_accion('importacion.ejecutar', job.usuario_id, {
+            'job': job.pk, 'tipo': job.tipo, 'status': job.status,
+            'filas': job.filas_procesadas, 'filas_con_error': job.filas_con_error,
+        })
+    return job
@@ -0,0 +1,236 @@
+"""
+Asignación FEFO (First-Expired-First-Out) de lotes a los items de un pedido.
+
+Cada PedidoItem sin ``lote_origen`` se reparte entre los lotes de su variante
+por fecha de vencimiento; si necesita varios lotes se divide en varios items.
+Los lotes se bloquean con ``select_for_update(skip_locked=True)`` de a uno y
+solo cuando el item necesita otro, así que dos checkouts simultáneos sobre
+la misma variante toman lotes distintos en lugar de esperarse. Si los lotes libres no alcanzan se
+lanza StockInsuficiente y el llamador puede reintentar (con ``parcial`` lo
+que no alcanza queda como un item sin lote).
+
+Cada item lleva en el ledger su reserva neta (movimientos 'reserva' con su
+``pedido_item``): el checkout la abre sin lote. Al asignar, la reserva
+abierta del item se libera y se reemplaza por el movimiento ``tipo`` de cada
+parte, así que una reserva nunca se cuenta dos veces. ``despachar`` convierte
+en 'salida' la reserva (con o sin lote) de los items aún no despachados y
+``devolver_lotes`` devuelve a sus lotes las unidades de items que no salieron.
+
+Dividir items o cambiar su ``lote_origen`` cambia el costo de los cubos de
+ventas: esos pedidos avanzan su ``fecha_actualizacion`` (el watermark de
+core.services.analitica).
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Sum
+from django.utils import timezone
+
+from core.models import Lote, MovimientoInventario, Pedido, PedidoItem
+from core.services.stock import StockInsuficiente, registrar_movimientos, reservas_abiertas
+
+CENTIMO = Decimal('0.01')
+
+
+def _sin_salida(items):
+    """Items que todavía no tienen su 'salida' en el ledger."""
+    salidas = MovimientoInventario.objects.filter(tipo='salida', pedido_item=OuterRef('pk'))
+    return items.filter(~Exists(salidas))
+
+
+def asignar_lotes(pedido, tipo='reserva', usuario=None, parcial=False):
+    """
+    Asigna lotes a los items pendientes del pedido y registra un movimiento
+    ``tipo`` ('reserva' o 'salida') por cada porción. Devuelve los items
+    resultantes (incluidos los creados al dividir).
+    """
+    return asignar_lotes_pedidos([pedido.pk], tipo=tipo, usuario=usuario, parcial=parcial)
+
+
+def asignar_lotes_pedidos(pedido_ids, tipo='reserva', usuario=None, parcial=False):
+    """Como ``asignar_lotes`` para varios pedidos en una sola transacción."""
+    if tipo not in ('reserva', 'salida'):
+        raise ValueError(f"Tipo de movimiento no válido para asignación: {tipo}")
+
+    pedido_ids = list(pedido_ids)
+    with transaction.atomic():
+        items = list(
+            _sin_salida(PedidoItem.objects.filter(pedido_id__in=pedido_ids, lote_origen__isnull=True))
+            .annotate(codigo_pedido=F('pedido__codigo')).order_by('pk')
+        )
+        lotes_por_variante = {}
+        vistos = {}
+        repartos = []
+        faltantes = set()
+
+        for item in items:
+            lotes = lotes_por_variante.setdefault(item.variante_id, [])
+            excluidos = vistos.setdefault(item.variante_id, set())
+            porciones = _repartir(item, lotes, excluidos)
+            restante = item.cantidad - sum(cantidad for _, cantidad in porciones)
+            if restante > 0:
+                if not parcial:
+                    faltantes.add(item.variante_id)
+                elif not porciones:
+                    continue
+                else:
+                    porciones.append((None, restante))
+            repartos.append((item, porciones))
+
+        if faltantes:
+            raise StockInsuficiente(faltantes)
+
+        abiertas = reservas_abiertas(pedido_ids)
+        actualizados, nuevos, movimientos = [], [], []
+        for item, porciones in repartos:
+            motivo = f"Pedido {item.codigo_pedido}"
+            if item.pk in abiertas:
+                # La reserva sin lote del checkout pasa a las partes
+                movimientos.append(MovimientoInventario(
+                    variante_id=item.variante_id, tipo='reserva', cantidad=-abiertas[item.pk],
+                    motivo=motivo, usuario=usuario, pedido_item=item,
+                ))
+            partes = _dividir_item(item, porciones)
+            actualizados.append(partes[0])
+            nuevos.extend(partes[1:])
+            for parte in partes:
+                movimientos.append(_movimiento(parte, tipo, motivo, usuario))
+
+        PedidoItem.objects.bulk_update(
+            actualizados, ['lote_origen', 'cantidad', 'subtotal', 'descuento_item', 'total_neto']
+        )
+        PedidoItem.objects.bulk_create(nuevos)
+        tocados = {lote.pk: lote for _, porciones in repartos for lote, _ in porciones if lote is not None}
+        Lote.objects.bulk_update(tocados.values(), ['cantidad_disponible'])
+        registrar_movimientos(movimientos)
+        _marcar_pedidos({item.pedido_id for item, _ in repartos})
+
+    return actualizados + nuevos
+
+
+def despachar(pedido_ids, usuario=None):
+    """
+    Registra la 'salida' de los items de los pedidos que aún no salieron,
+    cerrando su reserva abierta. Los items con lote salen de ese lote (las
+    unidades ya se descontaron al asignarlo). Devuelve los movimientos.
+    """
+    pedido_ids = list(pedido_ids)
+    with transaction.atomic():
+        items = list(
+            _sin_salida(PedidoItem.objects.filter(pedido_id__in=pedido_ids))
+            .annotate(codigo_pedido=F('pedido__codigo'))
+            .select_related('lote_origen').order_by('pk')
+        )
+        abiertas = reservas_abiertas(pedido_ids)
+        movimientos = []
+        for item in items:
+            motivo = f"Despacho pedido {item.codigo_pedido}"
+            if item.pk in abiertas:
+                movimientos.append(MovimientoInventario(
+                    variante_id=item.variante_id, tipo='reserva', cantidad=-abiertas[item.pk],
+                    lote=item.lote_origen, motivo=motivo, usuario=usuario, pedido_item=item,
+                ))
+            movimientos.append(_movimiento(item, 'salida', motivo, usuario))
+        return registrar_movimientos(movimientos)
+
+
+def devolver_lotes(pedido_ids):
+    """
+    Devuelve a ``Lote.cantidad_disponible`` las unidades asignadas a items
+    de esos pedidos que no salieron y les quita el lote. Devuelve unidades.
+    """
+    with transaction.atomic():
+        items = _sin_salida(PedidoItem.objects.filter(pedido_id__in=list(pedido_ids), lote_origen__isnull=False))
+        por_lote = dict(
+            items.order_by('lote_origen_id').values('lote_origen_id').annotate(unidades=Sum('cantidad'))
+            .values_list('lote_origen_id', 'unidades')
+        )
+        if not por_lote:
+            return 0
+        # Mismo orden de bloqueo que la asignación
+        for lote in Lote.objects.select_for_update().filter(pk__in=list(por_lote)).order_by('pk'):
+            lote.cantidad_disponible += por_lote[lote.pk]
+            lote.save(update_fields=['cantidad_disponible'])
+        _marcar_pedidos(set(items.values_list('pedido_id', flat=True)))
+        items.update(lote_origen=None)
+    return sum(por_lote.values())
+
+
+def _marcar_pedidos(pedido_ids):
+    if pedido_ids:
+        Pedido.objects.filter(pk__in=sorted(pedido_ids)).update(fecha_actualizacion=timezone.now())
+
+
+def _movimiento(item, tipo, motivo, usuario):
+    lote = item.lote_origen
+    costo = {} if lote is None else {
+        'costo_unitario': lote.costo_unitario,
+        'total_costo': (lote.costo_unitario * item.cantidad).quantize(CENTIMO),
+    }
+    return MovimientoInventario(
+        lote=lote, variante_id=item.variante_id, tipo=tipo, cantidad=item.cantidad,
+        motivo=motivo, usuario=usuario, pedido_item=item, **costo,
+    )
+
+
+def _siguiente_lote(variante_id, excluidos):
+    """Bloquea el próximo lote FEFO con saldo que nadie más tenga bloqueado."""
+    return (
+        Lote.objects.select_for_update(skip_locked=True)
+        .filter(variante_id=variante_id, cantidad_disponible__gt=0)
+        .exclude(pk__in=excluidos)
+        .order_by(F('fecha_vencimiento').asc(nulls_last=True), 'fecha_ingreso', 'pk')
+        .first()
+    )
+
+
+def _repartir(item, lotes, excluidos):
+    """Toma unidades de los lotes ya bloqueados y bloquea otro solo si hace falta."""
+    pendiente = item.cantidad
+    porciones = []
+    indice = 0
+    while pendiente > 0:
+        if indice == len(lotes):
+            siguiente = _siguiente_lote(item.variante_id, excluidos)
+            if siguiente is None:
+                break
+            lotes.append(siguiente)
+            excluidos.add(siguiente.pk)
+        lote = lotes[indice]
+        indice += 1
+        tomado = min(lote.cantidad_disponible, pendiente)
+        if tomado <= 0:
+            continue
+        lote.cantidad_disponible -= tomado
+        pendiente -= tomado
+        porciones.append((lote, tomado))
+    return porciones
+
+
+def _dividir_item(item, porciones):
+    """Divide el item en una parte por lote, repartiendo importes proporcionalmente."""
+    total = item.cantidad
+    subtotal_original, descuento_original = item.subtotal, item.descuento_item
+    subtotal, descuento = subtotal_original, descuento_original
+    partes = []
+    for i, (lote, cantidad) in enumerate(porciones):
+        parte = item if i == 0 else PedidoItem(
+            pedido_id=item.pedido_id,
+            variante_id=item.variante_id,
+            precio_unitario=item.precio_unitario,
+            promocion_aplicada_id=item.promocion_aplicada_id,
+        )
+        parte.lote_origen = lote
+        parte.cantidad = cantidad
+        if i == len(porciones) - 1:
+            # La última parte absorbe el redondeo
+            parte.subtotal = subtotal
+            parte.descuento_item = descuento
+        else:
+            parte.subtotal = (subtotal_original * cantidad / total).quantize(CENTIMO)
+            parte.descuento_item = (descuento_original * cantidad / total).quantize(CENTIMO)
+            subtotal -= parte.subtotal
+            descuento -= parte.descuento_item
+        parte.total_neto = parte.subtotal - parte.descuento_item
+        partes.append(parte)
+    return partes
@@ -0,0 +1,262 @@
+"""
+Tablas particionadas por mes en PostgreSQL (PARTITION BY RANGE sobre una fecha).
+
+Django no modela particiones: el modelo no cambia y la tabla se convierte con
+``particionar_tabla``. La conversión copia la tabla entera bajo un lock
+ACCESS EXCLUSIVE (nadie lee ni escribe mientras dura), así que no corre en
+``migrate`` salvo con PARTICIONES_EN_MIGRACION=True: se lanza a mano en una
+ventana de mantenimiento con ``manage.py particionar_tabla``, que informa la
+duración. La clave primaria pasa a ser (id, fecha),
+que PostgreSQL exige incluya la columna de partición; el ORM sigue usando id.
+Cada mes es una tabla ``<tabla>_pAAAAMM`` y ``<tabla>_default`` recibe lo que
+no tenga partición. Borrar un mes viejo es un DROP TABLE en lugar de un
+DELETE fila por fila.
+
+``mantener`` crea los meses próximos y aplica la retención configurada por
+tabla; lo corren ``manage.py mantener_particiones`` y, periódicamente, el
+worker ``run_jobs``. Borrar particiones es opt-in: sin ``borrar=True``
+(``mantener_particiones --borrar``, o PARTICIONES_BORRAR_EN_WORKER para
+``run_jobs``) solo se informan las que exceden la retención.
+
+Las migraciones 0020 y 0022 usan su propia copia congelada de este DDL
+(core/migrations/_particiones.py): los cambios aquí no las alteran.
+"""
+import re
+from collections import namedtuple
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.models import LogAccion, MovimientoInventario
+
+Particionada = namedtuple('Particionada', 'modelo columna retencion')
+
+# retencion: nombre del setting con los meses a conservar (None o ausente = todo)
+PARTICIONADAS = [
+    Particionada(LogAccion, 'fecha', 'AUDITORIA_RETENCION_MESES'),
+    Particionada(MovimientoInventario, 'fecha', None),  # el ledger no se poda
+]
+
+
+def _q(nombre):
+    return '"%s"' % nombre.replace('"', '""')
+
+
+def _mes(anio, mes):
+    return timezone.make_aware(datetime(anio, mes, 1), timezone.get_default_timezone())
+
+
+def _siguiente(anio, mes):
+    return (anio + 1, 1) if mes == 12 else (anio, mes + 1)
+
+
+def _mes_de(fecha):
+    fecha = timezone.localtime(fecha, timezone.get_default_timezone())
+    return fecha.year, fecha.month
+
+
+def es_particionada(cursor, tabla):
+    cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass", [tabla])
+    return cursor.fetchone() is not None
+
+
+def en_migracion(schema_editor):
+    """Si la migración debe convertir la tabla (ver PARTICIONES_EN_MIGRACION)."""
+    return schema_editor.connection.vendor == 'postgresql' and getattr(settings, 'PARTICIONES_EN_MIGRACION', False)
+
+
+def reescribir(tabla, revertir=False, lock_timeout='10s'):
+    """
+    Convierte ``tabla`` (una de PARTICIONADAS) en particionada, o la vuelve
+    normal con ``revertir``. Si otra transacción retiene la tabla más de
+    ``lock_timeout`` se aborta sin cambios. Devuelve False si ya estaba así.
+    """
+    particionada = next(p for p in PARTICIONADAS if p.modelo._meta.db_table == tabla)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT set_config('lock_timeout', %s, true)", [lock_timeout])
+        if es_particionada(cursor, tabla) != revertir:
+            return False
+        if revertir:
+            desparticionar_tabla(cursor, tabla, particionada.columna)
+        else:
+            particionar_tabla(cursor, tabla, particionada.columna)
+    return True
+
+
+def particionar_tabla(cursor, tabla, columna, pk='id', meses_adelante=3):
+    """Convierte ``tabla`` en particionada por mes, conservando datos, índices y FKs."""
+    _reconstruir(cursor, tabla, columna, pk, meses_adelante)
+
+
+def desparticionar_tabla(cursor, tabla, columna, pk='id'):
+    """Vuelve a una tabla normal (reversa de la migración)."""
+    _reconstruir(cursor, tabla, columna, pk, None)
+
+
+def _reconstruir(cursor, tabla, columna, pk, meses_adelante):
+    particionar = meses_adelante is not None
+    cursor.execute(
+        "SELECT count(*) FROM pg_constraint WHERE confrelid = %s::regclass AND contype = 'f'", [tabla]
+    )
+    if cursor.fetchone()[0]:
+        raise RuntimeError(f"{tabla} es referenciada por claves foráneas: no se puede reconstruir")
+    cursor.execute(
+        "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'u'", [tabla]
+    )
+    if particionar and cursor.fetchone():
+        raise RuntimeError(f"{tabla} tiene restricciones UNIQUE sin la columna {columna}")
+
+    # Índices (salvo la PK) y FKs se recrean con el mismo nombre al final
+    cursor.execute(
+        """
+        SELECT indexdef FROM pg_indexes
+        WHERE schemaname = current_schema() AND tablename = %s
+          AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p')
+        """,
+        [tabla, tabla],
+    )
+    indices = [fila[0] for fila in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+        [tabla],
+    )
+    foraneas = cursor.fetchall()
+    cursor.execute(f"SELECT min({_q(columna)}) FROM {_q(tabla)}")
+    minimo = cursor.fetchone()[0]
+
+    cursor.execute("SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'", [tabla])
+    nombre_pk = cursor.fetchone()[0]
+
+    anterior = f"{tabla}_anterior"
+    cursor.execute(f"ALTER TABLE {_q(tabla)} RENAME TO {_q(anterior)}")
+    cursor.execute(f"ALTER TABLE {_q(anterior)} RENAME CONSTRAINT {_q(nombre_pk)} TO {_q(anterior + '_pkey')}")
+    cursor.execute(
+        f"CREATE TABLE {_q(tabla)} (LIKE {_q(anterior)} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING STORAGE)"
+        + (f" PARTITION BY RANGE ({_q(columna)})" if particionar else "")
+    )
+    claves = f"{_q(pk)}, {_q(columna)}" if particionar else _q(pk)
+    cursor.execute(f"ALTER TABLE {_q(tabla)} ADD CONSTRAINT {_q(nombre_pk)} PRIMARY KEY ({claves})")
+    if particionar:
+        cursor.execute(f"CREATE TABLE {_q(tabla + '_default')} PARTITION OF {_q(tabla)} DEFAULT")
+        crear_particiones(cursor, tabla, columna, minimo or timezone.now(), meses_adelante)
+
+    # Columna serial (no identity): la secuencia pasa a la tabla nueva antes del DROP
+    cursor.execute("SELECT pg_get_serial_sequence(%s, %s)", [anterior, pk])
+    secuencia = cursor.fetchone()[0]
+    cursor.execute("SELECT pg_get_serial_sequence(%s, %s)", [tabla, pk])
+    if secuencia and cursor.fetchone()[0] is None:
+        cursor.execute(f"ALTER SEQUENCE {secuencia} OWNED BY {_q(tabla)}.{_q(pk)}")
+
+    cursor.execute(f"INSERT INTO {_q(tabla)} SELECT * FROM {_q(anterior)}")
+    cursor.execute(f"DROP TABLE {_q(anterior)}")
+    for definicion in indices:
+        # En la tabla particionada los índices se listan como "ON ONLY"; al recrearlos deben propagarse
+        cursor.execute(definicion.replace(' ON ONLY ', ' ON ', 1))
+    for nombre, definicion in foraneas:
+        cursor.execute(f"ALTER TABLE {_q(tabla)} ADD CONSTRAINT {_q(nombre)} {definicion}")
+    cursor.execute(
+        f"SELECT setval(pg_get_serial_sequence(%s, %s), COALESCE(max({_q(pk)}), 0) + 1, false) FROM {_q(tabla)}",
+        [tabla, pk],
+    )
+
+
+def particiones(cursor, tabla):
+    """{(año, mes): nombre} de las particiones mensuales existentes."""
+    cursor.execute(
+        """
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+        """,
+        [tabla],
+    )
+    patron = re.compile(rf'^{re.escape(tabla)}_p(\d{{4}})(\d{{2}})$')
+    meses = {}
+    for (nombre,) in cursor.fetchall():
+        coincidencia = patron.match(nombre)
+        if coincidencia:
+            meses[int(coincidencia[1]), int(coincidencia[2])] = nombre
+    return meses
+
+
+def crear_particiones(cursor, tabla, columna, desde, meses_adelante=3):
+    """
+    Crea las particiones desde el mes de ``desde`` hasta ``meses_adelante``
+    meses después del actual. Si la partición default ya tiene filas de un
+    mes nuevo, se mueven antes de adjuntarla. Devuelve las creadas.
+    """
+    existentes = particiones(cursor, tabla)
+    anio, mes = _mes_de(desde)
+    hasta = _mes_de(timezone.now())
+    for _ in range(meses_adelante):
+        hasta = _siguiente(*hasta)
+
+    creadas = []
+    while (anio, mes) <= hasta:
+        if (anio, mes) not in existentes:
+            nombre = f"{tabla}_p{anio:04d}{mes:02d}"
+            inicio, fin = _mes(anio, mes), _mes(*_siguiente(anio, mes))
+            cursor.execute(f"CREATE TABLE {_q(nombre)} (LIKE {_q(tabla)} INCLUDING DEFAULTS INCLUDING STORAGE)")
+            cursor.execute(
+                f"""
+                WITH movidas AS (
+                    DELETE FROM {_q(tabla + '_default')} WHERE {_q(columna)} >= %s AND {_q(columna)} < %s
+                    RETURNING *
+                )
+                INSERT INTO {_q(nombre)} SELECT * FROM movidas
+                """,
+                [inicio, fin],
+            )
+            cursor.execute(
+                f"ALTER TABLE {_q(tabla)} ATTACH PARTITION {_q(nombre)} FOR VALUES FROM (%s) TO (%s)",
+                [inicio, fin],
+            )
+            creadas.append(nombre)
+        anio, mes = _siguiente(anio, mes)
+    return creadas
+
+
+def eliminar_particiones(cursor, tabla, retener_meses, simular=False):
+    """Borra (DROP TABLE) los meses completos anteriores a los últimos ``retener_meses``."""
+    anio, mes = _mes_de(timezone.now())
+    for _ in range(retener_meses - 1):
+        anio, mes = (anio - 1, 12) if mes == 1 else (anio, mes - 1)
+    eliminadas = [nombre for clave, nombre in sorted(particiones(cursor, tabla).items()) if clave < (anio, mes)]
+    if not simular:
+        for nombre in eliminadas:
+            cursor.execute(f"DROP TABLE {_q(nombre)}")
+    return eliminadas
+
+
+def retencion(particionada):
+    return getattr(settings, particionada.retencion, None) if particionada.retencion else None
+
+
+def mantener(meses_adelante=3, simular=False, borrar=False):
+    """
+    Mantenimiento de todas las tablas de PARTICIONADAS: lista de (tabla,
+    acción, partición). Las particiones fuera de la retención solo se
+    borran con ``borrar``; si no, se listan como 'por borrar'.
+    """
+    if connection.vendor != 'postgresql':
+        return []
+    acciones = []
+    for particionada in PARTICIONADAS:
+        tabla = particionada.modelo._meta.db_table
+        with transaction.atomic(), connection.cursor() as cursor:
+            if not es_particionada(cursor, tabla):
+                acciones.append((tabla, 'sin particionar', None))
+                continue
+            if not simular:
+                for nombre in crear_particiones(cursor, tabla, particionada.columna, timezone.now(), meses_adelante):
+                    acciones.append((tabla, 'creada', nombre))
+            meses = retencion(particionada)
+            if meses:
+                if simular:
+                    accion = 'se borraría'
+                else:
+                    accion = 'borrada' if borrar else 'por borrar'
+                for nombre in eliminar_particiones(cursor, tabla, meses, simular=simular or not borrar):
+                    acciones.append((tabla, accion, nombre))
+    return acciones
@@ -0,0 +1,234 @@
+"""
+Máquina de estados de Pedido con transiciones en lote.
+
+Transiciones válidas (TRANSICIONES):
+
+  pendiente -> pagado | cancelado
+  pagado -> preparando | cancelado
+  preparando -> enviado | cancelado
+  enviado -> entregado
+
+``transicionar`` aplica un destino a muchos pedidos en una transacción:
+bloquea las filas en orden de PK, las agrupa por estado actual y emite un
+único ``UPDATE ... WHERE estado = origen`` por cada origen válido; el
+historial (PedidoTransicion) se escribe con un ``bulk_create`` y el Envio de
+los pedidos se sincroniza con un UPDATE más (ENVIO_POR_ESTADO). Los pedidos
+cuyo estado actual no admite el destino se informan como rechazados sin
+frenar al resto del lote.
+
+QuerySet.update no pasa por ``auto_now``: ``fecha_actualizacion`` se fija a
+mano porque es el watermark de la analítica (core.services.analitica).
+
+Efectos sobre el stock (core.services.lotes):
+  - pagado: las retenciones temporales del pedido (ReservaStock) pasan a ser
+    la reserva firme de sus items en el ledger, salvo en los items que ya la
+    tienen (los que vienen del checkout).
+  - preparando: se asignan lotes FEFO a los items (``parcial``: lo que no
+    alcanza queda sin lote con su reserva abierta).
+  - enviado: la reserva de los items se convierte en 'salida'.
+  - cancelado: se borran las retenciones, se libera la reserva firme que
+    quede abierta, las unidades vuelven a sus lotes y cada cupón con
+    ``max_usos`` devuelve su uso al shard que lo contó.
+"""
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.db.models import DateTimeField, F, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from core.models import (
+    Envio, MovimientoInventario, Pedido, PedidoItem, PedidoTransicion, PromocionAplicada, ReservaStock,
+)
+from core.services import lotes
+from core.services.auditoria import registrar_accion
+from core.services.cupones import liberar_uso
+from core.services.stock import registrar_movimientos, reservas_abiertas
+
+TRANSICIONES = {
+    'pendiente': {'pagado', 'cancelado'},
+    'pagado': {'preparando', 'cancelado'},
+    'preparando': {'enviado', 'cancelado'},
+    'enviado': {'entregado'},
+    'entregado': set(),
+    'cancelado': set(),
+}
+
+# Estado del pedido -> (estado del Envio, fecha que se completa, estados del Envio que avanzan)
+ENVIO_POR_ESTADO = {
+    'enviado': ('en_transito', 'fecha_envio', ['pendiente']),
+    'entregado': ('entregado', 'fecha_entrega_real', ['pendiente', 'en_transito']),
+}
+
+
+class TransicionInvalida(Exception):
+    pass
+
+
+@dataclass
+class ResultadoTransicion:
+    destino: str
+    operacion: uuid.UUID
+    aplicados: dict = field(default_factory=dict)    # origen -> [pedido_id]
+    rechazados: dict = field(default_factory=dict)   # pedido_id -> estado actual
+    inexistentes: list = field(default_factory=list)
+    envios: int = 0
+
+    @property
+    def total_aplicados(self):
+        return sum(len(ids) for ids in self.aplicados.values())
+
+
+def origenes(destino):
+    """Estados desde los que se puede pasar a ``destino``."""
+    return sorted(origen for origen, destinos in TRANSICIONES.items() if destino in destinos)
+
+
+def puede_transicionar(origen, destino):
+    return destino in TRANSICIONES.get(origen, ())
+
+
+def transicionar(pedido_ids, destino, usuario=None, motivo=None):
+    """
+    Pasa a ``destino`` todos los pedidos de ``pedido_ids`` cuyo estado actual
+    lo permite. Devuelve un ResultadoTransicion; lanza TransicionInvalida
+    solo si ``destino`` no es un estado alcanzable.
+    """
+    if not origenes(destino):
+        raise TransicionInvalida(f"Ningún estado puede pasar a '{destino}'")
+    pedido_ids = sorted(set(pedido_ids))
+    resultado = ResultadoTransicion(destino=destino, operacion=uuid.uuid4())
+    ahora = timezone.now()
+    with transaction.atomic():
+        actuales = dict(
+            Pedido.objects.select_for_update().filter(pk__in=pedido_ids).order_by('pk')
+            .values_list('pk', 'estado')
+        )
+        resultado.inexistentes = [pk for pk in pedido_ids if pk not in actuales]
+        por_origen = defaultdict(list)
+        for pk, estado in actuales.items():
+            if puede_transicionar(estado, destino):
+                por_origen[estado].append(pk)
+            else:
+                resultado.rechazados[pk] = estado
+
+        for origen, ids in sorted(por_origen.items()):
+            # Condicional sobre el origen: filas ya bloqueadas, pero el WHERE documenta y protege la regla
+            Pedido.objects.filter(pk__in=ids, estado=origen).update(estado=destino, fecha_actualizacion=ahora)
+            resultado.aplicados[origen] = ids
+
+        aplicados = [pk for ids in resultado.aplicados.values() for pk in ids]
+        if not aplicados:
+            return resultado
+        PedidoTransicion.objects.bulk_create(
+            [
+                PedidoTransicion(
+                    pedido_id=pk, estado_anterior=origen, estado_nuevo=destino,
+                    operacion=resultado.operacion, usuario=usuario, motivo=motivo, fecha=ahora,
+                )
+                for origen, ids in resultado.aplicados.items()
+                for pk in ids
+            ],
+            batch_size=1000,
+        )
+        resultado.envios = _sincronizar_envios(aplicados, destino, ahora)
+        if destino == 'pagado':
+            _confirmar_retenciones(aplicados, usuario)
+        elif destino == 'preparando':
+            lotes.asignar_lotes_pedidos(aplicados, 'reserva', usuario=usuario, parcial=True)
+        elif destino == 'enviado':
+            lotes.despachar(aplicados, usuario=usuario)
+        elif destino == 'cancelado':
+            _liberar_reservas(aplicados, usuario)
+            _devolver_cupones(aplicados)
+        registrar_accion('pedidos.transicionar', usuario, {
+            'destino': destino, 'operacion': resultado.operacion, 'pedidos': len(aplicados),
+            'rechazados': len(resultado.rechazados), 'motivo': motivo,
+        })
+    return resultado
+
+
+def transicionar_uno(pedido, destino, usuario=None, motivo=None):
+    """Como ``transicionar`` para un pedido; lanza TransicionInvalida si no aplica."""
+    pedido_id = getattr(pedido, 'pk', pedido)
+    resultado = transicionar([pedido_id], destino, usuario=usuario, motivo=motivo)
+    if resultado.inexistentes:
+        raise TransicionInvalida(f"El pedido {pedido_id} no existe")
+    if resultado.rechazados:
+        raise TransicionInvalida(
+            f"El pedido {pedido_id} está '{resultado.rechazados[pedido_id]}' y no puede pasar a '{destino}'"
+        )
+    return resultado
+
+
+def _sincronizar_envios(pedido_ids, destino, ahora):
+    if destino not in ENVIO_POR_ESTADO:
+        return 0
+    estado_envio, campo_fecha, previos = ENVIO_POR_ESTADO[destino]
+    # Conserva la fecha si el transportista ya la había informado
+    return Envio.objects.filter(pedido_id__in=pedido_ids, estado_envio__in=previos).update(
+        estado_envio=estado_envio,
+        **{campo_fecha: Coalesce(F(campo_fecha), Value(ahora, output_field=DateTimeField()))},
+    )
+
+
+def _confirmar_retenciones(pedido_ids, usuario):
+    """
+    Reemplaza las retenciones temporales de los pedidos por la reserva firme
+    de sus items; los items que ya tienen reserva abierta no reservan de nuevo.
+    """
+    con_retencion = set(
+        ReservaStock.objects.filter(pedido_id__in=pedido_ids).values_list('pedido_id', flat=True).distinct()
+    )
+    if not con_retencion:
+        return
+    ReservaStock.objects.filter(pedido_id__in=con_retencion).delete()
+    abiertas = reservas_abiertas(con_retencion)
+    # Sin exigir disponible: el pago ya entró; si la retención venció y otro
+    # tomó el stock, el faltante queda a la vista como disponible negativo.
+    movimientos = [
+        MovimientoInventario(
+            variante_id=variante_id, tipo='reserva', cantidad=cantidad,
+            motivo=f"Pago pedido {codigo}", usuario=usuario, pedido_item_id=item_id,
+        )
+        for item_id, variante_id, cantidad, codigo in
+        PedidoItem.objects.filter(pedido_id__in=con_retencion).order_by('pk')
+        .values_list('pk', 'variante_id', 'cantidad', 'pedido__codigo')
+        if item_id not in abiertas
+    ]
+    if movimientos:
+        registrar_movimientos(movimientos)
+
+
+def _liberar_reservas(pedido_ids, usuario):
+    """
+    Borra las retenciones, libera la reserva firme abierta de los items
+    cancelados y devuelve a sus lotes las unidades asignadas.
+    """
+    ReservaStock.objects.filter(pedido_id__in=pedido_ids).delete()
+    abiertas = reservas_abiertas(pedido_ids)
+    movimientos = [
+        MovimientoInventario(
+            variante_id=item.variante_id, tipo='reserva', cantidad=-abiertas[item.pk],
+            lote_id=item.lote_origen_id, motivo=f"Cancelación pedido {item.codigo_pedido}",
+            usuario=usuario, pedido_item=item,
+        )
+        for item in PedidoItem.objects.filter(pk__in=list(abiertas))
+        .annotate(codigo_pedido=F('pedido__codigo')).order_by('pk')
+    ]
+    if movimientos:
+        registrar_movimientos(movimientos)
+    lotes.devolver_lotes(pedido_ids)
+
+
+def _devolver_cupones(pedido_ids):
+    """Devuelve un uso por promoción aplicada al shard que lo contó."""
+    aplicadas = (
+        PromocionAplicada.objects.filter(pedido_id__in=pedido_ids, promocion__max_usos__isnull=False)
+        .order_by('promocion_id', 'pk').values_list('promocion_id', 'shard_uso')
+    )
+    for promocion_id, shard in aplicadas:
+        # Sin shard (anteriores a la migración 0033): configurar_contador los sembró en el shard 0
+        liberar_uso(promocion_id, 0 if shard is None else shard)
@@ -0,0 +1,297 @@
+"""
+Motor de promociones compilado en memoria.
+
+Las promociones vigentes y sus PromocionProducto se cargan en dos consultas y
+se indexan por variante_id y producto_id. Evaluar un carrito completo no
+vuelve a consultar la base de datos: solo se verifica, como mucho cada
+PROMOCIONES_VERIFICACION_SEGUNDOS, el contador de versión 'promociones' que
+las señales incrementan al guardar o borrar Promocion/PromocionProducto.
+
+Semántica de 'x_por_y': cada ``cantidad_requerida`` unidades compradas,
+``cantidad_gratis`` salen gratis (2x1: requerida=2, gratis=1). Si la regla
+define producto_gratis/variante_gratis, las unidades gratis se toman de esa
+línea del carrito. 'monto_fijo' descuenta ``valor_descuento`` por unidad
+cuando aplica a productos, y una sola vez cuando es un cupón global.
+"""
+import threading
+import time
+from collections import defaultdict, namedtuple
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import CarritoItem, Promocion, PromocionProducto
+from core.services.versiones import version_actual
+
+CLAVE_VERSION = 'promociones'
+CERO = Decimal('0.00')
+CENTIMO = Decimal('0.01')
+
+LineaPromocion = namedtuple(
+    'LineaPromocion', 'item_id variante_id producto_id cantidad precio_unitario'
+)
+
+
+@dataclass(frozen=True)
+class Regla:
+    promocion_id: int
+    nombre: str
+    codigo: str
+    tipo: str
+    valor: Decimal
+    inicio: object
+    fin: object
+    min_compra: Decimal
+    max_usos: int = None
+    cantidad_requerida: int = 1
+    cantidad_gratis: int = 0
+    producto_gratis_id: int = None
+    variante_gratis_id: int = None
+
+    def aplica(self, ahora, cupon, subtotal):
+        if self.inicio > ahora or (self.fin is not None and self.fin < ahora):
+            return False
+        if self.codigo and self.codigo != cupon:
+            return False
+        return self.min_compra is None or subtotal >= self.min_compra
+
+
+@dataclass
+class LineaEvaluada:
+    item_id: int
+    variante_id: int
+    cantidad: int
+    precio_unitario: Decimal
+    subtotal: Decimal
+    descuento: Decimal = CERO
+    promocion_id: int = None
+
+
+@dataclass
+class ResultadoPromociones:
+    lineas: list
+    subtotal: Decimal
+    descuento_lineas: Decimal
+    descuento_global: Decimal
+    promocion_global_id: int = None
+    # promocion_id -> (nombre, monto total aportado)
+    aplicadas: dict = field(default_factory=dict)
+    # promociones aplicadas que tienen max_usos
+    con_limite: set = field(default_factory=set)
+
+    @property
+    def descuento_total(self):
+        return self.descuento_lineas + self.descuento_global
+
+    @property
+    def total(self):
+        return self.subtotal - self.descuento_total
+
+
+class IndicePromociones:
+    def __init__(self, version, por_variante, por_producto, globales):
+        self.version = version
+        self.por_variante = por_variante
+        self.por_producto = por_producto
+        self.globales = globales
+
+    def evaluar(self, lineas, cupon=None, ahora=None):
+        ahora = ahora or timezone.now()
+        evaluadas = [
+            LineaEvaluada(
+                item_id=l.item_id,
+                variante_id=l.variante_id,
+                cantidad=l.cantidad,
+                precio_unitario=l.precio_unitario,
+                subtotal=(l.precio_unitario * l.cantidad).quantize(CENTIMO),
+            )
+            for l in lineas
+        ]
+        subtotal = sum((l.subtotal for l in evaluadas), CERO)
+        por_variante = defaultdict(list)
+        por_producto = defaultdict(list)
+        for linea, evaluada in zip(lineas, evaluadas):
+            por_variante[linea.variante_id].append(evaluada)
+            por_producto[linea.producto_id].append(evaluada)
+
+        # Mejor beneficio por línea destino: item_id -> (monto, regla)
+        mejores = {}
+        for linea, evaluada in zip(lineas, evaluadas):
+            candidatas = self.por_variante.get(linea.variante_id, ()) + self.por_producto.get(linea.producto_id, ())
+            for regla in candidatas:
+                if not regla.aplica(ahora, cupon, subtotal):
+                    continue
+                for destino, monto in _beneficios(regla, evaluada, por_variante, por_producto):
+                    monto = min(monto, destino.subtotal).quantize(CENTIMO)
+                    if monto > mejores.get(destino.item_id, (CERO, None))[0]:
+                        mejores[destino.item_id] = (monto, regla)
+
+        aplicadas = {}
+        con_limite = set()
+        descuento_lineas = CERO
+        for evaluada in evaluadas:
+            if evaluada.item_id in mejores:
+                monto, regla = mejores[evaluada.item_id]
+                evaluada.descuento = monto
+                evaluada.promocion_id = regla.promocion_id
+                descuento_lineas += monto
+                nombre, acumulado = aplicadas.get(regla.promocion_id, (regla.nombre, CERO))
+                aplicadas[regla.promocion_id] = (nombre, acumulado + monto)
+                if regla.max_usos is not None:
+                    con_limite.add(regla.promocion_id)
+
+        base = subtotal - descuento_lineas
+        descuento_global, regla_global = CERO, None
+        for regla in self.globales:
+            if not regla.aplica(ahora, cupon, subtotal):
+                continue
+            if regla.tipo == 'porcentaje':
+                monto = base * regla.valor / 100
+            elif regla.tipo == 'monto_fijo':
+                monto = regla.valor
+            else:
+                continue
+            monto = min(monto, base).quantize(CENTIMO)
+            if monto > descuento_global:
+                descuento_global, regla_global = monto, regla
+        if regla_global is not None:
+            aplicadas[regla_global.promocion_id] = (regla_global.nombre, descuento_global)
+            if regla_global.max_usos is not None:
+                con_limite.add(regla_global.promocion_id)
+
+        return ResultadoPromociones(
+            lineas=evaluadas,
+            subtotal=subtotal,
+            descuento_lineas=descuento_lineas,
+            descuento_global=descuento_global,
+            promocion_global_id=regla_global.promocion_id if regla_global else None,
+            aplicadas=aplicadas,
+            con_limite=con_limite,
+        )
+
+
+def _beneficios(regla, linea, por_variante, por_producto):
+    """Pares (línea destino, monto) que la regla genera a partir de ``linea``."""
+    if regla.tipo == 'porcentaje':
+        yield linea, linea.subtotal * regla.valor / 100
+    elif regla.tipo == 'monto_fijo':
+        yield linea, regla.valor * linea.cantidad
+    elif regla.tipo == 'x_por_y' and regla.cantidad_requerida > 0:
+        grupos = linea.cantidad // regla.cantidad_requerida
+        gratis = grupos * regla.cantidad_gratis
+        if regla.variante_gratis_id is not None:
+            destinos = por_variante.get(regla.variante_gratis_id, [])
+        elif regla.producto_gratis_id is not None:
+            destinos = por_producto.get(regla.producto_gratis_id, [])
+        else:
+            yield linea, linea.precio_unitario * min(gratis, linea.cantidad)
+            return
+        for destino in destinos:
+            if gratis <= 0:
+                break
+            unidades = min(gratis, destino.cantidad)
+            gratis -= unidades
+            yield destino, destino.precio_unitario * unidades
+
+
+def compilar(ahora=None):
+    """Carga las promociones activas no vencidas y construye el índice."""
+    ahora = ahora or timezone.now()
+    version = version_actual(CLAVE_VERSION)
+    promociones = {
+        p['id']: p
+        for p in Promocion.objects.filter(activo=True)
+        .filter(Q(fecha_fin__isnull=True) | Q(fecha_fin__gte=ahora))
+        .values(
+            'id', 'nombre', 'codigo', 'tipo_descuento', 'valor_descuento',
+            'fecha_inicio', 'fecha_fin', 'min_compra', 'max_usos',
+        )
+    }
+    objetivos = PromocionProducto.objects.filter(promocion_id__in=list(promociones)).values_list(
+        'promocion_id', 'producto_id', 'variante_id', 'producto_gratis_id',
+        'variante_gratis_id', 'cantidad_requerida', 'cantidad_gratis',
+    )
+
+    por_variante = defaultdict(tuple)
+    por_producto = defaultdict(tuple)
+    con_objetivo = set()
+    for promocion_id, producto_id, variante_id, producto_gratis_id, variante_gratis_id, requerida, gratis in objetivos:
+        regla = _regla(
+            promociones[promocion_id],
+            cantidad_requerida=requerida,
+            cantidad_gratis=gratis,
+            producto_gratis_id=producto_gratis_id,
+            variante_gratis_id=variante_gratis_id,
+        )
+        if variante_id is not None:
+            por_variante[variante_id] += (regla,)
+        elif producto_id is not None:
+            por_producto[producto_id] += (regla,)
+        con_objetivo.add(promocion_id)
+
+    globales = tuple(_regla(p) for pk, p in promociones.items() if pk not in con_objetivo)
+    return IndicePromociones(version, dict(por_variante), dict(por_producto), globales)
+
+
+def _regla(promocion, **extra):
+    return Regla(
+        promocion_id=promocion['id'],
+        nombre=promocion['nombre'],
+        codigo=promocion['codigo'],
+        tipo=promocion['tipo_descuento'],
+        valor=promocion['valor_descuento'],
+        inicio=promocion['fecha_inicio'],
+        fin=promocion['fecha_fin'],
+        min_compra=promocion['min_compra'],
+        max_usos=promocion['max_usos'],
+        **extra,
+    )
+
+
+# -----------------------------
+# Índice por proceso
+# -----------------------------
+_lock = threading.Lock()
+_indice = None
+_verificado_en = 0.0
+
+
+def obtener_indice():
+    global _indice, _verificado_en
+    intervalo = getattr(settings, 'PROMOCIONES_VERIFICACION_SEGUNDOS', 5)
+    with _lock:
+        ahora = time.monotonic()
+        if _indice is not None and ahora - _verificado_en < intervalo:
+            return _indice
+        if _indice is None or version_actual(CLAVE_VERSION) != _indice.version:
+            _indice = compilar()
+        _verificado_en = ahora
+        return _indice
+
+
+def invalidar_local():
+    global _indice
+    with _lock:
+        _indice = None
+
+
+def evaluar_carrito(carrito, lineas=None):
+    """
+    Evalúa todas las promociones sobre el carrito. ``lineas`` permite pasar
+    LineaPromocion ya cargadas; si no, se leen los items en una consulta.
+    """
+    if lineas is None:
+        lineas = [
+            LineaPromocion(
+                item_id=item.pk,
+                variante_id=item.variante_id,
+                producto_id=item.variante.producto_id,
+                cantidad=item.cantidad,
+                precio_unitario=item.precio_unitario_snapshot,
+            )
+            for item in CarritoItem.objects.filter(carrito=carrito).select_related('variante')
+        ]
+    return obtener_indice().evaluar(lineas, cupon=carrito.cupon_codigo)
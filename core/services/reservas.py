@@ -0,0 +1,127 @@
+"""
+Retenciones temporales de stock (ReservaStock) para carritos y pedidos.
+
+Una retención aparta unidades de una variante hasta ``expira``. No toca la
+proyección (StockVariante) ni el ledger: el disponible real es
+``StockVariante.disponible`` menos la suma de retenciones vigentes, una
+consulta sobre el índice (variante, expira). Al vencer deja de contar sola;
+``liberar_vencidas`` (comando ``liberar_reservas``) solo borra las filas.
+
+Retener bloquea las filas de StockVariante de las variantes en orden de PK,
+igual que ``registrar_movimientos``, así que retenciones y checkouts
+simultáneos sobre la misma variante se serializan y no venden de más. Al
+confirmar el carrito (core.services.checkout) sus retenciones se reemplazan
+por el movimiento 'reserva' del pedido dentro de la misma transacción.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from core.models import CarritoItem, PedidoItem, ReservaStock, StockVariante
+from core.services.stock import StockInsuficiente, retenido_vigente
+
+
+def disponibles(variante_ids):
+    """{variante_id: disponible menos retenciones vigentes}; sin proyección vale 0."""
+    variante_ids = list(variante_ids)
+    retenido = (
+        ReservaStock.objects.filter(variante_id=OuterRef('pk'), expira__gt=timezone.now())
+        .order_by().values('variante_id').annotate(total=Sum('cantidad')).values('total')
+    )
+    netos = dict(
+        StockVariante.objects.filter(pk__in=variante_ids)
+        .annotate(neto=F('disponible') - Coalesce(Subquery(retenido), 0))
+        .values_list('pk', 'neto')
+    )
+    return {v: netos.get(v, 0) for v in variante_ids}
+
+
+def _retener(cantidades, titular, nuevas):
+    """
+    Verifica con las variantes bloqueadas que ``cantidades`` ({variante_id:
+    unidades}) entren en lo disponible sin contar las retenciones de
+    ``titular`` (Q), y las reemplaza por ``nuevas``.
+    """
+    variante_ids = sorted(cantidades)
+    StockVariante.objects.bulk_create([StockVariante(variante_id=v) for v in variante_ids], ignore_conflicts=True)
+    disponible = dict(
+        StockVariante.objects.select_for_update().filter(pk__in=variante_ids).order_by('pk')
+        .values_list('pk', 'disponible')
+    )
+    otros = retenido_vigente(variante_ids, excluir=titular)
+    faltantes = [v for v in variante_ids if disponible[v] - otros.get(v, 0) < cantidades[v]]
+    if faltantes:
+        raise StockInsuficiente(faltantes)
+    ReservaStock.objects.filter(titular).delete()
+    ReservaStock.objects.bulk_create(nuevas)
+
+
+def reservar_carrito(carrito_id, ttl=None):
+    """
+    Retiene (o renueva) el stock de todos los items del carrito por ``ttl``
+    (RESERVAS_TTL_CARRITO_MINUTOS). Todo o nada: lanza StockInsuficiente con
+    las variantes que no alcanzan. Devuelve el vencimiento.
+    """
+    expira = timezone.now() + (ttl or timedelta(minutes=getattr(settings, 'RESERVAS_TTL_CARRITO_MINUTOS', 15)))
+    with transaction.atomic():
+        items = list(CarritoItem.objects.filter(carrito_id=carrito_id, cantidad__gt=0).values_list('pk', 'variante_id', 'cantidad'))
+        cantidades = Counter()
+        for _, variante_id, cantidad in items:
+            cantidades[variante_id] += cantidad
+        titular = Q(carrito_item__carrito_id=carrito_id)
+        if not items:
+            ReservaStock.objects.filter(titular).delete()
+            return None
+        _retener(cantidades, titular, [
+            ReservaStock(variante_id=variante_id, cantidad=cantidad, expira=expira, carrito_item_id=item_id)
+            for item_id, variante_id, cantidad in items
+        ])
+    return expira
+
+
+def reservar_pedido(pedido, ttl=None):
+    """
+    Como ``reservar_carrito`` para los items de un pedido que aún no tiene la
+    reserva firme en el ledger (RESERVAS_TTL_PEDIDO_MINUTOS).
+    """
+    expira = timezone.now() + (ttl or timedelta(minutes=getattr(settings, 'RESERVAS_TTL_PEDIDO_MINUTOS', 30)))
+    with transaction.atomic():
+        cantidades = Counter()
+        for variante_id, cantidad in PedidoItem.objects.filter(pedido=pedido).values_list('variante_id', 'cantidad'):
+            cantidades[variante_id] += cantidad
+        titular = Q(pedido=pedido)
+        if not cantidades:
+            ReservaStock.objects.filter(titular).delete()
+            return None
+        _retener(cantidades, titular, [
+            ReservaStock(variante_id=variante_id, cantidad=cantidad, expira=expira, pedido=pedido)
+            for variante_id, cantidad in cantidades.items()
+        ])
+    return expira
+
+
+def liberar_carrito(carrito_id):
+    return ReservaStock.objects.filter(carrito_item__carrito_id=carrito_id).delete()[0]
+
+
+def liberar_pedido(pedido):
+    return ReservaStock.objects.filter(pedido=pedido).delete()[0]
+
+
+def liberar_vencidas(tamano_lote=5000):
+    """Borra en lotes las retenciones vencidas. Devuelve cuántas."""
+    total = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                ReservaStock.objects.filter(expira__lte=timezone.now())
+                .order_by('expira').values_list('pk', flat=True)[:tamano_lote]
+            )
+            if not ids:
+                return total
+            total += ReservaStock.objects.filter(pk__in=ids).delete()[0]
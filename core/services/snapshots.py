@@ -0,0 +1,135 @@
+"""
+Fichas de detalle de producto precalculadas (ProductoSnapshot).
+
+El documento es la ficha de core.services.catalogo (producto, marca,
+categoría, imágenes, atributos y variantes con los suyos) más las
+promociones activas que apuntan al producto o a sus variantes, serializado
+como JSON compacto y comprimido con zlib. Servir el detalle es leer una fila
+por clave primaria y descomprimir, sin joins.
+
+core.signals reconstruye al confirmar solo los productos afectados por el
+cambio; ``rebuild_product_snapshots`` los regenera todos (con --parallel en
+varios procesos). Las promociones se guardan con su ventana de vigencia y
+``obtener_snapshots`` descarta las vencidas al leer, así que no hace falta
+reconstruir cuando una promoción expira. Por lo mismo el documento no guarda
+stock: ``obtener_snapshots`` lo agrega al leer (``catalogo.agregar_stock``)
+y los movimientos de inventario no obligan a reconstruir.
+"""
+import hashlib
+import json
+import zlib
+from collections import defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.models import ProductoSnapshot, PromocionProducto
+from core.services.catalogo import agregar_stock, construir_fichas
+
+NIVEL_COMPRESION = 6
+
+
+def _promociones(producto_ids, ahora):
+    """{producto_id: [promoción]} de las promociones activas no vencidas."""
+    promociones = defaultdict(list)
+    for fila in (
+        PromocionProducto.objects.filter(Q(producto_id__in=producto_ids) | Q(variante__producto_id__in=producto_ids))
+        .filter(promocion__activo=True)
+        .filter(Q(promocion__fecha_fin__isnull=True) | Q(promocion__fecha_fin__gte=ahora))
+        .order_by('promocion_id', 'pk')
+        .values(
+            'promocion_id', 'producto_id', 'variante_id', 'variante__producto_id',
+            'promocion__nombre', 'promocion__tipo_descuento', 'promocion__valor_descuento',
+            'promocion__codigo', 'promocion__fecha_inicio', 'promocion__fecha_fin', 'promocion__min_compra',
+            'cantidad_requerida', 'cantidad_gratis', 'producto_gratis_id', 'variante_gratis_id',
+        )
+    ):
+        promociones[fila['producto_id'] or fila['variante__producto_id']].append({
+            'pk': fila['promocion_id'],
+            'nombre': fila['promocion__nombre'],
+            'tipo': fila['promocion__tipo_descuento'],
+            'valor': fila['promocion__valor_descuento'],
+            'requiere_cupon': bool(fila['promocion__codigo']),
+            'inicio': fila['promocion__fecha_inicio'],
+            'fin': fila['promocion__fecha_fin'],
+            'min_compra': fila['promocion__min_compra'],
+            'variante_id': fila['variante_id'],
+            'cantidad_requerida': fila['cantidad_requerida'],
+            'cantidad_gratis': fila['cantidad_gratis'],
+            'producto_gratis_id': fila['producto_gratis_id'],
+            'variante_gratis_id': fila['variante_gratis_id'],
+        })
+    return promociones
+
+
+def construir_documentos(producto_ids, ahora=None):
+    """{producto_id: documento} de los productos existentes."""
+    ahora = ahora or timezone.now()
+    fichas = construir_fichas(producto_ids)
+    promociones = _promociones(list(fichas), ahora)
+    for producto_id, ficha in fichas.items():
+        ficha['promociones'] = promociones.get(producto_id, [])
+    return fichas
+
+
+def serializar(documento):
+    texto = json.dumps(documento, cls=DjangoJSONEncoder, separators=(',', ':'), ensure_ascii=False)
+    return zlib.compress(texto.encode(), NIVEL_COMPRESION)
+
+
+def deserializar(datos):
+    return json.loads(zlib.decompress(bytes(datos)))
+
+
+def reconstruir(producto_ids):
+    """
+    Regenera los snapshots de esos productos y borra los de productos que ya
+    no existen. Solo escribe los que cambiaron. Devuelve filas escritas.
+    """
+    producto_ids = list(producto_ids)
+    if not producto_ids:
+        return 0
+    ahora = timezone.now()
+    documentos = {pk: serializar(documento) for pk, documento in construir_documentos(producto_ids, ahora).items()}
+    actuales = dict(
+        ProductoSnapshot.objects.filter(pk__in=producto_ids).values_list('pk', 'huella')
+    )
+    cambiados = []
+    for pk, datos in documentos.items():
+        huella = hashlib.sha1(datos).hexdigest()
+        if actuales.get(pk) != huella:
+            cambiados.append(ProductoSnapshot(producto_id=pk, documento=datos, huella=huella, fecha_actualizacion=ahora))
+    ProductoSnapshot.objects.bulk_create(
+        cambiados,
+        update_conflicts=True,
+        unique_fields=['producto'],
+        update_fields=['documento', 'huella', 'fecha_actualizacion'],
+        batch_size=500,
+    )
+    huerfanos = [pk for pk in actuales if pk not in documentos]
+    if huerfanos:
+        ProductoSnapshot.objects.filter(pk__in=huerfanos).delete()
+    return len(cambiados)
+
+
+def _vigente(promocion, ahora):
+    inicio = parse_datetime(promocion['inicio'])
+    fin = promocion['fin'] and parse_datetime(promocion['fin'])
+    return inicio <= ahora and (fin is None or fin >= ahora)
+
+
+def obtener_snapshots(producto_ids, ahora=None):
+    """{producto_id: documento} con el stock actual y solo las promociones vigentes en ``ahora``."""
+    ahora = ahora or timezone.now()
+    documentos = {}
+    for pk, datos in ProductoSnapshot.objects.filter(pk__in=list(producto_ids)).values_list('pk', 'documento'):
+        documento = deserializar(datos)
+        documento['promociones'] = [p for p in documento['promociones'] if _vigente(p, ahora)]
+        documentos[pk] = documento
+    return agregar_stock(documentos)
+
+
+def obtener_snapshot(producto_id, ahora=None):
+    return obtener_snapshots([producto_id], ahora).get(producto_id)
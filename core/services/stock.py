@@ -0,0 +1,244 @@
+"""
+Proyección de stock por variante (StockVariante).
+
+Todo movimiento de inventario debe registrarse con ``registrar_movimientos``:
+guarda las filas de MovimientoInventario en un solo INSERT, calcula
+``saldo_despues`` y actualiza la proyección dentro de la misma transacción,
+bloqueando únicamente las filas de las variantes afectadas.
+
+Cada llamada mantiene también el rollup diario por variante
+(MovimientoResumenDiario) bajo los mismos bloqueos: el historial de stock y
+los reportes por período leen el rollup en lugar de recorrer el ledger.
+
+``exigir_disponible`` descuenta además las retenciones temporales vigentes
+(ReservaStock, core.services.reservas): un checkout no puede tomar stock que
+otro carrito tiene retenido.
+
+Convención de signos de ``MovimientoInventario.cantidad``:
+  - entrada, salida, devolucion: cantidad positiva.
+  - ajuste: con signo (negativo resta stock físico).
+  - reserva: con signo (negativo libera una reserva previa).
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from core.models import MovimientoInventario, MovimientoResumenDiario, ReservaStock, StockVariante
+
+# Signo con el que cada tipo afecta al stock físico
+SIGNO_FISICO = {
+    'entrada': 1,
+    'devolucion': 1,
+    'ajuste': 1,
+    'salida': -1,
+}
+
+# Columna del rollup diario que acumula cada tipo
+CAMPO_RESUMEN = {
+    'entrada': 'entradas',
+    'salida': 'salidas',
+    'ajuste': 'ajustes',
+    'reserva': 'reservas',
+    'devolucion': 'devoluciones',
+}
+CAMPOS_RESUMEN = [*CAMPO_RESUMEN.values(), 'movimientos', 'saldo_cierre', 'costo_entradas', 'costo_salidas']
+
+
+class StockInsuficiente(Exception):
+    def __init__(self, variante_ids):
+        self.variante_ids = sorted(variante_ids)
+        super().__init__(f"Stock insuficiente para las variantes {self.variante_ids}")
+
+
+def delta_movimiento(tipo, cantidad):
+    """Devuelve (delta_fisico, delta_reservado) de un movimiento."""
+    if tipo == 'reserva':
+        return 0, cantidad
+    if tipo in SIGNO_FISICO:
+        return SIGNO_FISICO[tipo] * cantidad, 0
+    raise ValueError(f"Tipo de movimiento desconocido: {tipo}")
+
+
+def expresion_fisico(campo='cantidad'):
+    """Expresión SQL equivalente al delta físico de ``delta_movimiento``."""
+    return Case(
+        *[When(tipo=tipo, then=F(campo) * signo) for tipo, signo in SIGNO_FISICO.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def expresion_reservado(campo='cantidad'):
+    return Case(When(tipo='reserva', then=F(campo)), default=Value(0), output_field=IntegerField())
+
+
+def registrar_movimientos(movimientos, exigir_disponible=False):
+    """
+    Inserta los movimientos (instancias sin guardar) y aplica sus deltas a la
+    proyección. Con ``exigir_disponible`` lanza StockInsuficiente si alguna
+    variante queda con disponible negativo tras un movimiento que lo reduce.
+    """
+    movimientos = list(movimientos)
+    if not movimientos:
+        return []
+
+    variante_ids = sorted({m.variante_id for m in movimientos})
+    with transaction.atomic():
+        StockVariante.objects.bulk_create(
+            [StockVariante(variante_id=v) for v in variante_ids], ignore_conflicts=True
+        )
+        # Orden por PK para que dos transacciones concurrentes no se bloqueen mutuamente
+        proyecciones = {
+            s.pk: s
+            for s in StockVariante.objects.select_for_update().filter(pk__in=variante_ids).order_by('pk')
+        }
+
+        reducidas = set()
+        for mov in movimientos:
+            proyeccion = proyecciones[mov.variante_id]
+            delta_fisico, delta_reservado = delta_movimiento(mov.tipo, mov.cantidad)
+            proyeccion.fisico += delta_fisico
+            proyeccion.reservado += delta_reservado
+            mov.saldo_despues = proyeccion.fisico
+            if delta_fisico - delta_reservado < 0:
+                reducidas.add(mov.variante_id)
+
+        if exigir_disponible:
+            retenido = retenido_vigente(reducidas)
+            faltantes = [
+                v for v in reducidas
+                if proyecciones[v].fisico - proyecciones[v].reservado - retenido.get(v, 0) < 0
+            ]
+            if faltantes:
+                raise StockInsuficiente(faltantes)
+
+        ahora = timezone.now()
+        for proyeccion in proyecciones.values():
+            proyeccion.fecha_actualizacion = ahora
+
+        creados = MovimientoInventario.objects.bulk_create(movimientos)
+        StockVariante.objects.bulk_update(
+            proyecciones.values(), ['fisico', 'reservado', 'fecha_actualizacion']
+        )
+        # Con las variantes bloqueadas nadie más escribe sus filas del rollup
+        _aplicar_resumenes(acumular_resumenes({}, movimientos))
+    return creados
+
+
+def acumular_resumenes(resumenes, movimientos):
+    """Suma los movimientos en {(variante_id, fecha local): MovimientoResumenDiario}."""
+    for mov in movimientos:
+        clave = (mov.variante_id, timezone.localdate(mov.fecha))
+        resumen = resumenes.get(clave)
+        if resumen is None:
+            resumen = resumenes[clave] = MovimientoResumenDiario(variante_id=clave[0], fecha=clave[1])
+        campo = CAMPO_RESUMEN[mov.tipo]
+        setattr(resumen, campo, getattr(resumen, campo) + mov.cantidad)
+        resumen.movimientos += 1
+        if mov.saldo_despues is not None:
+            resumen.saldo_cierre = mov.saldo_despues
+        if mov.total_costo and mov.tipo == 'entrada':
+            resumen.costo_entradas += mov.total_costo
+        elif mov.total_costo and mov.tipo == 'salida':
+            resumen.costo_salidas += mov.total_costo
+    return resumenes
+
+
+def _aplicar_resumenes(resumenes):
+    existentes = MovimientoResumenDiario.objects.filter(
+        variante_id__in={v for v, _ in resumenes}, fecha__in={f for _, f in resumenes}
+    )
+    actualizados = []
+    for resumen in existentes:
+        delta = resumenes.pop((resumen.variante_id, resumen.fecha), None)
+        if delta is None:
+            continue
+        for campo in CAMPOS_RESUMEN:
+            if campo != 'saldo_cierre':
+                setattr(resumen, campo, getattr(resumen, campo) + getattr(delta, campo))
+        resumen.saldo_cierre = delta.saldo_cierre
+        actualizados.append(resumen)
+    MovimientoResumenDiario.objects.bulk_update(actualizados, CAMPOS_RESUMEN)
+    MovimientoResumenDiario.objects.bulk_create(resumenes.values())
+
+
+def retenido_vigente(variante_ids, excluir=None):
+    """{variante_id: unidades en ReservaStock sin vencer}; ``excluir`` filtra retenciones a ignorar."""
+    retenciones = ReservaStock.objects.filter(variante_id__in=list(variante_ids), expira__gt=timezone.now())
+    if excluir is not None:
+        retenciones = retenciones.exclude(excluir)
+    return dict(retenciones.order_by().values('variante_id').annotate(total=Sum('cantidad')).values_list('variante_id', 'total'))
+
+
+def reservas_abiertas(pedido_ids):
+    """{pedido_item_id: reserva neta en el ledger} de los items de esos pedidos que la tienen abierta."""
+    return dict(
+        MovimientoInventario.objects.filter(tipo='reserva', pedido_item__pedido_id__in=list(pedido_ids))
+        .order_by().values('pedido_item_id').annotate(neto=Sum('cantidad')).filter(neto__gt=0)
+        .values_list('pedido_item_id', 'neto')
+    )
+
+
+def stock_disponible(variante_ids):
+    """Disponible por variante; las variantes sin movimientos valen 0."""
+    disponibles = dict(
+        StockVariante.objects.filter(pk__in=variante_ids).values_list('pk', 'disponible')
+    )
+    return {v: disponibles.get(v, 0) for v in variante_ids}
+
+
+def totales_desde_ledger():
+    """Totales físico/reservado por variante calculados sobre el ledger completo."""
+    return (
+        MovimientoInventario.objects.order_by('variante_id')
+        .values('variante_id')
+        .annotate(
+            fisico=Coalesce(Sum(expresion_fisico()), 0),
+            reservado=Coalesce(Sum(expresion_reservado()), 0),
+        )
+    )
+
+
+# -----------------------------
+# Lecturas sobre el rollup diario
+# -----------------------------
+def historial_stock(variante_id, desde, hasta):
+    """Saldo físico al cierre de cada día de [desde, hasta]: [(fecha, saldo)]."""
+    saldo = (
+        MovimientoResumenDiario.objects.filter(variante_id=variante_id, fecha__lt=desde)
+        .order_by('-fecha').values_list('saldo_cierre', flat=True).first()
+    ) or 0
+    cierres = dict(
+        MovimientoResumenDiario.objects.filter(variante_id=variante_id, fecha__range=(desde, hasta))
+        .values_list('fecha', 'saldo_cierre')
+    )
+    serie = []
+    dia = desde
+    while dia <= hasta:
+        saldo = cierres.get(dia, saldo)
+        serie.append((dia, saldo))
+        dia += timedelta(days=1)
+    return serie
+
+
+def resumen_periodo(desde, hasta, variante_ids=None):
+    """
+    Por variante: ``total_<campo>`` por tipo y costos de [desde, hasta] y
+    ``saldo_final`` al cierre de ``hasta`` (último día con movimientos).
+    """
+    filas = MovimientoResumenDiario.objects.filter(fecha__range=(desde, hasta))
+    if variante_ids is not None:
+        filas = filas.filter(variante_id__in=variante_ids)
+    saldo_cierre = (
+        MovimientoResumenDiario.objects.filter(variante_id=OuterRef('variante_id'), fecha__lte=hasta)
+        .order_by('-fecha').values('saldo_cierre')[:1]
+    )
+    # Los alias no pueden repetir nombres de campos del modelo
+    sumas = {f'total_{campo}': Sum(campo) for campo in CAMPOS_RESUMEN if campo != 'saldo_cierre'}
+    return (
+        filas.order_by('variante_id').values('variante_id')
+        .annotate(**sumas, saldo_final=Subquery(saldo_cierre))
+    )
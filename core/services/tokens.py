@@ -0,0 +1,179 @@
+"""
+Emisión, validación, rotación y purga de RefreshToken y EmailVerificationToken.
+
+En la base solo se guarda el SHA-256 (hex, 64 caracteres) del token: quien
+lea la tabla no puede usar lo que ve, y validar es una búsqueda exacta sobre
+el índice único de ``token_hash``. El token en claro solo lo conoce el
+cliente; estas funciones lo devuelven al emitirlo y nunca más. Las filas
+que una versión anterior de la aplicación siga escribiendo con el token en
+claro (``token_hash`` nulo) se validan comparando ``token``; ``family`` les
+llega por el default de la base.
+
+Rotación: cada refresh revoca el token presentado (``rotated_at``) y emite
+otro de la misma ``family``. Si llega un token ya rotado, alguien más lo
+tiene: se revoca la familia entera (TokenReutilizado) con un solo UPDATE.
+
+Los tokens vencidos se borran con ``purge_tokens`` en lotes cortos, cada uno
+en su transacción, para no sostener bloqueos largos. Los de verificación
+usados o anulados vencen a lo sumo en EMAIL_VERIFICACION_HORAS.
+"""
+import hashlib
+import secrets
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import EmailVerificationToken, RefreshToken
+from core.services.accesos import registrar_acceso
+from core.services.auditoria import registrar_accion
+
+BYTES_TOKEN = 32
+
+
+class TokenInvalido(Exception):
+    pass
+
+
+class TokenReutilizado(TokenInvalido):
+    """Se presentó un refresh token ya rotado: la familia quedó revocada."""
+
+
+def hashear(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _por_token(token):
+    return Q(token_hash=hashear(token)) | Q(token_hash__isnull=True, token=token)
+
+
+def _nuevo_token():
+    return secrets.token_urlsafe(BYTES_TOKEN)
+
+
+# -----------------------------
+# Refresh tokens
+# -----------------------------
+def emitir_refresh(usuario, family=None, duracion=None):
+    """Crea un refresh token; devuelve (token en claro, RefreshToken)."""
+    token = _nuevo_token()
+    duracion = duracion or timedelta(days=getattr(settings, 'REFRESH_TOKEN_DIAS', 7))
+    registro = RefreshToken(user=usuario, token_hash=hashear(token), expires=timezone.now() + duracion)
+    if family is not None:
+        registro.family = family
+    registro.save(force_insert=True)
+    return token, registro
+
+
+def validar_refresh(token):
+    """El RefreshToken vigente (con su usuario) o None. Cuenta como acceso del usuario."""
+    registro = (
+        RefreshToken.objects.select_related('user')
+        .filter(_por_token(token), revoked=False, expires__gt=timezone.now())
+        .first()
+    )
+    if registro is not None:
+        registrar_acceso(registro.user_id)
+    return registro
+
+
+def rotar_refresh(token, duracion=None):
+    """
+    Revoca ``token`` y emite su reemplazo en la misma familia. Devuelve
+    (token nuevo en claro, RefreshToken). Lanza TokenReutilizado si ya había
+    sido rotado y TokenInvalido si no existe, venció o fue revocado.
+    """
+    buscado = _por_token(token)
+    ahora = timezone.now()
+    with transaction.atomic():
+        # UPDATE condicional: de dos refresh simultáneos con el mismo token gana uno
+        rotados = RefreshToken.objects.filter(
+            buscado, revoked=False, expires__gt=ahora,
+        ).update(revoked=True, rotated_at=ahora)
+        registro = RefreshToken.objects.select_related('user').filter(buscado).first()
+        if rotados:
+            registrar_acceso(registro.user_id)
+            return emitir_refresh(registro.user, family=registro.family, duracion=duracion)
+    if registro is not None and registro.rotated_at is not None:
+        revocados = revocar_familia(registro.family)
+        registrar_accion('tokens.reutilizado', registro.user_id, {'family': registro.family, 'revocados': revocados})
+        raise TokenReutilizado(f"Refresh token reutilizado; familia {registro.family} revocada")
+    raise TokenInvalido("Refresh token inexistente, vencido o revocado")
+
+
+def revocar_refresh(token):
+    return RefreshToken.objects.filter(_por_token(token), revoked=False).update(revoked=True)
+
+
+def revocar_familia(family):
+    """Revoca todos los tokens vigentes de la familia. Devuelve cuántos."""
+    return RefreshToken.objects.filter(family=family, revoked=False).update(revoked=True)
+
+
+def revocar_usuario(usuario):
+    """Cierra todas las sesiones del usuario. Devuelve cuántos tokens revocó."""
+    revocados = RefreshToken.objects.filter(user=usuario, revoked=False).update(revoked=True)
+    registrar_accion('tokens.revocar_usuario', usuario, {'revocados': revocados})
+    return revocados
+
+
+# -----------------------------
+# Verificación de email
+# -----------------------------
+def emitir_verificacion(usuario, duracion=None):
+    """
+    Anula los tokens pendientes del usuario y emite uno nuevo. Devuelve
+    (token en claro, EmailVerificationToken).
+    """
+    token = _nuevo_token()
+    ahora = timezone.now()
+    duracion = duracion or timedelta(hours=getattr(settings, 'EMAIL_VERIFICACION_HORAS', 24))
+    with transaction.atomic():
+        EmailVerificationToken.objects.filter(user=usuario, used=False).update(expires=ahora)
+        registro = EmailVerificationToken.objects.create(
+            user=usuario, token_hash=hashear(token), expires=ahora + duracion,
+        )
+    return token, registro
+
+
+def consumir_verificacion(token):
+    """Marca el token como usado y devuelve su usuario; lanza TokenInvalido si no sirve."""
+    buscado = _por_token(token)
+    ahora = timezone.now()
+    usados = EmailVerificationToken.objects.filter(
+        buscado, used=False, expires__gt=ahora,
+    ).update(used=True, used_at=ahora)
+    if not usados:
+        raise TokenInvalido("Token de verificación inexistente, vencido o ya usado")
+    return EmailVerificationToken.objects.select_related('user').get(buscado).user
+
+
+# -----------------------------
+# Purga
+# -----------------------------
+PURGABLES = {
+    'refresh': RefreshToken,
+    'email': EmailVerificationToken,
+}
+
+
+def purgar(tipo, tamano_lote=5000, antes=None, pausa=0):
+    """
+    Borra en lotes de ``tamano_lote`` los tokens vencidos antes de ``antes``
+    (por defecto ahora), cada lote en su propia transacción y recorriendo el
+    índice de ``expires``. Genera la cantidad borrada por lote.
+    """
+    modelo = PURGABLES[tipo]
+    vencidos = modelo.objects.filter(expires__lt=antes or timezone.now())
+    while True:
+        with transaction.atomic():
+            ids = list(vencidos.order_by('expires').values_list('pk', flat=True)[:tamano_lote])
+            if not ids:
+                return
+            borrados, _ = modelo.objects.filter(pk__in=ids).delete()
+        yield borrados
+        if pausa:
+            time.sleep(pausa)
@@ -0,0 +1,134 @@
+"""
+Cola de trabajos en base de datos para ImportJob y ExportJob.
+
+``manage.py run_jobs`` toma trabajos con ``SELECT ... FOR UPDATE SKIP LOCKED``
+(varios workers no se pisan) y los ejecuta en un pool de procesos. Mientras
+un trabajo corre, su proceso actualiza ``latido`` cada
+TRABAJOS_LATIDO_SEGUNDOS; si un worker muere, el trabajo queda 'procesando'
+con un latido viejo y otro worker lo retoma pasado TRABAJOS_TIMEOUT_SEGUNDOS.
+Los fallos se reintentan con espera exponencial hasta TRABAJOS_MAX_INTENTOS,
+pero solo en colas cuyo ejecutor se declara ``reintentable``: volver a
+correrlo tras un fallo a medias no duplica datos. La importación reanuda
+desde ``filas_procesadas`` (se confirma junto con cada lote) y la
+exportación genera un archivo nuevo. En una cola no reintentable, un fallo o
+un latido vencido dejan el trabajo en 'error'.
+"""
+import threading
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from core.models import ExportJob, ImportJob
+from core.services import auditoria
+from core.services.exportacion import ejecutar_exportacion
+from core.services.importacion import ejecutar_importacion
+
+Cola = namedtuple('Cola', 'modelo ejecutor reintentable')
+
+COLAS = {
+    'importacion': Cola(ImportJob, ejecutar_importacion, reintentable=True),
+    'exportacion': Cola(ExportJob, ejecutar_exportacion, reintentable=True),
+}
+
+
+def _config(nombre, defecto):
+    return getattr(settings, f'TRABAJOS_{nombre}', defecto)
+
+
+def reclamar(cola, trabajador, limite):
+    """
+    Marca hasta ``limite`` trabajos como tomados por ``trabajador`` y devuelve
+    sus ids: pendientes cuyo turno llegó y 'procesando' sin latido reciente.
+    Los que ya agotaron sus intentos (o, si la cola no es reintentable, los
+    abandonados por un worker caído) pasan a 'error'.
+    """
+    if limite <= 0:
+        return []
+    modelo, _, reintentable = COLAS[cola]
+    ahora = timezone.now()
+    vencido = ahora - timedelta(seconds=_config('TIMEOUT_SEGUNDOS', 300))
+    # Sin reintentos, el único intento es el primero
+    max_intentos = _config('MAX_INTENTOS', 3) if reintentable else 1
+    with transaction.atomic():
+        candidatos = list(
+            modelo.objects.select_for_update(skip_locked=True)
+            .filter(Q(status='pendiente', disponible_desde__lte=ahora) | Q(status='procesando', latido__lt=vencido))
+            .order_by('disponible_desde', 'pk')
+            .values_list('pk', 'intentos')[:limite]
+        )
+        agotados = [pk for pk, intentos in candidatos if intentos >= max_intentos]
+        tomados = [pk for pk, intentos in candidatos if intentos < max_intentos]
+        if agotados:
+            modelo.objects.filter(pk__in=agotados).update(
+                status='error', latido=None,
+                ultimo_error=Coalesce('ultimo_error', Value("Sin latido: intentos agotados")),
+            )
+        if tomados:
+            modelo.objects.filter(pk__in=tomados).update(
+                status='procesando', intentos=F('intentos') + 1, trabajador=trabajador, latido=ahora,
+            )
+    return tomados
+
+
+def registrar_fallo(cola, pk, trabajador, error):
+    """
+    Vuelve a encolar el trabajo con espera exponencial, o lo deja en 'error'
+    si agotó sus intentos o su cola no es reintentable.
+    """
+    modelo, _, reintentable = COLAS[cola]
+    intentos = modelo.objects.filter(pk=pk).values_list('intentos', flat=True).first()
+    if intentos is None:
+        return None
+    cambios = {'latido': None, 'ultimo_error': str(error)[:4000]}
+    if reintentable and intentos < _config('MAX_INTENTOS', 3):
+        espera = _config('ESPERA_BASE_SEGUNDOS', 30) * 2 ** max(intentos - 1, 0)
+        cambios.update(status='pendiente', disponible_desde=timezone.now() + timedelta(seconds=espera))
+    else:
+        cambios['status'] = 'error'
+    # Solo si sigue siendo nuestro: con el latido vencido otro worker pudo retomarlo
+    modelo.objects.filter(pk=pk, trabajador=trabajador).update(**cambios)
+    return cambios['status']
+
+
+class Latido(threading.Thread):
+    """Hilo que mantiene fresco el latido del trabajo mientras se ejecuta."""
+
+    def __init__(self, modelo, pk, trabajador, intervalo):
+        super().__init__(daemon=True)
+        self.modelo, self.pk, self.trabajador, self.intervalo = modelo, pk, trabajador, intervalo
+        self._detener = threading.Event()
+
+    def run(self):
+        try:
+            while not self._detener.wait(self.intervalo):
+                self.modelo.objects.filter(pk=self.pk, trabajador=self.trabajador).update(latido=timezone.now())
+        finally:
+            connection.close()
+
+    def detener(self):
+        self._detener.set()
+        self.join()
+
+
+def ejecutar(cola, pk, trabajador):
+    """Corre un trabajo ya reclamado (en el proceso hijo). Devuelve el estado final."""
+    modelo, ejecutor, _ = COLAS[cola]
+    latido = Latido(modelo, pk, trabajador, _config('LATIDO_SEGUNDOS', 30))
+    latido.start()
+    try:
+        job = modelo.objects.get(pk=pk)
+        ejecutor(job)
+    except (Exception, KeyboardInterrupt) as exc:
+        # Ctrl+C llega a todo el grupo de procesos: el trabajo se reencola
+        return registrar_fallo(cola, pk, trabajador, f"{type(exc).__name__}: {exc}")
+    finally:
+        latido.detener()
+        # Los procesos del pool terminan sin pasar por atexit: la auditoría se escribe acá
+        auditoria.vaciar()
+    modelo.objects.filter(pk=pk, trabajador=trabajador).update(latido=None, ultimo_error=None)
+    return job.status
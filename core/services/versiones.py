@@ -0,0 +1,14 @@
+"""Contadores de versión compartidos entre procesos (tabla ContadorVersion)."""
+from django.db.models import F
+
+from core.models import ContadorVersion
+
+
+def version_actual(clave):
+    version = ContadorVersion.objects.filter(clave=clave).values_list('version', flat=True).first()
+    return version or 0
+
+
+def incrementar_version(clave):
+    ContadorVersion.objects.bulk_create([ContadorVersion(clave=clave)], ignore_conflicts=True)
+    ContadorVersion.objects.filter(clave=clave).update(version=F('version') + 1)
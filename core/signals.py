@@ -0,0 +1,182 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core.models import (
+    Categoria, Imagen, Marca, Producto, ProductoAtributo, ProductoVariante, Promocion, PromocionProducto,
+    PromocionUsoContador, TarifaEnvio, VarianteAtributo,
+)
+from core.services import busqueda, catalogo, categorias, envios, facetas, promociones, snapshots
+from core.services.cupones import configurar_contador
+from core.services.versiones import incrementar_version
+
+
+@receiver([post_save, post_delete], sender=Promocion)
+@receiver([post_save, post_delete], sender=PromocionProducto)
+def invalidar_promociones(sender, **kwargs):
+    transaction.on_commit(_publicar_cambio_promociones)
+
+
+def _publicar_cambio_promociones():
+    incrementar_version(promociones.CLAVE_VERSION)
+    promociones.invalidar_local()
+
+
+@receiver(post_save, sender=Promocion)
+def sincronizar_cupo_promocion(sender, instance, raw=False, **kwargs):
+    # Redistribuye el cupo entre los shards cuando cambia max_usos
+    if raw:
+        return
+    if instance.max_usos is not None or PromocionUsoContador.objects.filter(promocion=instance).exists():
+        configurar_contador(instance)
+
+
+@receiver(pre_save, sender=Categoria)
+def validar_movimiento_categoria(sender, instance, raw=False, **kwargs):
+    if not raw:
+        categorias.validar_padre(instance)
+
+
+@receiver(post_save, sender=Categoria)
+def sincronizar_ruta_categoria(sender, instance, raw=False, **kwargs):
+    if not raw:
+        categorias.sincronizar_ruta(instance)
+
+
+@receiver(post_delete, sender=Categoria)
+def desprender_subcategorias(sender, instance, **kwargs):
+    categorias.desprender_subarbol(instance)
+
+
+@receiver([post_save, post_delete], sender=ProductoAtributo)
+def reindexar_facetas_producto(sender, instance, **kwargs):
+    producto_id = instance.producto_id
+    transaction.on_commit(lambda: facetas.indexar_productos([producto_id]))
+
+
+@receiver([post_save, post_delete], sender=VarianteAtributo)
+def reindexar_facetas_variante(sender, instance, **kwargs):
+    variante_id = instance.variante_id
+    transaction.on_commit(lambda: facetas.indexar_variantes([variante_id]))
+
+
+@receiver(post_save, sender=ProductoVariante)
+def indexar_facetas_variante(sender, instance, raw=False, **kwargs):
+    # Cubre altas y cambios de activo; el borrado lo resuelve el CASCADE
+    if not raw:
+        variante_id = instance.pk
+        transaction.on_commit(lambda: facetas.indexar_variantes([variante_id]))
+
+
+@receiver(post_save, sender=Producto)
+def indexar_facetas_producto(sender, instance, created=False, raw=False, **kwargs):
+    if not raw and not created:
+        producto_id = instance.pk
+        transaction.on_commit(lambda: facetas.indexar_productos([producto_id]))
+
+
+@receiver(post_save, sender=Producto)
+def indexar_busqueda_producto(sender, instance, raw=False, **kwargs):
+    if not raw:
+        producto_id = instance.pk
+        transaction.on_commit(lambda: busqueda.actualizar_documentos([producto_id]))
+
+
+@receiver([post_save, post_delete], sender=ProductoVariante)
+def indexar_busqueda_skus(sender, instance, raw=False, **kwargs):
+    if not raw:
+        producto_id = instance.producto_id
+        transaction.on_commit(lambda: busqueda.actualizar_documentos([producto_id]))
+
+
+@receiver(post_save, sender=Marca)
+def indexar_busqueda_marca(sender, instance, created=False, raw=False, **kwargs):
+    if not raw and not created:
+        ids = list(Producto.objects.filter(marca=instance).values_list('pk', flat=True))
+        transaction.on_commit(lambda: busqueda.actualizar_documentos(ids))
+
+
+@receiver(post_save, sender=Categoria)
+def indexar_busqueda_categoria(sender, instance, created=False, raw=False, **kwargs):
+    if not raw and not created:
+        ids = list(Producto.objects.filter(categoria=instance).values_list('pk', flat=True))
+        transaction.on_commit(lambda: busqueda.actualizar_documentos(ids))
+
+
+@receiver(pre_save, sender=TarifaEnvio)
+def marcar_tarifa_actualizada(sender, instance, raw=False, **kwargs):
+    # Mueve la firma con la que core.services.envios revalida sus índices
+    if not raw:
+        instance.fecha_actualizacion = timezone.now()
+
+
+@receiver([post_save, post_delete], sender=TarifaEnvio)
+def invalidar_tarifas(sender, instance, **kwargs):
+    ciudad_id = instance.ciudad_id
+    transaction.on_commit(lambda: envios.invalidar_local(ciudad_id))
+
+
+def _invalidar_fichas(producto_ids):
+    producto_ids = [pk for pk in producto_ids if pk is not None]
+    if producto_ids:
+        transaction.on_commit(lambda: catalogo.incrementar_versiones(producto_ids))
+        transaction.on_commit(lambda: snapshots.reconstruir(producto_ids))
+
+
+@receiver([post_save, post_delete], sender=Producto)
+def invalidar_ficha_producto(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _invalidar_fichas([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=ProductoVariante)
+@receiver([post_save, post_delete], sender=ProductoAtributo)
+def invalidar_ficha_por_producto(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _invalidar_fichas([instance.producto_id])
+
+
+@receiver([post_save, post_delete], sender=Imagen)
+@receiver([post_save, post_delete], sender=VarianteAtributo)
+def invalidar_ficha_por_variante(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    producto_id = getattr(instance, 'producto_id', None)
+    if producto_id is None and instance.variante_id is not None:
+        # Si la variante se está borrando en cascada, su propio post_delete ya invalida
+        producto_id = ProductoVariante.objects.filter(pk=instance.variante_id).values_list('producto_id', flat=True).first()
+    _invalidar_fichas([producto_id])
+
+
+@receiver(post_save, sender=Marca)
+@receiver(post_save, sender=Categoria)
+def invalidar_fichas_clasificacion(sender, instance, created=False, raw=False, **kwargs):
+    if not raw and not created:
+        campo = 'marca' if sender is Marca else 'categoria'
+        _invalidar_fichas(Producto.objects.filter(**{campo: instance}).values_list('pk', flat=True))
+
+
+@receiver([post_save, post_delete], sender=PromocionProducto)
+def reconstruir_snapshots_objetivo(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    producto_id = instance.producto_id
+    if producto_id is None and instance.variante_id is not None:
+        producto_id = ProductoVariante.objects.filter(pk=instance.variante_id).values_list('producto_id', flat=True).first()
+    if producto_id is not None:
+        transaction.on_commit(lambda: snapshots.reconstruir([producto_id]))
+
+
+@receiver(post_save, sender=Promocion)
+def reconstruir_snapshots_promocion(sender, instance, created=False, raw=False, **kwargs):
+    # El borrado lo cubre el post_delete de cada PromocionProducto en cascada
+    if raw or created:
+        return
+    ids = {
+        producto_id or variante_producto_id
+        for producto_id, variante_producto_id in PromocionProducto.objects.filter(promocion=instance)
+        .values_list('producto_id', 'variante__producto_id')
+    } - {None}
+    if ids:
+        transaction.on_commit(lambda: snapshots.reconstruir(ids))
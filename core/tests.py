@@ -1,3 +1,1213 @@
-from django.test import TestCase
+import atexit
+import gzip
+import io
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from decimal import Decimal
+from importlib import import_module
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core.models import (
+    Atributo, Carrito, CarritoItem, Categoria, Ciudad, CostoVariante, EmpresaEnvio, ExportJob, ImportJob, Lote, Marca,
+    LogAccion, MovimientoInventario, Pedido, PedidoItem, Producto, ProductoAtributo, ProductoSnapshot, ProductoVariante,
+    Promocion, PromocionAplicada, PromocionProducto, PromocionUsoContador, PuntoControl, Region, ReservaStock, Rol,
+    StockVariante, TarifaEnvio, Usuario, VarianteAtributo, VentaCubo,
+)
+from core.services import (
+    accesos, analitica, auditoria, busqueda, catalogo, categorias, costeo, envios, particiones, promociones, reservas,
+    snapshots,
+)
+from core.services.buffer import BufferEscritura
+from core.services.carrito import desactivar_inactivos, fusionar_carrito_anonimo, purgar_inactivos, resumen_carrito
+from core.services.checkout import confirmar_carrito
+from core.services.costeo import costear
+from core.services.cupones import CuponAgotado, configurar_contador, consumir_uso, usos_totales
+from core.services.exportacion import ejecutar_exportacion
+from core.services.facetas import conteo_facetas, indexar_productos, variantes_filtradas
+from core.services.importacion import ImportadorLotes, OrigenNoPermitido, ejecutar_importacion
+from core.services.lotes import asignar_lotes, despachar, devolver_lotes
+from core.services.pedidos import transicionar
+from core.services.reservas import reservar_carrito, reservar_pedido
+from core.services.stock import StockInsuficiente, historial_stock, registrar_movimientos, resumen_periodo
+from core.services.tokens import rotar_refresh, validar_refresh
+from core.services.trabajos import COLAS, Cola, reclamar, registrar_fallo
+
+
+def crear_catalogo(variantes=1):
+    """Usuario, producto y ``variantes`` variantes de precio 10.00."""
+    rol = Rol.objects.create(nombre='cliente')
+    usuario = Usuario.objects.create(email='cliente@example.com', rol=rol, nombre='Ana', apellido='Pérez')
+    categoria = Categoria.objects.create(nombre='Categoría', slug='categoria')
+    marca = Marca.objects.create(nombre='Marca')
+    producto = Producto.objects.create(
+        sku_base='P1', categoria=categoria, marca=marca, nombre='Producto', precio_base=10, peso_kg=Decimal('1.5'),
+    )
+    lista = [
+        ProductoVariante.objects.create(sku=f'V{i}', producto=producto, precio=Decimal('10.00'))
+        for i in range(variantes)
+    ]
+    return usuario, producto, lista
+
+
+def crear_carrito(usuario, cantidades):
+    """Carrito activo con {variante: cantidad}."""
+    carrito = Carrito.objects.create(usuario=usuario)
+    CarritoItem.objects.bulk_create([
+        CarritoItem(carrito=carrito, variante=variante, cantidad=cantidad, precio_unitario_snapshot=variante.precio)
+        for variante, cantidad in cantidades.items()
+    ])
+    return carrito
+
+
+def concurrencia_real():
+    """
+    Los tests con hilos necesitan conexiones que se bloqueen de verdad entre sí:
+    en SQLite, una base en archivo con transaction_mode IMMEDIATE.
+    """
+    if connection.vendor != 'sqlite':
+        return True
+    ajustes = connection.settings_dict
+    return ajustes['TEST'].get('NAME') is not None and ajustes['OPTIONS'].get('transaction_mode') == 'IMMEDIATE'
+
+
+def en_paralelo(funcion, hilos):
+    """Ejecuta ``funcion()`` en ``hilos`` hilos a la vez; devuelve resultados o excepciones."""
+    barrera = threading.Barrier(hilos)
+    resultados = [None] * hilos
+
+    def correr(i):
+        try:
+            barrera.wait()
+            resultados[i] = funcion()
+        except Exception as exc:
+            resultados[i] = exc
+        finally:
+            connections.close_all()
+
+    lista = [threading.Thread(target=correr, args=(i,)) for i in range(hilos)]
+    for hilo in lista:
+        hilo.start()
+    for hilo in lista:
+        hilo.join()
+    return resultados
+
+
+def stock(variante):
+    proyeccion = StockVariante.objects.get(pk=variante.pk)
+    return proyeccion.fisico, proyeccion.reservado
+
+
+class BuffersSincronos:
+    """
+    Los buffers de ultimo_acceso y auditoría escriben en el hilo del test y se
+    vacían (dentro de la transacción del test) al terminar: no le queda nada
+    al atexit.
+    """
+
+    def setUp(self):
+        super().setUp()
+        for modulo in (accesos, auditoria):
+            asincrono, modulo._buffer.asincrono = modulo._buffer.asincrono, False
+            self.addCleanup(setattr, modulo._buffer, 'asincrono', asincrono)
+            self.addCleanup(modulo.vaciar)
+        self.addCleanup(accesos._registrados.clear)
+
+
+class IndexAdvisorTests(TestCase):
+    def advisor(self, *argumentos):
+        salida, errores = io.StringIO(), io.StringIO()
+        call_command('index_advisor', *argumentos, stdout=salida, stderr=errores)
+        return salida.getvalue(), errores.getvalue()
+
+    @skipUnless(connection.vendor != 'postgresql', "fuera de PostgreSQL")
+    def test_fuera_de_postgresql_avisa_y_no_analiza(self):
+        with self.assertRaisesMessage(CommandError, 'solo está disponible sobre PostgreSQL'):
+            self.advisor()
+
+    @skipUnless(connection.vendor == 'postgresql', "EXPLAIN y pg_stat_* son de PostgreSQL")
+    def test_sugiere_indice_para_seq_scan_filtrado(self):
+        LogAccion.objects.bulk_create(LogAccion(accion=f'accion-{i}') for i in range(50))
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE core_logaccion')
+        salida, _ = self.advisor('--sql', "SELECT * FROM core_logaccion WHERE accion = 'x'", '--min-filas', '0')
+        self.assertIn('CREATE INDEX CONCURRENTLY core_logaccion_accion_idx ON core_logaccion (accion);', salida)
+        # usuario_id ya tiene el índice de la FK
+        salida, _ = self.advisor('--sql', 'SELECT * FROM core_logaccion WHERE usuario_id = 1', '--min-filas', '0')
+        self.assertIn('No se encontraron índices faltantes.', salida)
+        # Sin --sql lee pg_stat_statements, o avisa si no está instalado
+        self.advisor('--min-filas', '0')
+
+
+class LotesTests(TestCase):
+    def setUp(self):
+        self.usuario, self.producto, (self.variante,) = crear_catalogo()
+        self.lotes = [
+            Lote.objects.create(
+                producto=self.producto, variante=self.variante, cantidad_inicial=cantidad,
+                cantidad_disponible=cantidad, costo_total=cantidad * costo, costo_unitario=costo,
+            )
+            for cantidad, costo in ((4, 2), (10, 3))
+        ]
+        registrar_movimientos([MovimientoInventario(variante=self.variante, tipo='entrada', cantidad=14)])
+
+    def pedido(self, cantidad=6):
+        carrito = crear_carrito(self.usuario, {self.variante: cantidad})
+        return confirmar_carrito(carrito.pk, self.usuario, 'yape')
+
+    def disponibles_lotes(self):
+        return list(Lote.objects.order_by('pk').values_list('cantidad_disponible', flat=True))
+
+    def test_reserva_por_lote_reemplaza_la_del_checkout(self):
+        pedido = self.pedido()
+        asignar_lotes(pedido)
+        self.assertEqual(stock(self.variante), (14, 6))
+        self.assertEqual(self.disponibles_lotes(), [0, 8])
+        self.assertEqual(PedidoItem.objects.filter(pedido=pedido).count(), 2)
+
+    def test_asignar_y_devolver_avanzan_el_watermark_del_pedido(self):
+        pedido = self.pedido()
+        antes = '2000-01-01T00:00Z'
+        Pedido.objects.filter(pk=pedido.pk).update(fecha_actualizacion=antes)
+        asignar_lotes(pedido)
+        self.assertGreater(Pedido.objects.get(pk=pedido.pk).fecha_actualizacion.year, 2000)
+        Pedido.objects.filter(pk=pedido.pk).update(fecha_actualizacion=antes)
+        devolver_lotes([pedido.pk])
+        self.assertGreater(Pedido.objects.get(pk=pedido.pk).fecha_actualizacion.year, 2000)
+
+    def test_solo_lee_y_escribe_los_lotes_que_usa(self):
+        pedido = self.pedido(3)
+        with CaptureQueriesContext(connection) as capturadas:
+            asignar_lotes(pedido)
+        lotes_sql = [q['sql'] for q in capturadas.captured_queries if '"core_lote"' in q['sql']]
+        self.assertEqual(len([sql for sql in lotes_sql if sql.startswith('SELECT')]), 1)
+        (actualizacion,) = [sql for sql in lotes_sql if sql.startswith('UPDATE')]
+        self.assertEqual(actualizacion.count('WHEN'), 1)
+        self.assertEqual(self.disponibles_lotes(), [1, 10])
+
+    def test_despachar_convierte_la_reserva_en_salida_una_sola_vez(self):
+        pedido = self.pedido()
+        asignar_lotes(pedido)
+        despachar([pedido.pk])
+        despachar([pedido.pk])
+        self.assertEqual(stock(self.variante), (8, 0))
+        self.assertEqual(self.disponibles_lotes(), [0, 8])
+
+    def test_salida_directa_libera_la_reserva(self):
+        pedido = self.pedido()
+        asignar_lotes(pedido, 'salida')
+        self.assertEqual(stock(self.variante), (8, 0))
+
+    def test_parcial_y_devolucion_de_lotes(self):
+        registrar_movimientos([MovimientoInventario(variante=self.variante, tipo='entrada', cantidad=10)])
+        pedido = self.pedido(16)
+        with self.assertRaises(StockInsuficiente):
+            asignar_lotes(pedido)
+        asignar_lotes(pedido, parcial=True)
+        self.assertEqual(stock(self.variante), (24, 16))
+        self.assertEqual(self.disponibles_lotes(), [0, 0])
+        self.assertEqual(devolver_lotes([pedido.pk]), 14)
+        self.assertEqual(self.disponibles_lotes(), [4, 10])
+        self.assertFalse(PedidoItem.objects.filter(pedido=pedido, lote_origen__isnull=False).exists())
+
+
+class StockTests(TestCase):
+    def setUp(self):
+        _, _, (self.variante, *self.otras) = crear_catalogo(3)
+        self.hoy = timezone.localdate()
+
+    def movimiento(self, dia, tipo, cantidad, **campos):
+        return MovimientoInventario(
+            variante=self.variante, tipo=tipo, cantidad=cantidad,
+            fecha=timezone.make_aware(datetime.combine(dia, datetime.min.time())) + timedelta(hours=12), **campos,
+        )
+
+    def test_rollup_diario_alimenta_historial_y_resumen(self):
+        primero, segundo, tercero = (self.hoy - timedelta(days=n) for n in (3, 2, 1))
+        registrar_movimientos([self.movimiento(primero, 'entrada', 10, total_costo=20)])
+        # Un día que ya tiene fila del rollup se actualiza; el otro se crea
+        registrar_movimientos([
+            self.movimiento(primero, 'salida', 3, total_costo=6), self.movimiento(tercero, 'ajuste', -2),
+        ])
+        registrar_movimientos([self.movimiento(tercero, 'reserva', 4)])
+
+        self.assertEqual(
+            historial_stock(self.variante.pk, primero - timedelta(days=1), self.hoy),
+            [(primero - timedelta(days=1), 0), (primero, 7), (segundo, 7), (tercero, 5), (self.hoy, 5)],
+        )
+        (dia,) = resumen_periodo(primero, primero)
+        self.assertEqual(
+            (dia['total_entradas'], dia['total_salidas'], dia['total_movimientos'], dia['saldo_final']), (10, 3, 2, 7),
+        )
+        self.assertEqual((dia['total_costo_entradas'], dia['total_costo_salidas']), (20, 6))
+        (periodo,) = resumen_periodo(segundo, self.hoy, [self.variante.pk])
+        self.assertEqual(
+            (periodo['total_ajustes'], periodo['total_reservas'], periodo['total_movimientos'], periodo['saldo_final']),
+            (-2, 4, 2, 5),
+        )
+        self.assertEqual(list(resumen_periodo(segundo, self.hoy, [0])), [])
+
+    def proyeccion(self):
+        return list(StockVariante.objects.order_by('pk').values_list('pk', 'fisico', 'reservado', 'disponible'))
+
+    def test_rebuild_stock_coincide_con_la_proyeccion_incremental(self):
+        segunda, sin_movimientos = self.otras
+        registrar_movimientos([
+            MovimientoInventario(variante=self.variante, tipo='entrada', cantidad=20),
+            MovimientoInventario(variante=segunda, tipo='entrada', cantidad=8),
+            MovimientoInventario(variante=self.variante, tipo='reserva', cantidad=5),
+        ])
+        registrar_movimientos([
+            MovimientoInventario(variante=self.variante, tipo='salida', cantidad=6),
+            MovimientoInventario(variante=self.variante, tipo='reserva', cantidad=-2),
+            MovimientoInventario(variante=segunda, tipo='ajuste', cantidad=-3),
+            MovimientoInventario(variante=segunda, tipo='devolucion', cantidad=1),
+        ])
+        incremental = self.proyeccion()
+
+        # Proyección desviada: valores falsos, una fila perdida y otra sin movimientos
+        StockVariante.objects.filter(pk=self.variante.pk).update(fisico=999)
+        StockVariante.objects.filter(pk=segunda.pk).delete()
+        StockVariante.objects.create(variante=sin_movimientos, fisico=4)
+        call_command('rebuild_stock', '--chunk', '1', stdout=io.StringIO())
+        self.assertEqual(self.proyeccion(), incremental + [(sin_movimientos.pk, 0, 0, 0)])
+        self.assertEqual(incremental, [(self.variante.pk, 14, 3, 11), (segunda.pk, 6, 0, 6)])
+
+    def test_rebuild_stock_sincroniza_variantes(self):
+        segunda, sin_movimientos = self.otras
+        registrar_movimientos([
+            MovimientoInventario(variante=self.variante, tipo='entrada', cantidad=5),
+            MovimientoInventario(variante=self.variante, tipo='reserva', cantidad=2),
+        ])
+        ProductoVariante.objects.update(stock=50)
+        call_command('rebuild_stock', stdout=io.StringIO())
+        self.assertEqual(set(ProductoVariante.objects.values_list('stock', flat=True)), {50})
+        call_command('rebuild_stock', '--sincronizar-variantes', stdout=io.StringIO())
+        self.assertEqual(
+            dict(ProductoVariante.objects.values_list('pk', 'stock')),
+            {self.variante.pk: 3, segunda.pk: 0, sin_movimientos.pk: 0},
+        )
+
+
+@override_settings(PROMOCIONES_VERIFICACION_SEGUNDOS=0)
+class PedidosTests(TestCase):
+    def setUp(self):
+        promociones.invalidar_local()
+        self.usuario, self.producto, (self.variante,) = crear_catalogo()
+        for cantidad in (4, 10):
+            Lote.objects.create(
+                producto=self.producto, variante=self.variante, cantidad_inicial=cantidad,
+                cantidad_disponible=cantidad, costo_total=cantidad * 2, costo_unitario=2,
+            )
+        registrar_movimientos([MovimientoInventario(variante=self.variante, tipo='entrada', cantidad=14)])
+
+    def tearDown(self):
+        promociones.invalidar_local()
+
+    def pedido(self, cupon=None):
+        carrito = crear_carrito(self.usuario, {self.variante: 6})
+        Carrito.objects.filter(pk=carrito.pk).update(cupon_codigo=cupon)
+        return confirmar_carrito(carrito.pk, self.usuario, 'yape')
+
+    def disponibles_lotes(self):
+        return list(Lote.objects.order_by('pk').values_list('cantidad_disponible', flat=True))
+
+    def test_pago_preparacion_y_envio_mueven_el_stock_una_vez(self):
+        pedido = self.pedido()
+        reservar_pedido(pedido)
+        transicionar([pedido.pk], 'pagado')
+        self.assertEqual(stock(self.variante), (14, 6))
+        self.assertFalse(ReservaStock.objects.exists())
+        transicionar([pedido.pk], 'preparando')
+        self.assertEqual(self.disponibles_lotes(), [0, 8])
+        self.assertEqual(stock(self.variante), (14, 6))
+        transicionar([pedido.pk], 'enviado')
+        self.assertEqual(stock(self.variante), (8, 0))
+        self.assertEqual(MovimientoInventario.objects.filter(tipo='salida').count(), 2)
+
+    def test_cancelar_devuelve_stock_lotes_y_cupon(self):
+        promocion = Promocion.objects.create(
+            nombre='Cupón', codigo='VERANO', tipo_descuento='porcentaje', valor_descuento=10, max_usos=1,
+        )
+        configurar_contador(promocion, shards=4)
+        pedido = self.pedido(cupon='VERANO')
+        self.assertEqual(usos_totales(promocion.pk), 1)
+        transicionar([pedido.pk], 'pagado')
+        transicionar([pedido.pk], 'preparando')
+        transicionar([pedido.pk], 'cancelado')
+        self.assertEqual(stock(self.variante), (14, 0))
+        self.assertEqual(self.disponibles_lotes(), [4, 10])
+        self.assertFalse(PedidoItem.objects.filter(pedido=pedido, lote_origen__isnull=False).exists())
+        self.assertEqual(usos_totales(promocion.pk), 0)
+        consumir_uso(promocion)
+
+
+@override_settings(PROMOCIONES_VERIFICACION_SEGUNDOS=0)
+class PromocionesTests(TestCase):
+    def setUp(self):
+        promociones.invalidar_local()
+        self.usuario, self.producto, (self.variante, self.otra) = crear_catalogo(variantes=2)
+
+    def tearDown(self):
+        promociones.invalidar_local()
+
+    def lineas(self, cantidad=2):
+        return [
+            promociones.LineaPromocion(1, self.variante.pk, self.producto.pk, cantidad, Decimal('10.00')),
+            promociones.LineaPromocion(2, self.otra.pk, self.producto.pk, 1, Decimal('10.00')),
+        ]
+
+    def test_evaluar_no_consulta_la_base(self):
+        PromocionProducto.objects.create(
+            promocion=Promocion.objects.create(nombre='2x1', tipo_descuento='x_por_y'),
+            variante=self.variante, cantidad_requerida=2, cantidad_gratis=1,
+        )
+        indice = promociones.compilar()
+        with self.assertNumQueries(0):
+            resultado = indice.evaluar(self.lineas(4))
+        self.assertEqual(resultado.descuento_lineas, Decimal('20.00'))
+
+    def test_mejor_regla_por_linea_y_cupon_global(self):
+        diez = Promocion.objects.create(nombre='10%', tipo_descuento='porcentaje', valor_descuento=10)
+        fijo = Promocion.objects.create(nombre='-3', tipo_descuento='monto_fijo', valor_descuento=3)
+        PromocionProducto.objects.create(promocion=diez, producto=self.producto)
+        PromocionProducto.objects.create(promocion=fijo, variante=self.variante)
+        Promocion.objects.create(
+            nombre='Cupón', codigo='VERANO', tipo_descuento='porcentaje', valor_descuento=50, min_compra=30,
+        )
+        indice = promociones.compilar()
+        sin_cupon = indice.evaluar(self.lineas())
+        self.assertEqual([l.descuento for l in sin_cupon.lineas], [Decimal('6.00'), Decimal('1.00')])
+        self.assertEqual(sin_cupon.descuento_global, Decimal('0.00'))
+        con_cupon = indice.evaluar(self.lineas(), cupon='VERANO')
+        self.assertEqual(con_cupon.descuento_global, Decimal('11.50'))
+
+    def test_cambio_de_promociones_invalida_el_indice(self):
+        self.assertEqual(promociones.obtener_indice().evaluar(self.lineas()).descuento_lineas, Decimal('0.00'))
+        with self.captureOnCommitCallbacks(execute=True):
+            promocion = Promocion.objects.create(nombre='10%', tipo_descuento='porcentaje', valor_descuento=10)
+            PromocionProducto.objects.create(promocion=promocion, producto=self.producto)
+        self.assertEqual(promociones.obtener_indice().evaluar(self.lineas()).descuento_lineas, Decimal('3.00'))
+
+
+class CuponesTests(TestCase):
+    def setUp(self):
+        self.usuario, _, _ = crear_catalogo()
+
+    def test_contador_nuevo_parte_de_los_usos_registrados(self):
+        promocion = Promocion.objects.create(nombre='Cupón', codigo='X', tipo_descuento='porcentaje', valor_descuento=5)
+        for estado in ('pagado', 'entregado', 'cancelado'):
+            pedido = Pedido.objects.create(
+                usuario=self.usuario, codigo=f'P-{estado}', estado=estado,
+                subtotal=10, impuestos=0, costo_envio=0, total=10,
+            )
+            PromocionAplicada.objects.create(pedido=pedido, promocion=promocion, nombre_snapshot='X', valor_descuento_aplicado=1)
+        promocion.max_usos = 3
+        promocion.save()
+        self.assertEqual(usos_totales(promocion.pk), 2)
+        consumir_uso(promocion)
+        with self.assertRaises(CuponAgotado):
+            consumir_uso(promocion)
+
+
+@skipUnless(concurrencia_real(), "requiere conexiones concurrentes (PostgreSQL o SQLite en archivo con IMMEDIATE)")
+class CuponesConcurrenciaTests(TransactionTestCase):
+    def test_usos_concurrentes_no_pasan_max_usos(self):
+        crear_catalogo()
+        promocion = Promocion.objects.create(
+            nombre='Viral', codigo='VIRAL', tipo_descuento='porcentaje', valor_descuento=5, max_usos=50,
+        )
+        configurar_contador(promocion, shards=4)
+        resultados = en_paralelo(lambda: consumir_uso(promocion), 200)
+        usados = [r for r in resultados if isinstance(r, int)]
+        agotados = [r for r in resultados if isinstance(r, CuponAgotado)]
+        self.assertEqual(len(usados), 50)
+        self.assertEqual(len(agotados), 150)
+        self.assertEqual(usos_totales(promocion.pk), 50)
+        self.assertEqual(PromocionUsoContador.objects.filter(promocion=promocion).count(), 4)
+
+
+@skipUnless(concurrencia_real(), "requiere conexiones concurrentes (PostgreSQL o SQLite en archivo con IMMEDIATE)")
+class ReservasConcurrenciaTests(TransactionTestCase):
+    def test_retenciones_simultaneas_no_pasan_el_stock(self):
+        usuario, _, (variante,) = crear_catalogo()
+        registrar_movimientos([MovimientoInventario(variante=variante, tipo='entrada', cantidad=100)])
+        carritos = iter([crear_carrito(usuario, {variante: 1}).pk for _ in range(300)])
+        siguiente = threading.Lock()
+
+        def reservar():
+            with siguiente:
+                carrito_id = next(carritos)
+            return reservar_carrito(carrito_id)
+
+        resultados = en_paralelo(reservar, 300)
+        retenidos = [r for r in resultados if isinstance(r, datetime)]
+        sin_stock = [r for r in resultados if isinstance(r, StockInsuficiente)]
+        self.assertEqual(len(retenidos), 100)
+        self.assertEqual(len(sin_stock), 200)
+        self.assertEqual(ReservaStock.objects.count(), 100)
+        self.assertEqual(stock(variante), (100, 0))
+
+
+@override_settings(PROMOCIONES_VERIFICACION_SEGUNDOS=3600)
+class ConsultasCarritoTests(TestCase):
+    """El número de consultas no puede crecer con las líneas del carrito."""
+
+    def setUp(self):
+        promociones.invalidar_local()
+        self.usuario, self.producto, self.variantes = crear_catalogo(variantes=30)
+        promocion = Promocion.objects.create(nombre='10%', tipo_descuento='porcentaje', valor_descuento=10)
+        PromocionProducto.objects.create(promocion=promocion, producto=self.producto)
+        registrar_movimientos([
+            MovimientoInventario(variante=variante, tipo='entrada', cantidad=100) for variante in self.variantes
+        ])
+        promociones.obtener_indice()
+
+    def tearDown(self):
+        promociones.invalidar_local()
+
+    def carrito(self, lineas):
+        return crear_carrito(self.usuario, {variante: 2 for variante in self.variantes[:lineas]})
+
+    def test_resumen_carrito(self):
+        for lineas in (1, 30):
+            carrito = self.carrito(lineas)
+            with self.subTest(lineas=lineas), self.assertNumQueries(4):
+                resumen = resumen_carrito(carrito.pk)
+            self.assertEqual(len(resumen.lineas), lineas)
+
+    def test_confirmar_carrito(self):
+        # Los SAVEPOINT y el INSERT ... RETURNING varían según el motor: la base es el carrito de 1 línea
+        carrito = self.carrito(1)
+        with CaptureQueriesContext(connection) as una_linea:
+            confirmar_carrito(carrito.pk, self.usuario, 'yape')
+        carrito = self.carrito(30)
+        with self.assertNumQueries(len(una_linea)):
+            pedido = confirmar_carrito(carrito.pk, self.usuario, 'yape')
+        self.assertEqual(PedidoItem.objects.filter(pedido=pedido).count(), 30)
+
+
+class CategoriasTests(TestCase):
+    def setUp(self):
+        self.raiz = Categoria.objects.create(nombre='Raíz', slug='raiz')
+        self.hija = Categoria.objects.create(nombre='Hija', slug='hija', id_padre=self.raiz)
+        self.nieta = Categoria.objects.create(nombre='Nieta', slug='nieta', id_padre=self.hija)
+        self.otra = Categoria.objects.create(nombre='Otra', slug='otra')
+
+    def test_consultas_de_una_sola_sentencia(self):
+        Producto.objects.create(categoria=self.nieta, nombre='A')
+        Producto.objects.create(categoria=self.hija, nombre='B')
+        with self.assertNumQueries(1):
+            self.assertEqual(categorias.productos_en_subarbol(self.raiz).count(), 2)
+        with self.assertNumQueries(1):
+            self.assertEqual([c.pk for c in categorias.migas_de_pan(self.nieta)], [self.raiz.pk, self.hija.pk, self.nieta.pk])
+        with self.assertNumQueries(1):
+            self.assertEqual(categorias.conteo_por_subcategoria(self.raiz), {self.hija.pk: 2})
+
+    def test_mover_reescribe_el_subarbol(self):
+        self.hija.id_padre = self.otra
+        self.hija.save()
+        self.nieta.refresh_from_db()
+        self.assertEqual(self.nieta.ruta, self.otra.ruta + categorias.segmento(self.hija.pk) + categorias.segmento(self.nieta.pk))
+        self.assertEqual(self.nieta.profundidad, 2)
+        self.otra.id_padre = self.nieta
+        with self.assertRaises(categorias.CicloCategorias):
+            self.otra.save()
+
+    def cadena(self, niveles):
+        padre, lista = None, []
+        for i in range(niveles):
+            padre = Categoria.objects.create(nombre=f'Nivel {i}', slug=f'nivel-{i}', id_padre=padre)
+            lista.append(padre)
+        return lista
+
+    def test_profundidad_maxima_de_la_ruta(self):
+        niveles = self.cadena(categorias.MAX_NIVELES)
+        self.assertEqual(len(niveles[-1].ruta), categorias.MAX_NIVELES * categorias.LARGO_SEGMENTO)
+        with self.assertRaises(categorias.ProfundidadExcedida):
+            Categoria.objects.create(nombre='Honda', slug='honda', id_padre=niveles[-1])
+
+        # Mover cuenta la altura del subárbol (hija y nieta)
+        self.hija.id_padre = niveles[-2]
+        with self.assertRaises(categorias.ProfundidadExcedida):
+            self.hija.save()
+        self.hija.id_padre = niveles[-3]
+        self.hija.save()
+        self.nieta.refresh_from_db()
+        self.assertEqual(self.nieta.profundidad, categorias.MAX_NIVELES - 1)
+
+    def test_reconstruir_no_escribe_arboles_demasiado_profundos(self):
+        niveles = self.cadena(categorias.MAX_NIVELES)
+        Categoria.objects.filter(pk=self.raiz.pk).update(id_padre=niveles[-1])
+        rutas = dict(Categoria.objects.values_list('pk', 'ruta'))
+        with self.assertRaises(categorias.ProfundidadExcedida):
+            categorias.reconstruir_rutas()
+        with self.assertRaisesMessage(CommandError, str(self.nieta.pk)):
+            call_command('rebuild_categorias', stdout=io.StringIO())
+        self.assertEqual(dict(Categoria.objects.values_list('pk', 'ruta')), rutas)
+
+
+class FacetasTests(TestCase):
+    def setUp(self):
+        _, self.producto, (self.roja, self.azul) = crear_catalogo(variantes=2)
+        self.color = Atributo.objects.create(nombre='Color', codigo='color', tipo='texto')
+        self.talla = Atributo.objects.create(nombre='Talla', codigo='talla', tipo='numero')
+        ProductoAtributo.objects.create(producto=self.producto, atributo=self.talla, valor_num=Decimal('42'))
+        VarianteAtributo.objects.create(variante=self.roja, atributo=self.color, valor_text='Rojo')
+        VarianteAtributo.objects.create(variante=self.azul, atributo=self.color, valor_text='Azul')
+        indexar_productos([self.producto.pk])
+
+    def test_filtro_por_varios_atributos(self):
+        ids = set(variantes_filtradas({'color': ['rojo', 'verde'], 'talla': 42}).values_list('variante_id', flat=True))
+        self.assertEqual(ids, {self.roja.pk})
+        self.assertEqual(conteo_facetas({'talla': 42}, atributos=[self.color.pk]), {self.color.pk: {'rojo': 1, 'azul': 1}})
+
+    def test_codigo_desconocido_no_coincide_con_nada(self):
+        self.assertEqual(list(variantes_filtradas({'no_existe': 'rojo'})), [])
+        self.assertEqual(list(variantes_filtradas({'color': 'rojo', 'no_existe': 'x'})), [])
+        self.assertEqual(conteo_facetas({'no_existe': 'rojo'}), {})
+
+
+@override_settings(BUSQUEDA_VERIFICACION_SEGUNDOS=0)
+class BusquedaTests(TestCase):
+    def setUp(self):
+        busqueda.invalidar_local()
+        _, self.zapatilla, _ = crear_catalogo()
+        Producto.objects.filter(pk=self.zapatilla.pk).update(nombre='Zapatilla deportiva roja', sku_base='ZAP-001')
+        self.taza = Producto.objects.create(categoria=self.zapatilla.categoria, nombre='Taza de cerámica', sku_base='TZ-9')
+        busqueda.actualizar_documentos([self.zapatilla.pk, self.taza.pk])
+
+    def tearDown(self):
+        busqueda.invalidar_local()
+
+    def ids(self, texto):
+        return [producto_id for producto_id, _ in busqueda.buscar(texto)]
+
+    def test_nombre_sku_y_typo(self):
+        self.assertEqual(self.ids('zapatilla')[:1], [self.zapatilla.pk])
+        self.assertIn(self.zapatilla.pk, self.ids('ZAP-001'))
+        self.assertIn(self.zapatilla.pk, self.ids('zapatila'))
+        self.assertNotIn(self.taza.pk, self.ids('zapatilla'))
+
+    def test_inactivos_no_aparecen(self):
+        Producto.objects.filter(pk=self.taza.pk).update(activo=False)
+        busqueda.actualizar_documentos([self.taza.pk])
+        self.assertEqual(self.ids('taza'), [])
+
+
+class ImportacionTests(TestCase):
+    def setUp(self):
+        self.usuario, self.producto, (self.variante,) = crear_catalogo()
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.directorio = directorio.name
+        ajustes = override_settings(IMPORTACION_DIR=self.directorio)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+    def archivo(self, lineas, directorio=None):
+        temporal = tempfile.NamedTemporaryFile(
+            'w', suffix='.csv', delete=False, encoding='utf-8', dir=directorio or self.directorio,
+        )
+        with temporal:
+            temporal.write('\n'.join(lineas) + '\n')
+        self.addCleanup(os.remove, temporal.name)
+        return temporal.name
+
+    def test_reintento_de_lotes_reanuda_sin_duplicar(self):
+        archivo = self.archivo(['sku,cantidad,costo_unitario'] + [f'V0,{i},2' for i in range(1, 6)])
+        job = ImportJob.objects.create(usuario=self.usuario, tipo='lotes', archivo_url=archivo)
+        guardar = ImportadorLotes.guardar
+        llamadas = []
+
+        def fallar_en_el_segundo(importador, lotes):
+            llamadas.append(len(lotes))
+            if len(llamadas) == 2:
+                raise RuntimeError("Conexión perdida")
+            return guardar(importador, lotes)
+
+        with mock.patch.object(ImportadorLotes, 'guardar', fallar_en_el_segundo):
+            with self.assertRaises(RuntimeError):
+                ejecutar_importacion(job, tamano_lote=2)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.filas_procesadas), ('error', 2))
+
+        ejecutar_importacion(job, tamano_lote=2)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.filas_procesadas), ('completado', 5))
+        self.assertEqual(sorted(Lote.objects.values_list('cantidad_inicial', flat=True)), [1, 2, 3, 4, 5])
+        self.assertEqual(MovimientoInventario.objects.filter(tipo='entrada', lote__isnull=False).count(), 5)
+
+    def test_productos_invalidan_fichas_y_snapshots(self):
+        archivo = self.archivo(['sku_base,nombre,categoria', 'P1,Nuevo nombre,categoria', 'P2,Otro,categoria'])
+        job = ImportJob.objects.create(usuario=self.usuario, tipo='productos', archivo_url=archivo)
+        with mock.patch.object(catalogo, 'incrementar_versiones') as incrementar:
+            with self.captureOnCommitCallbacks(execute=True):
+                ejecutar_importacion(job)
+        ids = set(Producto.objects.values_list('pk', flat=True))
+        self.assertEqual(set(incrementar.call_args.args[0]), ids)
+        self.assertEqual(set(ProductoSnapshot.objects.values_list('producto_id', flat=True)), ids)
+        self.assertEqual(snapshots.obtener_snapshot(self.producto.pk)['nombre'], 'Nuevo nombre')
+
+    def test_solo_abre_archivos_de_importacion_o_http(self):
+        fuera = tempfile.TemporaryDirectory()
+        self.addCleanup(fuera.cleanup)
+        ajeno = self.archivo(['sku,cantidad,costo_unitario', 'V0,1,x'], directorio=fuera.name)
+        propio = self.archivo(['sku,cantidad,costo_unitario', 'V0,1,2'])
+        for url in (ajeno, f'file://{ajeno}', f'{self.directorio}/../{os.path.basename(fuera.name)}/x.csv',
+                    'ftp://example.com/x.csv'):
+            job = ImportJob.objects.create(usuario=self.usuario, tipo='lotes', archivo_url=url)
+            with self.assertRaises(OrigenNoPermitido):
+                ejecutar_importacion(job)
+            self.assertEqual(job.status, 'error')
+            self.assertNotIn("no es un número", job.errores)
+        for url in (os.path.basename(propio), f'file://{propio}'):
+            job = ImportJob.objects.create(usuario=self.usuario, tipo='lotes', archivo_url=url)
+            self.assertEqual(ejecutar_importacion(job).status, 'completado')
+
+    def test_textos_largos_son_errores_de_fila(self):
+        archivo = self.archivo([
+            'email,documento,direccion',
+            'corto@example.com,12345678,Av. Principal 123',
+            f'largo@example.com,12345678,{"x" * 51}',
+        ])
+        job = ImportJob.objects.create(usuario=self.usuario, tipo='clientes', archivo_url=archivo)
+        ejecutar_importacion(job)
+        self.assertEqual((job.status, job.filas_con_error), ('completado_con_errores', 1))
+        self.assertIn("'direccion' admite hasta 50", job.errores)
+        self.assertTrue(Usuario.objects.filter(email='corto@example.com').exists())
+        self.assertFalse(Usuario.objects.filter(email='largo@example.com').exists())
+
+
+class ExportacionTests(TestCase):
+    def test_csv_con_formato_de_copy(self):
+        usuario, producto, _ = crear_catalogo()
+        job = ExportJob.objects.create(usuario=usuario, tipo='productos')
+        with tempfile.TemporaryDirectory() as directorio, override_settings(EXPORTACION_DIR=directorio):
+            ejecutar_exportacion(job)
+            with gzip.open(os.path.join(directorio, os.path.basename(job.url_archivo)), 'rt') as archivo:
+                lineas = archivo.read().splitlines()
+        self.assertEqual(job.filas_exportadas, 1)
+        self.assertEqual(lineas[1], 'P1,Producto,categoria,Marca,10.00,1.500,,true')
+
+
+@override_settings(TRABAJOS_MAX_INTENTOS=3)
+class TrabajosTests(TestCase):
+    def setUp(self):
+        self.usuario, _, _ = crear_catalogo()
+        self.job = ImportJob.objects.create(usuario=self.usuario, tipo='lotes', archivo_url='/no/existe.csv')
+
+    def test_cola_reintentable_reencola(self):
+        self.assertEqual(reclamar('importacion', 'w1', 1), [self.job.pk])
+        self.assertEqual(registrar_fallo('importacion', self.job.pk, 'w1', 'falla'), 'pendiente')
+
+    def test_cola_no_reintentable_no_reencola(self):
+        no_reintentable = Cola(ImportJob, COLAS['importacion'].ejecutor, reintentable=False)
+        with mock.patch.dict(COLAS, importacion=no_reintentable):
+            self.assertEqual(reclamar('importacion', 'w1', 1), [self.job.pk])
+            self.assertEqual(registrar_fallo('importacion', self.job.pk, 'w1', 'falla'), 'error')
+            # Un 'procesando' abandonado tampoco se retoma
+            ImportJob.objects.filter(pk=self.job.pk).update(status='procesando', latido='2000-01-01T00:00Z')
+            self.assertEqual(reclamar('importacion', 'w2', 1), [])
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, 'error')
+
+
+class AuditoriaTests(BuffersSincronos, TestCase):
+    def buffer(self, escribir, **opciones):
+        buffer = BufferEscritura('prueba', escribir, asincrono=False, **opciones)
+        self.addCleanup(atexit.unregister, buffer.vaciar)
+        return buffer
+
+    def test_buffer_escribe_en_bloque_al_llenarse(self):
+        escritos = []
+        buffer = self.buffer(escritos.append, tamano=3)
+        buffer.agregar(1)
+        buffer.agregar(2)
+        self.assertEqual(escritos, [])
+        buffer.agregar(3)
+        self.assertEqual(escritos, [[1, 2, 3]])
+        self.assertEqual(buffer.escritos, 3)
+
+    def test_buffer_conserva_los_mas_nuevos_si_la_escritura_falla(self):
+        escritos = []
+
+        def escribir(elementos):
+            if not escritos:
+                escritos.append(None)
+                raise DatabaseError("base caída")
+            escritos.append(elementos)
+
+        buffer = self.buffer(escribir, tamano=10, max_pendientes=2)
+        for elemento in (1, 2, 3):
+            buffer.agregar(elemento)
+        with self.assertLogs('core.services.buffer', 'WARNING'):
+            self.assertEqual(buffer.vaciar(), 0)
+        self.assertEqual(buffer.descartados, 1)
+        self.assertEqual(buffer.vaciar(), 2)
+        self.assertEqual(escritos, [None, [2, 3]])
+
+    def test_transicion_de_pedidos_queda_auditada_al_confirmar(self):
+        usuario, _, _ = crear_catalogo()
+        pedido = Pedido.objects.create(
+            usuario=usuario, codigo='P-1', subtotal=10, impuestos=0, costo_envio=0, total=10,
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            transicionar([pedido.pk], 'pagado', usuario=usuario, motivo='Pago confirmado')
+        self.assertFalse(LogAccion.objects.exists())
+        auditoria.vaciar()
+        registro = LogAccion.objects.get()
+        self.assertEqual((registro.accion, registro.usuario_id), ('pedidos.transicionar', usuario.pk))
+        self.assertIn('Pago confirmado', registro.detalle)
+
+
+@skipUnless(connection.vendor == 'postgresql', "las particiones solo existen en PostgreSQL")
+class ParticionesTests(TransactionTestCase):
+    # Como en migrate, el DDL corre fuera de la transacción de un TestCase
+    tabla = LogAccion._meta.db_table
+
+    def setUp(self):
+        self.migracion = import_module('core.migrations.0020_particionar_logaccion')
+        self.addCleanup(self.migrar, self.migracion.desparticionar)
+
+    def migrar(self, funcion):
+        with override_settings(PARTICIONES_EN_MIGRACION=True), connection.schema_editor() as editor:
+            funcion(django_apps, editor)
+
+    def estado(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s",
+                [self.tabla],
+            )
+            indices = {fila[0] for fila in cursor.fetchall()}
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [self.tabla])
+            return particiones.es_particionada(cursor, self.tabla), indices, cursor.fetchone()[0]
+
+    def test_migracion_conserva_datos_secuencia_e_indices(self):
+        anterior = LogAccion.objects.create(accion='antes', fecha=timezone.now() - timedelta(days=400))
+        _, indices, _ = self.estado()
+
+        self.migrar(self.migracion.particionar)
+        particionada, indices_despues, secuencia = self.estado()
+        self.assertTrue(particionada)
+        self.assertEqual(indices_despues, indices)
+        self.assertIsNotNone(secuencia)
+        with connection.cursor() as cursor:
+            meses = particiones.particiones(cursor, self.tabla)
+        self.assertIn(particiones._mes_de(anterior.fecha), meses)
+        self.assertIn(particiones._mes_de(timezone.now()), meses)
+        nuevo = LogAccion.objects.create(accion='particionada')
+        self.assertGreater(nuevo.pk, anterior.pk)
+        self.assertEqual(LogAccion.objects.count(), 2)
+
+        self.migrar(self.migracion.desparticionar)
+        particionada, indices_despues, secuencia = self.estado()
+        self.assertFalse(particionada)
+        self.assertEqual(indices_despues, indices)
+        self.assertIsNotNone(secuencia)
+        self.assertGreater(LogAccion.objects.create(accion='revertida').pk, nuevo.pk)
+        self.assertEqual(LogAccion.objects.count(), 3)
+
+
+@override_settings(ANALITICA_RETRASO_SEGUNDOS=0)
+class AnaliticaTests(TestCase):
+    def setUp(self):
+        self.usuario, _, (self.variante,) = crear_catalogo()
+        self.hoy = timezone.localdate()
+        self.ayer = self.hoy - timedelta(days=1)
+
+    def venta(self, dia, cantidad):
+        pedido = Pedido.objects.create(
+            usuario=self.usuario, codigo=f'P-{dia}-{cantidad}', estado='pagado', subtotal=10 * cantidad,
+            impuestos=0, costo_envio=0, total=10 * cantidad,
+            fecha_pedido=timezone.make_aware(datetime.combine(dia, datetime.min.time())) + timedelta(hours=12),
+        )
+        PedidoItem.objects.create(
+            pedido=pedido, variante=self.variante, cantidad=cantidad, precio_unitario=10,
+            subtotal=10 * cantidad, total_neto=10 * cantidad,
+        )
+        return pedido
+
+    def unidades(self):
+        return dict(VentaCubo.objects.values_list('fecha', 'unidades'))
+
+    def test_solo_recalcula_los_dias_de_pedidos_cambiados(self):
+        self.venta(self.ayer, 2)
+        pedido = self.venta(self.hoy, 3)
+        self.venta(self.hoy, 4)
+        self.assertEqual(analitica.refrescar_cubos(), (2, 2))
+        self.assertEqual(self.unidades(), {self.ayer: 2, self.hoy: 7})
+        self.assertEqual(analitica.refrescar_cubos(), (0, 0))
+
+        # Un día recalculado se reescribe entero; el otro conserva su fila tal cual
+        VentaCubo.objects.filter(fecha=self.ayer).update(unidades=99)
+        Pedido.objects.filter(pk=pedido.pk).update(estado='cancelado', fecha_actualizacion=timezone.now())
+        self.assertEqual(analitica.refrescar_cubos(), (1, 1))
+        self.assertEqual(self.unidades(), {self.ayer: 99, self.hoy: 4})
+
+    @override_settings(COSTEO_RETRASO_SEGUNDOS=0)
+    def test_costo_de_venta_del_costeo_llega_a_los_cubos(self):
+        item = PedidoItem.objects.get(pedido=self.venta(self.hoy, 3))
+        analitica.refrescar_cubos()
+        self.assertEqual(VentaCubo.objects.values_list('costo', 'unidades_sin_costo').get(), (0, 3))
+        registrar_movimientos([
+            MovimientoInventario(variante=self.variante, tipo='entrada', cantidad=10, costo_unitario=2),
+            MovimientoInventario(variante=self.variante, tipo='salida', cantidad=3, pedido_item=item),
+        ])
+        costear()
+        self.assertEqual(analitica.refrescar_cubos(), (1, 1))
+        self.assertEqual(VentaCubo.objects.values_list('costo', 'unidades_sin_costo').get(), (6, 0))
+
+    def test_completo_limpia_los_dias_sin_pedidos(self):
+        self.venta(self.ayer, 2)
+        pedido = self.venta(self.hoy, 3)
+        analitica.refrescar_cubos()
+        pedido.delete()
+        analitica.refrescar_cubos()
+        self.assertEqual(self.unidades(), {self.ayer: 2, self.hoy: 3})
+        call_command('refresh_sales_cubes', '--completo', stdout=io.StringIO())
+        self.assertEqual(self.unidades(), {self.ayer: 2})
+
+
+@override_settings(COSTEO_RETRASO_SEGUNDOS=0)
+class CosteoTests(TestCase):
+    def setUp(self):
+        self.usuario, _, (self.variante,) = crear_catalogo()
+
+    def item(self, cantidad):
+        pedido = Pedido.objects.create(
+            usuario=self.usuario, codigo=f'P-{Pedido.objects.count()}', subtotal=10 * cantidad,
+            impuestos=0, costo_envio=0, total=10 * cantidad,
+        )
+        return PedidoItem.objects.create(
+            pedido=pedido, variante=self.variante, cantidad=cantidad, precio_unitario=10,
+            subtotal=10 * cantidad, total_neto=10 * cantidad,
+        )
+
+    def mover(self, tipo, cantidad, costo=None, item=None):
+        registrar_movimientos([MovimientoInventario(
+            variante=self.variante, tipo=tipo, cantidad=cantidad, costo_unitario=costo, pedido_item=item,
+        )])
+
+    def costo_venta(self, item):
+        item.refresh_from_db()
+        return item.costo_total
+
+    def estado(self):
+        estado = CostoVariante.objects.get(variante=self.variante)
+        return estado.cantidad, estado.valor
+
+    def test_movimiento_retroactivo_recien_insertado_espera(self):
+        registrar_movimientos([MovimientoInventario(
+            variante=self.variante, tipo='entrada', cantidad=5, costo_unitario=2,
+            fecha=timezone.make_aware(datetime(2000, 1, 1)),
+        )])
+        with override_settings(COSTEO_RETRASO_SEGUNDOS=60):
+            self.assertEqual(costear(), (0, 0))
+        self.assertEqual(costear(), (1, 1))
+
+    def test_fifo_y_promedio_valorizan_distinto(self):
+        item = self.item(15)
+        self.mover('entrada', 10, costo=2)
+        self.mover('entrada', 10, costo=4)
+        self.mover('salida', 15, item=item)
+        for metodo, costo_venta, valor in (('promedio', 45, 15), ('fifo', 40, 20)):
+            with self.subTest(metodo), override_settings(COSTEO_METODO=metodo):
+                self.assertEqual(costear(reiniciar=True), (3, 1))
+                self.assertEqual(self.costo_venta(item), costo_venta)
+                self.assertEqual(self.estado(), (5, valor))
+
+    def test_deficit_sale_al_ultimo_costo_y_lo_cubre_la_entrada_siguiente(self):
+        item = self.item(5)
+        self.mover('entrada', 2, costo=3)
+        self.mover('salida', 5, item=item)
+        costear()
+        self.assertEqual(self.costo_venta(item), 15)
+        self.assertEqual(self.estado(), (-3, -9))
+        self.mover('entrada', 10, costo=5)
+        costear()
+        self.assertEqual(self.estado(), (7, 35))
+
+    def test_devolucion_descuenta_el_costo_de_venta(self):
+        item = self.item(4)
+        self.mover('entrada', 10, costo=2)
+        self.mover('salida', 4, item=item)
+        costear()
+        antes = Pedido.objects.get(pk=item.pedido_id).fecha_actualizacion
+        self.mover('devolucion', 1, item=item)
+        costear()
+        self.assertEqual(self.costo_venta(item), 6)
+        self.assertEqual(self.estado(), (7, 14))
+        self.assertGreater(Pedido.objects.get(pk=item.pedido_id).fecha_actualizacion, antes)
+
+    @override_settings(COSTEO_METODO='fifo')
+    def test_retoma_desde_el_ultimo_checkpoint(self):
+        item = self.item(6)
+        self.mover('entrada', 4, costo=2)
+        self.mover('entrada', 4, costo=5)
+        self.mover('salida', 6, item=item)
+        aplicar = costeo.aplicar_movimientos
+        tandas = []
+
+        def cortar_en_la_segunda(acumulador, movimientos):
+            tandas.append(movimientos)
+            if len(tandas) == 2:
+                raise DatabaseError("conexión perdida")
+            return aplicar(acumulador, movimientos)
+
+        with mock.patch('core.services.costeo.aplicar_movimientos', cortar_en_la_segunda), \
+                self.assertRaises(DatabaseError):
+            costear(tamano_tanda=2)
+        self.assertEqual(PuntoControl.objects.get(clave=costeo.CLAVE_PUNTO_CONTROL).ultimo_id, tandas[0][-1][0])
+        self.assertEqual(self.estado(), (8, 28))
+        self.assertIsNone(self.costo_venta(item))
+
+        self.assertEqual(costear(tamano_tanda=2), (1, 1))
+        self.assertEqual(self.costo_venta(item), 18)
+        self.assertEqual(self.estado(), (2, 10))
+
+
+@override_settings(ENVIOS_VERIFICACION_SEGUNDOS=0)
+class EnviosTests(TestCase):
+    def setUp(self):
+        envios.invalidar_local()
+        self.ciudad = Ciudad.objects.create(nombre='Lima', region=Region.objects.create(nombre='Lima'))
+        rapida, barata = EmpresaEnvio.objects.create(nombre='Rápida'), EmpresaEnvio.objects.create(nombre='Barata')
+        for empresa, peso_min, peso_max, costo in (
+            (rapida, None, 5, 10), (rapida, Decimal('5.01'), None, 25),
+            (barata, 1, 3, 8), (barata, Decimal('3.01'), 10, 30),
+        ):
+            TarifaEnvio.objects.create(
+                ciudad=self.ciudad, empresa=empresa, peso_min_kg=peso_min, peso_max_kg=peso_max, costo=costo,
+            )
+
+    def tearDown(self):
+        envios.invalidar_local()
+
+    def test_coincide_con_el_filtro_del_orm(self):
+        indice = envios.obtener_indice(self.ciudad.pk)
+        for peso in ('0.5', '1', '3', '3.005', '5', '7', '10', '50'):
+            peso = Decimal(peso)
+            ingenua = (
+                TarifaEnvio.objects.filter(ciudad=self.ciudad, activo=True)
+                .exclude(peso_min_kg__gt=peso).exclude(peso_max_kg__lt=peso).order_by('costo').first()
+            )
+            with self.assertNumQueries(0):
+                mejor = indice.cotizar(peso)[0]
+            self.assertEqual(mejor.tarifa_id, ingenua.pk, peso)
+
+    def test_cambio_de_tarifa_invalida_el_indice(self):
+        self.assertEqual(envios.mejor_cotizacion(self.ciudad.pk, 2).costo, 8)
+        TarifaEnvio.objects.filter(costo=8).get().delete()
+        self.assertEqual(envios.mejor_cotizacion(self.ciudad.pk, 2).costo, 10)
+
+
+class CatalogoTests(TestCase):
+    def setUp(self):
+        catalogo.invalidar_local()
+        self.usuario, self.producto, (self.variante,) = crear_catalogo()
+        registrar_movimientos([MovimientoInventario(variante=self.variante, tipo='entrada', cantidad=5)])
+
+    def tearDown(self):
+        catalogo.invalidar_local()
+
+    def stock_ficha(self, documento):
+        return [variante['stock'] for variante in documento['variantes']]
+
+    def test_nivel_local_sirve_la_ficha_con_el_stock_actual(self):
+        antes = catalogo.estadisticas()['local']
+        self.assertEqual(self.stock_ficha(catalogo.obtener_ficha(self.producto.pk)), [5])
+        registrar_movimientos([MovimientoInventario(variante=self.variante, tipo='salida', cantidad=2)])
+        reservar_carrito(crear_carrito(self.usuario, {self.variante: 1}).pk)
+        with self.assertNumQueries(1):
+            ficha = catalogo.obtener_ficha(self.producto.pk)
+        self.assertEqual(self.stock_ficha(ficha), [2])
+        despues = catalogo.estadisticas()['local']
+        self.assertEqual((despues['aciertos'] - antes['aciertos'], despues['fallos'] - antes['fallos']), (1, 1))
+
+    def test_cambio_de_producto_invalida_la_ficha(self):
+        self.assertEqual(catalogo.obtener_ficha(self.producto.pk)['nombre'], 'Producto')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.producto.nombre = 'Renombrado'
+            self.producto.save()
+        self.assertEqual(catalogo.obtener_ficha(self.producto.pk)['nombre'], 'Renombrado')
+
+    @override_settings(
+        CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'catalogo': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'catalogo-tests'},
+        },
+        CATALOGO_CACHE='catalogo',
+    )
+    def test_nivel_compartido_entre_procesos(self):
+        antes = catalogo.estadisticas()
+        catalogo.obtener_ficha(self.producto.pk)
+        # Otro proceso: sin nivel local, lee la ficha del compartido y solo consulta el stock
+        catalogo.invalidar_local()
+        with self.assertNumQueries(1):
+            catalogo.obtener_ficha(self.producto.pk)
+        catalogo.incrementar_versiones([self.producto.pk])
+        catalogo.obtener_ficha(self.producto.pk)
+        despues = catalogo.estadisticas()
+        self.assertEqual(despues['compartido']['aciertos'] - antes['compartido']['aciertos'], 1)
+        self.assertEqual(despues['recalculo']['fallos'] - antes['recalculo']['fallos'], 2)
+
+    @override_settings(CATALOGO_LOCAL_MAX=2)
+    def test_versiones_locales_acotadas(self):
+        catalogo.obtener_fichas(range(self.producto.pk + 1, self.producto.pk + 50))
+        catalogo.obtener_fichas([self.producto.pk])
+        self.assertLessEqual(len(catalogo._local.versiones), 4)
+        self.assertEqual(catalogo.obtener_ficha(self.producto.pk)['pk'], self.producto.pk)
+
+    def test_snapshot_lee_el_stock_sin_reconstruir(self):
+        snapshots.reconstruir([self.producto.pk])
+        registrar_movimientos([MovimientoInventario(variante=self.variante, tipo='salida', cantidad=4)])
+        self.assertEqual(self.stock_ficha(snapshots.obtener_snapshot(self.producto.pk)), [1])
+        self.assertEqual(snapshots.reconstruir([self.producto.pk]), 0)
+
+
+class TokensTests(BuffersSincronos, TestCase):
+    def test_token_en_claro_de_una_version_anterior(self):
+        usuario, _, _ = crear_catalogo()
+        with connection.cursor() as cursor:
+            # INSERT como lo haría el código previo al hash: sin token_hash ni family
+            cursor.execute(
+                "INSERT INTO core_refreshtoken (token, user_id, created, expires, revoked) VALUES (%s, %s, %s, %s, %s)",
+                ['viejo', usuario.pk, timezone.now(), timezone.now() + timedelta(days=1), False],
+            )
+        registro = validar_refresh('viejo')
+        self.assertIsNotNone(registro.family)
+        _, nuevo = rotar_refresh('viejo')
+        self.assertEqual(nuevo.family, registro.family)
+        self.assertIsNone(validar_refresh('viejo'))
+
+
+class AccesosTests(BuffersSincronos, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.usuario, _, _ = crear_catalogo()
+        self.otro = Usuario.objects.create(email='otro@example.com', rol=self.usuario.rol)
+        self.inicio = timezone.now() - timedelta(hours=1)
+
+    def ultimo_acceso(self, usuario):
+        return Usuario.objects.values_list('ultimo_acceso', flat=True).get(pk=usuario.pk)
+
+    def delta(self, antes, campo):
+        return accesos.estadisticas()[campo] - antes[campo]
+
+    def test_un_update_por_lote_con_el_ultimo_acceso_de_cada_usuario(self):
+        antes = accesos.estadisticas()
+        accesos.registrar_acceso(self.usuario, self.inicio)
+        accesos.registrar_acceso(self.usuario, self.inicio + timedelta(minutes=10))
+        accesos.registrar_acceso(self.usuario, self.inicio + timedelta(minutes=11))  # misma ventana: ni se encola
+        accesos.registrar_acceso(self.otro, self.inicio)
+        with CaptureQueriesContext(connection) as capturadas:
+            self.assertEqual(accesos.vaciar(), 2)
+        self.assertEqual(len([q for q in capturadas.captured_queries if q['sql'].startswith('UPDATE')]), 1)
+        self.assertEqual(self.ultimo_acceso(self.usuario), self.inicio + timedelta(minutes=10))
+        self.assertEqual(self.ultimo_acceso(self.otro), self.inicio)
+        self.assertEqual((self.delta(antes, 'omitidos'), self.delta(antes, 'filas')), (1, 2))
+
+    def test_no_reescribe_valores_dentro_de_la_granularidad(self):
+        Usuario.objects.filter(pk=self.usuario.pk).update(ultimo_acceso=self.inicio)
+        antes = accesos.estadisticas()
+        accesos.registrar_acceso(self.usuario, self.inicio + timedelta(minutes=1))
+        accesos.registrar_acceso(self.otro, self.inicio + timedelta(minutes=1))
+        accesos.vaciar()
+        self.assertEqual(self.ultimo_acceso(self.usuario), self.inicio)
+        self.assertEqual(self.delta(antes, 'filas'), 1)
+
+    def test_se_vacia_solo_al_llegar_al_tamano(self):
+        tamano, accesos._buffer.tamano = accesos._buffer.tamano, 2
+        self.addCleanup(setattr, accesos._buffer, 'tamano', tamano)
+        accesos.registrar_acceso(self.usuario, self.inicio)
+        self.assertIsNone(self.ultimo_acceso(self.usuario))
+        accesos.registrar_acceso(self.otro, self.inicio)
+        self.assertEqual(self.ultimo_acceso(self.usuario), self.inicio)
+        self.assertEqual(self.ultimo_acceso(self.otro), self.inicio)
+
+
+class PurgaCarritosTests(TestCase):
+    def setUp(self):
+        self.usuario, _, self.variantes = crear_catalogo(variantes=2)
+        registrar_movimientos([
+            MovimientoInventario(variante=variante, tipo='entrada', cantidad=10) for variante in self.variantes
+        ])
+
+    def anonimo(self, cantidades, session_id='sesion-1', **campos):
+        carrito = crear_carrito(None, cantidades)
+        Carrito.objects.filter(pk=carrito.pk).update(session_id=session_id, **campos)
+        return carrito
+
+    def hace(self, dias):
+        return timezone.now() - timedelta(days=dias)
+
+    def lineas(self, carrito):
+        return dict(CarritoItem.objects.filter(carrito=carrito).values_list('variante_id', 'cantidad'))
+
+    def test_fusion_suma_repetidas_y_suelta_las_retenciones_del_anonimo(self):
+        roja, azul = self.variantes
+        propio = crear_carrito(self.usuario, {roja: 3})
+        CarritoItem.objects.filter(carrito=propio).update(precio_unitario_snapshot=Decimal('8.00'))
+        anonimo = self.anonimo({roja: 1, azul: 2}, cupon_codigo='BIENVENIDA')
+        reservar_carrito(anonimo.pk)
+
+        resultado = fusionar_carrito_anonimo('sesion-1', self.usuario)
+        self.assertEqual(resultado.pk, propio.pk)
+        self.assertEqual(self.lineas(propio), {roja.pk: 4, azul.pk: 2})
+        self.assertEqual(CarritoItem.objects.get(carrito=propio, variante=roja).precio_unitario_snapshot, 8)
+        self.assertEqual(resultado.cupon_codigo, 'BIENVENIDA')
+        self.assertFalse(Carrito.objects.get(pk=anonimo.pk).activo)
+        self.assertFalse(ReservaStock.objects.exists())
+        self.assertEqual(fusionar_carrito_anonimo('sesion-1', self.usuario).pk, propio.pk)
+
+    def test_fusion_sin_carrito_propio_adopta_el_anonimo(self):
+        anonimo = self.anonimo({self.variantes[0]: 1})
+        resultado = fusionar_carrito_anonimo('sesion-1', self.usuario)
+        self.assertEqual(
+            (resultado.pk, resultado.usuario_id, resultado.session_id), (anonimo.pk, self.usuario.pk, None),
+        )
+        self.assertTrue(Carrito.objects.get(pk=anonimo.pk).activo)
+        otro = Usuario.objects.create(email='otro@example.com', rol=self.usuario.rol)
+        self.assertIsNone(fusionar_carrito_anonimo('otra-sesion', otro))
+
+    @override_settings(CARRITOS_INACTIVO_DIAS_ANONIMO=7, CARRITOS_INACTIVO_DIAS_USUARIO=30)
+    def test_desactiva_por_umbral_y_suelta_retenciones(self):
+        roja = self.variantes[0]
+        viejo_anonimo = self.anonimo({roja: 1}, fecha_actualizacion=self.hace(8))
+        reciente_anonimo = self.anonimo({roja: 1}, session_id='sesion-2', fecha_actualizacion=self.hace(6))
+        usuario_reciente = crear_carrito(self.usuario, {roja: 1})
+        Carrito.objects.filter(pk=usuario_reciente.pk).update(fecha_actualizacion=self.hace(20))
+        # Nunca actualizado: cuenta desde fecha_creacion
+        usuario_viejo = crear_carrito(self.usuario, {roja: 2})
+        Carrito.objects.filter(pk=usuario_viejo.pk).update(fecha_creacion=self.hace(31))
+        for carrito in (viejo_anonimo, reciente_anonimo, usuario_viejo):
+            reservar_carrito(carrito.pk)
+
+        self.assertEqual(desactivar_inactivos(tamano_lote=1), 2)
+        self.assertEqual(
+            set(Carrito.objects.filter(activo=True).values_list('pk', flat=True)),
+            {reciente_anonimo.pk, usuario_reciente.pk},
+        )
+        self.assertEqual(
+            list(ReservaStock.objects.values_list('carrito_item__carrito_id', flat=True)), [reciente_anonimo.pk],
+        )
+        self.assertEqual(reservas.disponibles([roja.pk]), {roja.pk: 9})
+        # Recién desactivados: la retención de borrado cuenta desde hoy
+        self.assertEqual(purgar_inactivos()['carritos'], 0)
+
+    def test_purga_borra_y_cuenta_por_modelo(self):
+        carrito = crear_carrito(self.usuario, {self.variantes[0]: 1, self.variantes[1]: 2})
+        reservar_carrito(carrito.pk)
+        Carrito.objects.filter(pk=carrito.pk).update(activo=False, fecha_actualizacion=self.hace(60))
+        self.assertEqual(purgar_inactivos(), {'carritos': 1, 'items': 2, 'reservas': 2, 'lotes': 1})
+        self.assertFalse(ReservaStock.objects.exists())
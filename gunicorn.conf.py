@@ -0,0 +1,9 @@
+# Gunicorn carga este archivo automáticamente desde el directorio de trabajo.
+# Solo agrega hooks; el resto de la configuración queda con sus valores por defecto.
+
+
+def worker_exit(server, worker):
+    # Escribe las entradas de auditoría y los accesos que el worker aún tenía en memoria
+    from core.services import accesos, auditoria
+    auditoria.vaciar()
+    accesos.vaciar()